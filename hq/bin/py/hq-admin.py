@@ -13,6 +13,7 @@ import traceback
 import argparse
 import textwrap
 import collections
+import json
 
 # logging
 import logging
@@ -33,6 +34,7 @@ logger.addHandler(consoleLog)
 # import hq libraries
 from hq.lib.hQSocket import hQSocket
 from hq.lib.hQServerDetails import hQServerDetails
+from hq.lib.hQServerProxy import BATCH_SIZE
 
 # get stored host and port from taskdispatcher
 hqDetails = hQServerDetails('hq-server')
@@ -89,18 +91,20 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         prog=PROG,
         formatter_class=argparse.RawDescriptionHelpFormatter,
-        usage="%(prog)s [-h --help] [options] [help] COMMAND",
+        usage="%(prog)s [-h --help] [options] [help] COMMAND | -",
         description='\n'.join( textwrap.wrap("Connect to connect to the hq-server", width=textWidth) +
                                ['\n'] +
                                textwrap.wrap("  host: {}".format(hqHost), width=textWidth) +
                                textwrap.wrap("  port: {}".format(hqPort), width=textWidth) +
                                ['\n'] +
-                               textwrap.wrap("If you want to connect to another server, specify host and port with option -S.", width=textWidth)
+                               textwrap.wrap("If you want to connect to another server, specify host and port with option -S.", width=textWidth) +
+                               ['\n'] +
+                               textwrap.wrap("If COMMAND is -, one command per line is read from stdin. All commands are sent in few batch requests and the responses are printed in the same order.", width=textWidth)
                                ),
         epilog='Written by Hendrik.')
     parser.add_argument('command',
                         metavar = 'COMMAND',
-                        help = "Command which will be sent to the server."
+                        help = "Command which will be sent to the server. - reads commands from stdin."
                         )
     
     parser.add_argument('commandArgs',
@@ -138,6 +142,28 @@ if __name__ == '__main__':
     port = args.serverSettings.port
 
     try:
+        if args.command=="-":
+            # read commands from stdin and send them in batches
+            commands = [ line.strip() for line in sys.stdin if line.strip() ]
+
+            logger.info( "Send {n} commands to {host}:{port}".format( n=len(commands), host=host, port=port ) )
+
+            for idx in xrange( 0, len(commands), BATCH_SIZE ):
+                client = hQSocket( catchErrors = False )
+                client.initSocket( host, port )
+
+                client.send( "batch:{j}".format( j=json.dumps( commands[ idx:idx+BATCH_SIZE ] ) ) )
+
+                for receivedStr in json.loads( client.recv() ):
+                    sys.stdout.write( receivedStr )
+
+                    if receivedStr:
+                        sys.stdout.write("\n")
+
+                client.close()
+
+            sys.exit(0)
+            
         # create socket
         client = hQSocket( catchErrors = False )
 
@@ -74,19 +74,21 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         prog=PROG,
         formatter_class=argparse.RawDescriptionHelpFormatter,
-        usage="%(prog)s [-h --help] [options] [help] COMMAND",
+        usage="%(prog)s [-h --help] [options] [help] COMMAND | -",
         description='\n'.join( textwrap.wrap("Connect to your hq-user-server", width=textWidth) +
                                ['\n'] +
                                textwrap.wrap("  host: {}".format(HQ_US_HOST), width=textWidth) +
                                textwrap.wrap("  port: {}".format(HQ_US_PORT), width=textWidth) +
                                ['\n'] +
-                               textwrap.wrap("and send the COMMAND to it and print response to stdout. If the hq-user-server is not running, a server will be started.")
+                               textwrap.wrap("and send the COMMAND to it and print response to stdout. If the hq-user-server is not running, a server will be started.") +
+                               ['\n'] +
+                               textwrap.wrap("If COMMAND is -, one command per line is read from stdin. All commands are sent in few batch requests over a single connection and the responses are printed in the same order.", width=textWidth)
                                ),
         epilog='Written by Hendrik.')
     
     parser.add_argument('command',
                         metavar = 'COMMAND',
-                        help = "Command which will be sent to the server."
+                        help = "Command which will be sent to the server. - reads commands from stdin."
                         )
     
     parser.add_argument('commandArgs',
@@ -123,6 +125,20 @@ if __name__ == '__main__':
         logger.info( "Connection to {host}:{port}".format( host=proxy.host,
                                                            port=proxy.port ) )
 
+        if args.command=="-":
+            # read commands from stdin and send them in batches
+            commands = [ line.strip() for line in sys.stdin if line.strip() ]
+
+            logger.info( "Send {n} commands".format( n=len(commands) ) )
+
+            for receivedStr in proxy.sendBatch( commands ):
+                sys.stdout.write( receivedStr )
+
+                if receivedStr:
+                    sys.stdout.write("\n")
+
+            sys.exit(0)
+
         command = ' '.join( [args.command] + args.commandArgs )
         
         proxy.send( command )
@@ -36,7 +36,7 @@ logger.addHandler(consoleLog)
 ETCPATH = "{hqpath}/etc".format( hqpath=os.environ['HQPATH'] )
 
 # import hq libraries
-from hq.lib.hQUtils import hQPingHost
+from hq.lib.hQUtils import hQPingHost, read_cluster_table
 
 class ValidateVerboseMode(argparse.Action):
     def __call__(self, parser, namespace, value, option_string=None):
@@ -47,6 +47,37 @@ class ValidateVerboseMode(argparse.Action):
         
         # set attribute self.dest
         setattr(namespace, self.dest, True)
+
+
+def release_legacy_reservations():
+    """give slots of reservations of older versions back to their hosts
+
+    older versions of hq-reservation lowered max_number_occupied_slots of a host by the reserved
+    slots. now, reserved slots are subtracted from the free slots by the job scheduler. the
+    reserved slots of these reservations have no value in column host_slots_lowered. they are
+    added to max_number_occupied_slots again and marked, so that this is done only once.
+
+    **Returns**
+      int: number of released reserved slots entries
+    """
+    from hq.lib.hQDBConnection import hQDBConnection
+    import hq.lib.hQDatabase as db
+
+    con = hQDBConnection( writer=True )
+
+    reservedSlots = con.query( db.ReservedSlots )\
+                    .filter( db.ReservedSlots.host_slots_lowered==None )\
+                    .all()
+
+    for rs in reservedSlots:
+        rs.host.max_number_occupied_slots += rs.slots
+        rs.host_slots_lowered = False
+
+    con.commit()
+    con.remove()
+
+    return len( reservedSlots )
+
         
 if __name__ == '__main__':
     textWidth = 80
@@ -63,6 +94,20 @@ if __name__ == '__main__':
                         help = 'Create all tables in database.'
                         )
 
+    parser.add_argument('-M', '--add-columns',
+                        dest = 'addColumns',
+                        action = 'store_true',
+                        default = False,
+                        help = 'Add missing columns to the tables of an existing database and give reserved slots of older versions back to their hosts.'
+                        )
+
+    parser.add_argument('-I', '--create-indexes',
+                        dest = 'createIndexes',
+                        action = 'store_true',
+                        default = False,
+                        help = 'Add missing columns and create missing indexes in an existing database.'
+                        )
+
     parser.add_argument('-D', '--drop-tables',
                         dest = 'dropTables',
                         action = 'store_true',
@@ -109,21 +154,13 @@ if __name__ == '__main__':
         sys.exit( -1 )
 
     if args.showDatabaseConfig:
-        databaseDialect = config.get( 'DATABASE', 'database_dialect' )
-        databaseHost = config.get( 'DATABASE', 'database_host' )
-        databasePort = config.get( 'DATABASE', 'database_port' )
-        databaseName = config.get( 'DATABASE', 'database_name' )
-        databaseUsername = config.get( 'DATABASE', 'database_username' )
-        databasePassword = config.get( 'DATABASE', 'database_password' )
-
         print "Database configuration:"
         print
-        print "{k:>20} : {v}".format( k='database_dialect', v=databaseDialect )
-        print "{k:>20} : {v}".format( k='database_host', v=databaseHost )
-        print "{k:>20} : {v}".format( k='database_port', v=databasePort )
-        print "{k:>20} : {v}".format( k='database_name', v=databaseName )
-        print "{k:>20} : {v}".format( k='database_username', v=databaseUsername )
-        print "{k:>20} : {v}".format( k='database_password', v=databasePassword )
+
+        # host, port, username and password are not needed for sqlite
+        for option in [ 'database_dialect', 'database_host', 'database_port', 'database_name', 'database_username', 'database_password' ]:
+            if config.has_option( 'DATABASE', option ):
+                print "{k:>20} : {v}".format( k=option, v=config.get( 'DATABASE', option ) )
 
     elif args.createTables:
         # This will not re-create tables that already exist.
@@ -136,6 +173,45 @@ if __name__ == '__main__':
         
         logger.info( "done." )
 
+    elif args.addColumns:
+        # Columns are added to existing tables. Tables are not created.
+
+        logger.info( "Add missing columns to tables in database" )
+
+        import hq.lib.hQDBSessionRegistry as dbSessionReg
+        added = dbSessionReg.create_missing_columns( dbSessionReg.get_engine(echo=True) )
+
+        for columnName in added:
+            logger.info( "Added column {c}".format( c=columnName ) )
+
+        # reservations of older versions lowered the slots of hosts
+        released = release_legacy_reservations()
+
+        logger.info( "Released {n} reserved slots entries of older versions.".format( n=released ) )
+        
+        logger.info( "done. {n} columns have been added.".format( n=len(added) ) )
+
+    elif args.createIndexes:
+        # Indexes are added to existing tables. Tables are not created. Indexes may refer to
+        # columns which are missing, so that these are added first.
+
+        logger.info( "Create missing indexes in database" )
+
+        import hq.lib.hQDBSessionRegistry as dbSessionReg
+        e = dbSessionReg.get_engine(echo=True)
+        
+        for columnName in dbSessionReg.create_missing_columns( e ):
+            logger.info( "Added column {c}".format( c=columnName ) )
+
+        release_legacy_reservations()
+
+        created = dbSessionReg.create_missing_indexes( e )
+
+        for indexName in created:
+            logger.info( "Created index {i}".format( i=indexName ) )
+        
+        logger.info( "done. {n} indexes have been created.".format( n=len(created) ) )
+
     elif args.dropTables:
         # This will really drop all tables including their contents.
 
@@ -211,7 +287,7 @@ if __name__ == '__main__':
 
 
         # fill JobStatus table
-        js = [ 'waiting', 'pending', 'running', 'finished' ]
+        js = [ 'waiting', 'pending', 'running', 'finished', 'blocked', 'cancelled' ]
         for jobStatus in js:
             try:
                 con.query( db.JobStatus ).filter( db.JobStatus.name==jobStatus ).one()
@@ -224,70 +300,47 @@ if __name__ == '__main__':
         con.commit()
 
 
+        # create counters of jobs for each user and job status
+        from hq.lib.hQJobStatusCounter import rebuild_job_counters
+
+        rebuild_job_counters( con )
+        con.commit()
+
+
         # read cluster table
         try:
             tableFileName = '{etcpath}/cluster.tab'.format(etcpath=ETCPATH)
             
             if os.path.exists( tableFileName ):
-                with open( tableFileName ) as f:
-                    # skip first line
-                    f.readline()
-
-                    # iterate over all lines
-                    for line in f:
-                        line = line.strip("\n")
-                        lineSplitted = line.split("\t")
-
-                        if len(line)>0 and len(lineSplitted)==8:
-                            defaultSettings = { 'full_name': '',
-                                                'short_name': '',
-                                                'total_number_slots': 0,
-                                                'max_number_occupied_slots': 0,
-                                                'additional_info': '',
-                                                'allow_info_server': False,
-                                                'info_server_port': 0 }
-                            defaultStatus = { 'active': False }
-                            
-                            # columns: short_name, full_name, total_number_slots, max_number_occupied_slots, additional_info, allow_info_server, info_server_port, active
-                            settings = dict( filter( lambda s: s[1]!="", zip( ["short_name",
-                                                                               "full_name",
-                                                                               "total_number_slots",
-                                                                               "max_number_occupied_slots",
-                                                                               "additional_info",
-                                                                               "allow_info_server",
-                                                                               "info_server_port",
-                                                                               "active"], lineSplitted ) ) )
-
-                            # get host setting using dict comprehension, prefer settings from settings file
-                            # automatically cast value to type of value given in defaultSettings
-                            hostSettings = { key: type(defaultValue)(settings.get(key, defaultValue)) for key,defaultValue in defaultSettings.iteritems() }
-                            hostStatus = { key: type(defaultValue)(settings.get(key, defaultValue)) for key,defaultValue in defaultStatus.iteritems() }
-
-                            # add entry in database if not already present
-                            try:
-                                con.query( db.Host ).filter( db.Host.full_name==hostSettings['full_name'] ).one()
-                            except NoResultFound:
-                                logger.info( "Add Host {name} to cluster".format(name=hostSettings['short_name'] ) )
-
-                                # create entry in database
-                                host = db.Host( **hostSettings )
-
-                                ph = hQPingHost( hostSettings['full_name'] )
-                                ph.start()
-                                ph.join()
-
-                                reachable = False
-                                if ph.status[1]>0:	# ph.status: (transmitted,received)
-                                     # successful ping
-                                     reachable = True
-
-
-                                # create HostSummaryInstance
-                                hostSummary = db.HostSummary( host=host,
-                                                              available=hostStatus['active'],
-                                                              reachable=reachable )
-
-                                con.introduce( host, hostSummary )
+                for hostSettings,hostStatus in read_cluster_table( tableFileName ):
+                    # add entry in database if not already present
+                    try:
+                        host = con.query( db.Host ).filter( db.Host.full_name==hostSettings['full_name'] ).one()
+
+                        # update memory of already present host
+                        host.total_memory = hostSettings['total_memory']
+                    except NoResultFound:
+                        logger.info( "Add Host {name} to cluster".format(name=hostSettings['short_name'] ) )
+
+                        # create entry in database
+                        host = db.Host( **hostSettings )
+
+                        ph = hQPingHost( hostSettings['full_name'] )
+                        ph.start()
+                        ph.join()
+
+                        reachable = False
+                        if ph.status[1]>0:	# ph.status: (transmitted,received)
+                             # successful ping
+                             reachable = True
+
+
+                        # create HostSummaryInstance
+                        hostSummary = db.HostSummary( host=host,
+                                                      available=hostStatus['active'],
+                                                      reachable=reachable )
+
+                        con.introduce( host, hostSummary )
                 con.commit()
 
         except:
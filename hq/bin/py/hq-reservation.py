@@ -108,7 +108,7 @@ if __name__ == '__main__':
     logger.info( "Welcome to {p}!".format(p=PROGNAME) )
 
     if args.showReservations:
-        con = hQDBConnection()
+        con = hQDBConnection( writer=True )
 
         reservations = con.query( db.Reservation ).all()
 
@@ -126,45 +126,48 @@ if __name__ == '__main__':
         #    q['answer']  = raw_input( q['question'] )
 
         con = hQDBConnection()
-        
-        reservation_codes = set(con.query( db.Reservation.code ).all())
-        
-        while True:
-            new_reservation_code = hex(random.getrandbits(32))[2:-1].upper()
-            if new_reservation_code not in reservation_codes:
-                break
 
-        new_reservation = db.Reservation( code = new_reservation_code )
-        con.introduce(new_reservation)
-        
-        
-        hosts = con.query( db.Host )\
+        hosts = con.query( db.Host.id, db.Host.full_name, db.Host.max_number_occupied_slots )\
                 .join( db.HostSummary )\
                 .filter( and_(db.HostSummary.available==True,
                               db.HostSummary.reachable==True,
                               db.HostSummary.active==True
-                              ) )
+                              ) )\
+                .all()
+
+        # end transaction. the database is not locked while waiting for input
+        con.commit()
 
         reserve_slots = {}
         print "Specify for each host the number of slots which will be reserved (default 0)"
-        for host in hosts:
-            reserve_slots[ host.id ] = raw_input( "  {h} [max: {m}]: ".format(h=host.full_name,m=host.max_number_occupied_slots ) )
+        for hostID,hostName,maxSlots in hosts:
+            reserve_slots[ hostID ] = raw_input( "  {h} [max: {m}]: ".format(h=hostName,m=maxSlots ) )
             try:
-                reserve_slots[ host.id ] = int( reserve_slots[ host.id ] )
-                if reserve_slots[ host.id ] > host.max_number_occupied_slots:
-                    reserve_slots[ host.id ] = host.max_number_occupied_slots
+                reserve_slots[ hostID ] = int( reserve_slots[ hostID ] )
+                if reserve_slots[ hostID ] > maxSlots:
+                    reserve_slots[ hostID ] = maxSlots
+            except:
+                reserve_slots[ hostID ] = 0
 
-                if reserve_slots[ host.id ]>0:
-                    new_reserved_slots = db.ReservedSlots( reservation=new_reservation,
-                                                           slots = reserve_slots[ host.id ],
-                                                           host = host )
-                    con.introduce( new_reserved_slots )
+        con = hQDBConnection( writer=True )
+        
+        reservation_codes = set( code for code, in con.query( db.Reservation.code ).all() )
+        
+        while True:
+            new_reservation_code = hex(random.getrandbits(32))[2:-1].upper()
+            if new_reservation_code not in reservation_codes:
+                break
 
-                    host.max_number_occupied_slots -= reserve_slots[ host.id ]
-                    
-            except:
-                reserve_slots[ host.id ] = 0
+        new_reservation = db.Reservation( code = new_reservation_code )
+        con.introduce(new_reservation)
 
+        for hostID,slots in reserve_slots.iteritems():
+            if slots>0:
+                new_reserved_slots = db.ReservedSlots( reservation=new_reservation,
+                                                       slots = slots,
+                                                       host_id = hostID,
+                                                       host_slots_lowered = False )
+                con.introduce( new_reserved_slots )
         
         con.commit()
 
@@ -176,7 +179,7 @@ if __name__ == '__main__':
 
     elif args.deleteReservation:
         # how to do it more effciently?
-        con = hQDBConnection()
+        con = hQDBConnection( writer=True )
 
         reservations = con.query( db.Reservation ).filter( db.Reservation.code==args.deleteReservation )
 
@@ -186,12 +189,19 @@ if __name__ == '__main__':
                             .filter( db.ReservedSlots.reservation==reservation )\
                             .all()
 
-            # update max_number_occupied_slots for each host and delete ReservedSlots entry
+            # delete ReservedSlots entry. reserved slots are subtracted from the free slots of a
+            # host by the job scheduler. older versions lowered max_number_occupied_slots of the
+            # host instead (see hq-dbadmin --add-columns)
             for rs in reservedSlots:
-                rs.host.max_number_occupied_slots += rs.slots
+                if rs.host_slots_lowered is not False:
+                    rs.host.max_number_occupied_slots += rs.slots
 
                 con.delete( rs )
 
+            # jobs of this reservation may run in any slot
+            con.query( db.Job )\
+               .filter( db.Job.reservation_id==reservation.id )\
+               .update( { db.Job.reservation_id: None }, synchronize_session=False )
             
         # delete Reservation
         d = con.query( db.Reservation )\
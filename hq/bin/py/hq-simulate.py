@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# hq/bin/py/hq-simulate - simulate the job scheduler offline
+#
+
+PROGNAME = "hq-simulate"
+
+import sys
+import os
+import argparse
+import traceback
+
+
+# logging
+import logging
+logger = logging.getLogger(__name__)
+logger.propagate = False
+logger.setLevel(logging.ERROR)			# logger level. can be changed with command line option -v
+
+formatter = logging.Formatter('[%(asctime)-15s] %(message)s')
+
+# create console handler and configure
+consoleLog = logging.StreamHandler(sys.stdout)
+consoleLog.setLevel(logging.INFO)		# handler level.
+consoleLog.setFormatter(formatter)
+
+# add handler to logger
+logger.addHandler(consoleLog)
+
+# path to config files
+ETCPATH = "{hqpath}/etc".format( hqpath=os.environ['HQPATH'] )
+
+# import hq libraries
+from hq.lib.hQUtils import read_cluster_table
+from hq.lib.hQSimulator import hQSimulator, read_trace, generate_trace
+from hq.lib.hQJobSchedulerSimple import PLACEMENT_POLICIES
+
+
+class ValidateVerboseMode(argparse.Action):
+    def __call__(self, parser, namespace, value, option_string=None):
+        # set level of logger to INFO
+        logger.setLevel( logging.INFO )
+
+        # set attribute self.dest
+        setattr(namespace, self.dest, True)
+
+
+def print_report( name, report ):
+    print "{t:>20} : {v}".format( t='scheduler', v=name )
+    print "{t:>20} : {v}".format( t='jobs', v=report['jobs'] )
+    print "{t:>20} : {v}".format( t='unplaceable', v=report['unplaceable'] )
+    print "{t:>20} : {v}".format( t='never started', v=report['unfinished'] )
+    print "{t:>20} : {v:.1f} s".format( t='makespan', v=report['makespan'] )
+    print "{t:>20} : {v:.1f} s".format( t='mean wait', v=report['mean_wait'] )
+    print "{t:>20} : {v:.1f} %".format( t='utilization', v=100*report['utilization'] )
+    print "{t:>20} : {v}".format( t='scheduling rounds', v=report['rounds'] )
+    print "{t:>20} : {m:.2f} ms (max {x:.2f} ms)".format( t='round latency', m=report['mean_round_latency'], x=report['max_round_latency'] )
+    print
+
+
+if __name__ == '__main__':
+    textWidth = 80
+    parser = argparse.ArgumentParser(
+        prog=PROGNAME,
+        usage="%(prog)s [-h --help] [options]",
+        description="Replay a job trace on a cluster with the job scheduler against a local SQLite database and report makespan, mean wait, utilization and scheduling-round latency.",
+        epilog='Written by Hendrik.' )
+
+    parser.add_argument('-b', '--backfill',
+                        dest = 'backfill',
+                        action = 'store_true',
+                        default = None,
+                        help = 'Use backfilling. Default: as configured in hq.cfg.'
+                        )
+
+    parser.add_argument('-c', '--cluster-table',
+                        metavar = 'FILE',
+                        dest = 'clusterTable',
+                        default = '{etcpath}/cluster.tab'.format( etcpath=ETCPATH ),
+                        help = 'Hosts in cluster.tab format. Default: etc/cluster.tab.'
+                        )
+
+    parser.add_argument('-d', '--database-file',
+                        metavar = 'FILE',
+                        dest = 'databaseFile',
+                        default = None,
+                        help = 'Use this SQLite database file. Default: in-memory database.'
+                        )
+
+    parser.add_argument('-f', '--fairshare',
+                        dest = 'fairshare',
+                        action = 'store_true',
+                        default = None,
+                        help = 'Use fair-share priorities. Default: as configured in hq.cfg.'
+                        )
+
+    parser.add_argument('-n', '--number-jobs',
+                        metavar = 'N',
+                        dest = 'numJobs',
+                        type = int,
+                        default = 1000,
+                        help = 'Number of jobs in synthetic trace. Default: 1000.'
+                        )
+
+    parser.add_argument('-p', '--placement-policy',
+                        metavar = 'POLICY',
+                        dest = 'placementPolicies',
+                        action = 'append',
+                        choices = PLACEMENT_POLICIES + [ 'all' ],
+                        default = [],
+                        help = 'Placement policy ({p} or all). Can be given several times in order to compare policies. Default: as configured in hq.cfg.'.format( p=', '.join( PLACEMENT_POLICIES ) )
+                        )
+
+    parser.add_argument('-s', '--seed',
+                        dest = 'seed',
+                        type = int,
+                        default = 0,
+                        help = 'Seed for synthetic trace. Default: 0.'
+                        )
+
+    parser.add_argument('-t', '--trace',
+                        metavar = 'FILE',
+                        dest = 'traceFile',
+                        default = "",
+                        help = 'Tab delimited job trace with columns submit time (s), slots, run time (s), user[, estimated time (min)[, estimated memory (MB)]]. A synthetic trace is generated if not given.'
+                        )
+
+    parser.add_argument('-u', '--number-users',
+                        metavar = 'N',
+                        dest = 'numUsers',
+                        type = int,
+                        default = 4,
+                        help = 'Number of users in synthetic trace. Default: 4.'
+                        )
+
+    parser.add_argument('-v', '--verbose-mode',
+                        nargs = 0,
+                        dest = 'verboseMode',
+                        action = ValidateVerboseMode,
+                        default = False,
+                        help = 'Activate verbose mode.'
+                        )
+
+    args = parser.parse_args()
+
+    logger.info( "Welcome to {p}!".format(p=PROGNAME) )
+
+    hosts = read_cluster_table( args.clusterTable )
+    logger.info( "read {n} hosts from {f}".format( n=len(hosts), f=args.clusterTable ) )
+
+    if args.traceFile:
+        trace = read_trace( args.traceFile )
+    else:
+        maxSlots = max( [ h[0]['max_number_occupied_slots'] for h in hosts ] or [1] )
+        trace = generate_trace( args.numJobs,
+                                numUsers=args.numUsers,
+                                maxSlots=min( maxSlots, 4 ),
+                                seed=args.seed )
+    logger.info( "replay {n} jobs".format( n=len(trace) ) )
+
+    if 'all' in args.placementPolicies:
+        placementPolicies = PLACEMENT_POLICIES
+    else:
+        placementPolicies = args.placementPolicies or [ None ]
+
+    for placementPolicy in placementPolicies:
+        try:
+            simulator = hQSimulator( hosts,
+                                     trace,
+                                     placementPolicy=placementPolicy,
+                                     backfill=args.backfill,
+                                     fairshare=args.fairshare,
+                                     databaseFile=args.databaseFile )
+            report = simulator.run()
+
+            print_report( placementPolicy or 'default', report )
+        except:
+            traceback.print_exc(file=sys.stdout)
+
+    logger.info( "Thank you for using {p}!".format( p=PROGNAME ) )
@@ -40,7 +40,7 @@ logger.addHandler(consoleLog)
 HOMEDIR = os.environ['HOME']
 
 # import hq libraries
-from hq.lib.hQUtils import SmartFormatter
+from hq.lib.hQUtils import SmartFormatter, iter_ndjson_batches
 from hq.lib.hQSocket import hQSocket
 from hq.lib.hQServerProxy import hQServerProxy
 from hq.lib.hQServerDetails import hQServerDetails
@@ -51,6 +51,64 @@ hqUserServerDetails = hQServerDetails('hq-user-server')
 HOST = hqUserServerDetails.get('host', None)
 PORT = hqUserServerDetails.get('port', None)
 
+# number of jobs which are sent in a single message of a job stream
+STREAM_BATCH_SIZE = 1000
+
+
+def read_jobs_file( fileName, defaultValues ):
+    """ read jobs from file lazily
+
+    each line is tab-delimited with one or more properties PROPERTY::VALUE. '{idx}' in values is
+    replaced by the line number.
+
+    @param fileName (string) path to file
+    @param defaultValues (dict) default properties of a job
+
+    @return (generator) jobs given as dict
+    """
+    with open(fileName,'r') as f:
+        # known job properties
+        properties = [ "command" ] + defaultValues.keys()
+
+        # construct regular expressions
+        reProperties = { prop: re.compile( "^{prop}::(.*)$".format(prop=prop) ) for prop in properties }
+
+        # iterate over all lines in file
+        for idx,line in enumerate(f):
+            line = line.strip('\n')
+
+            try:
+                # neglect lines with a leading '#' and empty lines
+                if line and (line[0] == '#' or line==""): continue
+
+                # parse line
+                lineSplitted = line.split( '\t' )
+
+                jobDetails = copy( defaultValues )
+                for entry in lineSplitted:
+
+                    # get matching property for each entry
+                    try:
+                        propertyName = next( propName for propName, reProp in reProperties.iteritems() if reProp.match( entry ) )
+                        propertyValue, = reProperties[propertyName].match( entry ).groups( 1 )
+
+                        # replace '{idx}' by idx
+                        propertyValue = propertyValue.format( idx=idx )
+
+                        jobDetails[ propertyName ] = propertyValue
+                    except StopIteration:
+                        pass
+
+                # at least command has to be specified
+                if jobDetails['command']:
+                    yield jobDetails
+
+            except:
+                # read next row
+                traceback.print_exc(file=sys.stdout)
+                continue
+
+
 
 if __name__ == '__main__':
     loginShell = os.environ['SHELL'].split('/')[-1]
@@ -63,9 +121,12 @@ if __name__ == '__main__':
                       "stderr": "",
                       "shell": loginShell,
                       "priority": 0,
-                      "estimatedTime": 1,
+                      "estimatedTime": 0,
                       "estimatedMemory": 10,
-                      "excludedHosts": "" }
+                      "excludedHosts": "",
+                      "reservation": "",
+                      "dependencies": "",
+                      "array": "" }
 
     helpJobsFile  = []
     helpJobsFile += ["**File in which a command line job and respective additional info are given in each line. Each line is tab-delimited with one or more properties"]
@@ -87,12 +148,22 @@ if __name__ == '__main__':
                         nargs = '*',
                         metavar = 'COMMAND',
                         help = "Command which will be executed in the cluster." )    
+    parser.add_argument("-a", "--array",
+                        metavar = "FIRST-LAST",
+                        dest = "array",
+                        default = defaultValues['array'],
+                        help = "Submit a job array with one task for each index between FIRST and LAST. Each occurrence of {idx} in the command, the info text, stdout, stderr and the logfile is replaced by the index of the task, e.g., -a 1-100 'run.sh input.{idx}'." )
     parser.add_argument("-c", "--slots",
                         metavar = "SLOTS",
                         dest = "slots",
                         type = int,
                         default = defaultValues['slots'],
                         help = "Number cores on a host which will be used for this job." )
+    parser.add_argument("-d", "--dependencies",
+                        metavar = "TYPE:ID[:ID...][,TYPE:ID...]",
+                        dest = "dependencies",
+                        default = defaultValues['dependencies'],
+                        help = "Start job only after other jobs have been finished. TYPE is afterok (jobs have to be finished successfully, otherwise this job is cancelled) or afterany (jobs have been finished or cancelled), e.g., afterok:12:13,afterany:14." )
     parser.add_argument("-E", "--excludeHosts",
                         metavar = "HOST[,HOST,...]",
                         dest = "excludedHosts",
@@ -135,6 +206,11 @@ if __name__ == '__main__':
                        dest = "priority",
                        default = defaultValues['priority'],
                        help = "Set priority of job. Higher values indicate higher priority. Max priority is 127.")
+    parser.add_argument("-r", "--reservation",
+                       metavar = "CODE",
+                       dest = "reservation",
+                       default = defaultValues['reservation'],
+                       help = "Run job only in the slots of the reservation with the given code. Consider hq-reservation -s for active reservations.")
     parser.add_argument("-q", "--quiet",
                        action="store_true",
                        dest="quiet",
@@ -153,7 +229,7 @@ if __name__ == '__main__':
     parser.add_argument("-t", "--estimatedTime",
                        dest = "estimatedTime",
                        default = defaultValues['estimatedTime'],
-                       help = "Specify estimated run time of job")
+                       help = "Specify estimated run time of job in minutes. It is used for backfilling idle slots. Default: unknown.")
     parser.add_argument("-v", "--verbose",
                        action = "store_true",
                        dest = "verboseMode",
@@ -183,70 +259,16 @@ if __name__ == '__main__':
         sys.exit(-1)
 
     requests = []
+    jobStream = None
     
     # assembl requests
     if args.showStatus:
         requests = ['status']
     else:
         if args.jobsFile:
-            # send several jobs at once
-            jsonObj = {}
-
-            with open(args.jobsFile,'r') as f:
-                jobs = []
-                
-                # known job properties
-                properties = [ "command" ] + defaultValues.keys()
-                
-                # construct regular expressions
-                reProperties = { prop: re.compile( "^{prop}::(.*)$".format(prop=prop) ) for prop in properties }
-
-                # iterate over all lines in file. add only 100 jobs at once
-                for idx,line in enumerate(f):
-                    line = line.strip('\n')
-                    
-                    try:
-                        # neglect lines with a leading '#' and empty lines
-                        if line and (line[0] == '#' or line==""): continue
-                        
-                        # parse line
-                        lineSplitted = line.split( '\t' )
-
-                        jobDetails = copy( defaultValues )
-                        for entry in lineSplitted:
-                            
-                            # get matching property for each entry
-                            try:
-                                propertyName = next( propName for propName, reProp in reProperties.iteritems() if reProp.match( entry ) )
-                                propertyValue, = reProperties[propertyName].match( entry ).groups( 1 )
-                                
-                                # replace '{idx}' by idx
-                                propertyValue = propertyValue.format( idx=idx )
-                                
-                                jobDetails[ propertyName ] = propertyValue
-                            except StopIteration:
-                                pass
-
-                        # at least command has to be specified
-                        if jobDetails['command']:
-                            jobs.append( jobDetails )
-                                
-                    except:
-                        # read next row
-                        traceback.print_exc(file=sys.stdout)
-                        continue
-                    
-                    # add maximal 100 jobs in a single request
-                    if idx>0 and idx % 99 == 0:
-                        # add jobs
-                        jsonObj = json.dumps( jobs )
-                        requests.append( 'addjobs:%s' % jsonObj )
-                        jobs = []
-
-            if jobs:
-                jsonObj = json.dumps( jobs )
-                requests.append( 'addjobs:%s' % jsonObj )
-
+            # stream jobs in batches over a single connection
+            jobStream = iter_ndjson_batches( read_jobs_file( args.jobsFile, defaultValues ),
+                                             STREAM_BATCH_SIZE )
         else:
             # send a single job
             jsonObj = {'command': args.command,
@@ -260,7 +282,10 @@ if __name__ == '__main__':
                        'priority': args.priority,
                        'estimatedTime': args.estimatedTime,
                        'estimatedMemory': args.estimatedMemory,
-                       'excludedHosts': args.excludedHosts
+                       'excludedHosts': args.excludedHosts,
+                       'reservation': args.reservation,
+                       'dependencies': args.dependencies,
+                       'array': args.array
                        }
 
             jsonObj = json.dumps(jsonObj)
@@ -269,6 +294,12 @@ if __name__ == '__main__':
 
     #send commands to server
     try:
+        if jobStream:
+            for recv in hqUserServer.sendStream( 'addjobstream', jobStream ):
+                # print ids of added jobs
+                if not args.quiet:
+                    print recv
+            
         for i,job in enumerate(requests):
             try:
                 hqUserServer.send(job)
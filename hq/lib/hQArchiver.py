@@ -0,0 +1,188 @@
+"""archival of finished jobs into the archive tables
+
+Jobs which have been finished or cancelled more than ``archive_after_days`` days ago are moved
+from the tables ``job``, ``job_details`` and ``job_history`` into the append-only tables
+``archived_job`` and ``archived_job_history`` (:class:`hq.lib.hQDatabase.ArchivedJob`,
+:class:`hq.lib.hQDatabase.ArchivedJobHistory`). Thereby the tables of jobs hold only the jobs
+which are worked on and recently finished jobs.
+
+Jobs are moved in chunks of ``archive_batch_size`` jobs. Each chunk is moved in its own short
+transaction, so that the archiver never holds locks for long. The options are read from section
+``SERVER`` of :file:`etc/hq.cfg`.
+
+Finished jobs which have not been processed by hq-server yet and jobs on which other jobs still
+depend are not archived.
+"""
+
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import and_, not_, exists, func, select
+
+# import hq libraries
+from hq.lib.hQJobStatusCounter import hQJobStatusCounter
+import hq.lib.hQDatabase as db
+
+
+# default number of days after which finished jobs are archived
+ARCHIVE_AFTER_DAYS = 30
+
+# default number of jobs which are archived in a single transaction
+ARCHIVE_BATCH_SIZE = 500
+
+# columns which are copied from job and job_details into archived_job
+JOB_COLUMNS = [ 'id', 'user_id', 'command', 'info_text', 'group', 'shell', 'stdout', 'stderr', 'logfile',
+                'excluded_hosts', 'slots', 'priority_id', 'estimated_time', 'estimated_memory',
+                'reservation_id', 'array_id', 'array_idx', 'submission_id' ]
+JOB_DETAILS_COLUMNS = [ 'job_status_id', 'host_id', 'pid', 'return_code' ]
+
+# columns which are copied from job_history into archived_job_history
+JOB_HISTORY_COLUMNS = [ 'job_id', 'datetime', 'job_status_id', 'checked' ]
+
+
+class hQArchiver( object ):
+    """move finished jobs into the archive tables in chunks
+
+    **Args**
+      | archiveAfterDays (float): archive jobs which have been finished more than archiveAfterDays days ago
+      | batchSize (int): number of jobs which are archived in a single transaction
+      | pause (float): seconds to wait between two chunks, so that other transactions get the tables
+    """
+    def __init__( self, archiveAfterDays=ARCHIVE_AFTER_DAYS, batchSize=ARCHIVE_BATCH_SIZE, pause=0.1 ):
+        self.archiveAfterDays = archiveAfterDays
+        self.batchSize = batchSize
+        self.pause = pause
+
+        # {<JobStatus.name>: <JobStatus.id>, ...}
+        self.database_ids = None
+
+
+    def archive( self, dbconnection, now=None, stopEvent=None, logFct=None ):
+        """archive all jobs which have been finished before the archival period
+
+        **Args**
+          | dbconnection (hQDBConnection): connection to database
+          | now (datetime): current time. default: datetime.now()
+          | stopEvent (threading.Event): stop after the current chunk if event is set
+          | logFct (function): function for logging
+
+        **Returns**
+          int: number of archived jobs
+        """
+        if not now:
+            now = datetime.now()
+
+        if not self.database_ids:
+            self.database_ids = dict( dbconnection.query( db.JobStatus.name, db.JobStatus.id ).all() )
+
+        before = now - timedelta( days=self.archiveAfterDays )
+
+        # the job with the largest id is kept, so that the ids of archived jobs are not reused by
+        # databases which derive the next id from the largest id in the table
+        maxJobID = dbconnection.query( func.max( db.Job.id ) ).scalar() or 0
+
+        numArchived = 0
+        lastJobID = 0
+        while not (stopEvent and stopEvent.is_set()):
+            jobIDs = self.next_chunk( dbconnection, before, lastJobID, maxJobID )
+
+            if not jobIDs:
+                break
+
+            self.archive_jobs( dbconnection, jobIDs )
+            dbconnection.commit()
+
+            numArchived += len( jobIDs )
+            lastJobID = jobIDs[-1]
+
+            if logFct:
+                logFct( "archived {n} jobs up to job {j}".format( n=len(jobIDs), j=lastJobID ),
+                        logCategory='debug' )
+
+            if len( jobIDs )<self.batchSize:
+                break
+
+            time.sleep( self.pause )
+
+        return numArchived
+
+
+    def next_chunk( self, dbconnection, before, lastJobID=0, maxJobID=None ):
+        """get ids of the next jobs which will be archived
+
+        **Args**
+          | dbconnection (hQDBConnection): connection to database
+          | before (datetime): jobs which have been finished or cancelled before are archived
+          | lastJobID (int): only jobs with larger ids are considered
+          | maxJobID (int): only jobs with smaller ids are considered
+
+        **Returns**
+          list: ids of at most :attr:`batchSize` jobs in ascending order
+        """
+        doneIDs = [ self.database_ids[ s ] for s in ('finished','cancelled') if s in self.database_ids ]
+
+        # the latest history entry of the current status tells when the job has been finished
+        query = dbconnection.query( db.JobDetails.job_id )\
+                .join( db.JobHistory, and_( db.JobHistory.job_id==db.JobDetails.job_id,
+                                            db.JobHistory.job_status_id==db.JobDetails.job_status_id ) )\
+                .filter( and_( db.JobDetails.job_id>lastJobID,
+                               db.JobDetails.job_status_id.in_( doneIDs ),
+                               not_( exists().where( db.FinishedJob.job_id==db.JobDetails.job_id ) ),
+                               not_( exists().where( db.JobDependency.required_job_id==db.JobDetails.job_id ) ) ) )\
+                .group_by( db.JobDetails.job_id )\
+                .having( func.max( db.JobHistory.datetime )<before )
+
+        if maxJobID is not None:
+            query = query.filter( db.JobDetails.job_id<maxJobID )
+
+        jobIDs = query.order_by( db.JobDetails.job_id )\
+                 .limit( self.batchSize )\
+                 .all()
+
+        return [ jobID for jobID, in jobIDs ]
+
+
+    def archive_jobs( self, dbconnection, jobIDs ):
+        """copy jobs into the archive tables and delete them from the tables of jobs
+
+        The rows are copied with ``INSERT ... SELECT`` statements. The transaction is not committed.
+
+        **Args**
+          | dbconnection (hQDBConnection): connection to database
+          | jobIDs (list): ids of finished or cancelled jobs
+        """
+        jobTable = db.Job.__table__
+        jobDetailsTable = db.JobDetails.__table__
+        jobHistoryTable = db.JobHistory.__table__
+
+        # jobs are no longer counted
+        jobStatusCounter = hQJobStatusCounter()
+        for userID,jobStatusID,number in dbconnection.query( db.Job.user_id,
+                                                              db.JobDetails.job_status_id,
+                                                              func.count('*') )\
+                                          .join( db.JobDetails, db.JobDetails.job_id==db.Job.id )\
+                                          .filter( db.Job.id.in_( jobIDs ) )\
+                                          .group_by( db.Job.user_id, db.JobDetails.job_status_id )\
+                                          .all():
+            jobStatusCounter.add( userID, jobStatusID, -number )
+
+        jobs = select( [ jobTable.c[ c ] for c in JOB_COLUMNS ] + [ jobDetailsTable.c[ c ] for c in JOB_DETAILS_COLUMNS ] )\
+               .select_from( jobTable.join( jobDetailsTable, jobDetailsTable.c.job_id==jobTable.c.id ) )\
+               .where( jobTable.c.id.in_( jobIDs ) )
+
+        history = select( [ jobHistoryTable.c[ c ] for c in JOB_HISTORY_COLUMNS ] )\
+                  .where( jobHistoryTable.c.job_id.in_( jobIDs ) )\
+                  .order_by( jobHistoryTable.c.id )
+
+        dbconnection.session.execute( db.ArchivedJob.__table__.insert().from_select( JOB_COLUMNS + JOB_DETAILS_COLUMNS, jobs ) )
+        dbconnection.session.execute( db.ArchivedJobHistory.__table__.insert().from_select( JOB_HISTORY_COLUMNS, history ) )
+
+        # rows which refer to the jobs are deleted first
+        for table,column in [ (db.JobDependency, db.JobDependency.job_id),
+                              (db.JobHistory, db.JobHistory.job_id),
+                              (db.JobDetails, db.JobDetails.job_id),
+                              (db.Job, db.Job.id) ]:
+            dbconnection.query( table )\
+              .filter( column.in_( jobIDs ) )\
+              .delete( synchronize_session=False )
+
+        jobStatusCounter.save( dbconnection )
@@ -8,13 +8,17 @@ import ConfigParser
 import SocketServer
 import traceback
 import re
+import socket
 
 ### import hq libraries
 from hq.lib.hQSocket import hQSocket
 from hq.lib.hQCommand import hQCommand
+from hq.lib.hQCodec import get_codec
 from hq.lib.hQLogger import hQLogger, wrapLogger
 from hq.lib.hQDBConnection import hQDBConnection
 from hq.lib.hQServerDetails import hQServerDetails
+from hq.lib.hQWorkerPool import hQWorkerPool
+from hq.lib.hQEventLoop import hQEventLoop
 from hq.lib.daemon import Daemon
 import hq.lib.hQUtils as hQUtils
 import hq.lib.hQDatabase as db
@@ -24,6 +28,29 @@ ETCPATH = "{hqpath}/etc".format( hqpath=os.environ['HQPATH'] )
 
 PRINT_STATUS_COUNTER=10
 SERVER_TIMEOUT=3
+# persistent connections are closed after being idle for KEEPALIVE_TIMEOUT seconds
+KEEPALIVE_TIMEOUT=60
+# default max number of persistent connections of the threading core. each of them occupies a
+# worker as long as it is open
+MAX_KEEPALIVE=16
+# response to ``keepalive`` if no further persistent connection is accepted
+KEEPALIVE_REFUSED="busy"
+# default max number of requests which wait for a worker
+WORKER_QUEUE_SIZE=1024
+# response to requests which are rejected because all workers are busy and the queue is full
+OVERLOAD_RESPONSE="Server is overloaded. Try again later."
+# max time in seconds for reading a request which is rejected
+REJECT_TIMEOUT=1
+# max number of rejected connections which wait for their response. further connections are closed
+REJECT_QUEUE_SIZE=64
+# min time in seconds between two log messages about rejected requests
+REJECT_LOG_INTERVAL=10
+# command verb of a request, i.e., the leading name of the command
+VERB_RE = re.compile( '[a-z]*' )
+# number of threads of a server which execute read-only commands of batches concurrently
+BATCH_WORKERS=4
+# max number of tasks which wait for a batch worker
+BATCH_QUEUE_SIZE=64
 
 class hQBaseServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer, Daemon):
     """Abstract class for a hq server.
@@ -50,6 +77,11 @@ class hQBaseServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer, Daemon):
       | loops (dict): dictinary of periodically executed functions
       | shutdown_server_event (threading.Event): an event which indicates a server shutdown
       | print_status_counter (int): number of recently handled requests
+      | server_core (string): 'threading' or 'eventloop'
+      | workerPool (hQWorkerPool): workers which process the requests
+      | rejectPool (hQWorkerPool): single thread which answers rejected requests
+      | batchPool (hQWorkerPool): workers which help to execute read-only commands of batches
+      | keepaliveSlots (threading.BoundedSemaphore): persistent connections of the threading core
       
     """
     # This means the main server will not do the equivalent of a
@@ -64,7 +96,8 @@ class hQBaseServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer, Daemon):
     allow_reuse_address = True
     request_queue_size = 30
 
-    # set maximum number of children. actually has to be adjust according to number of cpu's
+    # default number of workers which process requests. actually has to be adjust according to
+    # number of cpu's
     max_children=64
 
     server_type ='hq-base-server'
@@ -94,13 +127,41 @@ class hQBaseServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer, Daemon):
 
         self.logger = hQLogger()
     
-        # initialize socket server
-        SocketServer.TCPServer.__init__(self, (self.host,self.port), handler)
-
         # read hQ config
         self.config = ConfigParser.ConfigParser()
         self.config.read( '{etcpath}/hq.cfg'.format(etcpath=ETCPATH) )
 
+        # server core: 'threading' (a worker per connection) or 'eventloop' (see hQEventLoop)
+        self.server_core = self.get_server_option( 'server_core', 'threading' )
+
+        # requests are processed by a fixed number of workers. further requests wait in a bounded
+        # queue and are rejected if the queue is full
+        self.workerPool = hQWorkerPool( int( self.get_server_option( 'workers', self.max_children ) ),
+                                        int( self.get_server_option( 'worker_queue_size', WORKER_QUEUE_SIZE ) ),
+                                        name=self.server_type )
+
+        # rejected requests are answered by a separate thread, so that neither the thread which
+        # accepts connections nor the event loop waits for rejected clients
+        self.rejectPool = hQWorkerPool( 1, REJECT_QUEUE_SIZE, name='{s} rejector'.format( s=self.server_type ) )
+        self.numRejectedSinceLog = 0
+        self.lastRejectLog = 0
+
+        # read-only commands of batches are executed concurrently by a few shared threads, so that
+        # the number of threads does not grow with the number of batches
+        self.batchPool = hQWorkerPool( int( self.get_server_option( 'batch_workers', BATCH_WORKERS ) ),
+                                       BATCH_QUEUE_SIZE,
+                                       name='{s} batch'.format( s=self.server_type ) )
+
+        # a worker of the threading core is occupied by a persistent connection even if it is idle,
+        # so that only a part of the workers may serve persistent connections
+        self.keepaliveSlots = threading.BoundedSemaphore( int( self.get_server_option( 'max_keepalive', MAX_KEEPALIVE ) ) )
+
+        # max number of pending connections. has to be set before socket is listening
+        self.request_queue_size = int( self.get_server_option( 'backlog', self.request_queue_size ) )
+
+        # initialize socket server
+        SocketServer.TCPServer.__init__(self, (self.host,self.port), handler)
+
         # set server time out (time after which self.handle_request returns without a request)
         self.timeout=SERVER_TIMEOUT
         
@@ -191,15 +252,207 @@ class hQBaseServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer, Daemon):
                            logCategory='status')
         
 
-        # handle request unless server is shutting down
-        while not self.shutdown_server_event.is_set():
-            self.handle_request()
+        self.workerPool.start()
+        self.rejectPool.start()
+        self.batchPool.start()
+
+        if self.server_core=='eventloop':
+            hQEventLoop( self, self.workerPool, KEEPALIVE_TIMEOUT ).run( self.timeout )
+        else:
+            # handle request unless server is shutting down
+            while not self.shutdown_server_event.is_set():
+                self.handle_request()
+
+                self.after_request_processing()
 
-            self.after_request_processing()
+        self.workerPool.stop()
+        self.rejectPool.stop()
+        self.batchPool.stop()
 
         self.shutdown_server()
 
 
+    def process_request( self, request, client_address ):
+        """overwrites process_request of SocketServer.ThreadingMixIn
+
+        the connection is handled by a worker instead of a new thread. it is rejected if all
+        workers are busy and the queue is full.
+        """
+        if not self.workerPool.submit( self.process_request_thread, request, client_address ):
+            self.reject( request )
+
+
+    def accept_keepalive( self, receivedStr, requestSocket ):
+        """acknowledge request ``keepalive[:<codec>]`` which opens a persistent connection
+
+        the codec of payloads on this connection is set to the requested codec if it is available,
+        otherwise to JSON (see :mod:`hq.lib.hQCodec`).
+
+        **Args**
+          | receivedStr (string): first request on connection
+          | requestSocket (hQSocket): socket of request
+
+        **Returns**
+          bool: ``True`` if request opens a persistent connection
+        """
+        command,sep,codecName = receivedStr.partition( ':' )
+
+        if command!="keepalive":
+            return False
+
+        if sep:
+            requestSocket.codec = get_codec( codecName, requestSocket.framing )
+            requestSocket.send( "ok:{c}".format( c=requestSocket.codec.name ) )
+        else:
+            requestSocket.send( "ok" )
+
+        return True
+
+
+    def reject( self, request, requestSocket=None ):
+        """hand over a connection which is rejected to the thread which answers rejected requests
+
+        the connection is closed immediately if too many rejected connections are waiting.
+
+        **Args**
+          | request (socket): socket of connection
+          | requestSocket (hQSocket): hQSocket of connection if it has already been created
+        """
+        if not self.rejectPool.submit( self.reject_request, request, requestSocket ):
+            self.shutdown_request( request )
+
+
+    def reject_request( self, request, requestSocket=None ):
+        """answer a request with :obj:`OVERLOAD_RESPONSE` without processing it and close the connection
+
+        the request is read before, since otherwise the client might not get the response. is
+        executed by :attr:`rejectPool`. rejections are logged at most every
+        :obj:`REJECT_LOG_INTERVAL` seconds.
+
+        **Args**
+          | request (socket): socket of connection
+          | requestSocket (hQSocket): hQSocket of connection if it has already been created
+        """
+        try:
+            host,port = request.getpeername()[:2]
+        except:
+            host,port = None,None
+
+        self.numRejectedSinceLog += 1
+
+        now = time.time()
+        if now-self.lastRejectLog>=REJECT_LOG_INTERVAL:
+            self.logger.write( "all workers are busy. {n} requests have been rejected, the last from {h}:{p}.".format( n=self.numRejectedSinceLog,
+                                                                                                                        h=host,
+                                                                                                                        p=port ),
+                               logCategory='warning' )
+            self.numRejectedSinceLog = 0
+            self.lastRejectLog = now
+
+        try:
+            if requestSocket:
+                requestSocket.socket.settimeout( REJECT_TIMEOUT )
+            else:
+                requestSocket = hQSocket( sock = request,
+                                          serverSideSSLConn = True,
+                                          catchErrors = False,
+                                          timeout = REJECT_TIMEOUT )
+            requestSocket.recv()
+            requestSocket.send( OVERLOAD_RESPONSE )
+        except:
+            pass
+        finally:
+            self.shutdown_request( request )
+
+
+    def get_load( self ):
+        """get rendered load of the workers
+
+        **Returns**
+          string: rendered load
+        """
+        stats = self.workerPool.get_stats()
+        
+        load = ""
+        load += "{s:>20} : {value}\n".format(s="busy workers", value="{busy} / {workers}".format(**stats) )
+        load += "{s:>20} : {value}\n".format(s="waiting requests", value="{waiting} / {queueSize}".format(**stats) )
+        load += "{s:>20} : {value}\n".format(s="rejected requests", value=stats['rejected'] )
+        load += "{s:>20} : {value}".format(s="wait time", value="{meanWait:.3f}s (max {maxWait:.3f}s)".format(**stats) )
+
+        return load
+
+
+    def get_server_option( self, option, default ):
+        """get option of section SERVER in hq.cfg
+
+        **Args**
+          | option (string): name of option
+          | default: returned if option is not set
+        """
+        if self.config.has_option( 'SERVER', option ):
+            return self.config.get( 'SERVER', option )
+        else:
+            return default
+
+
+    def process_message( self, receivedStr, requestSocket, writeLog, requestHost, requestPort ):
+        """process a single request with the processor of the server
+
+        is used by :class:`hQBaseServerHandler` and :class:`hq.lib.hQEventLoop.hQEventLoop`
+        
+        **Args**
+          | receivedStr (string): request
+          | requestSocket (hQSocket): socket of request
+          | writeLog (function): logger
+          | requestHost (string): host of client
+          | requestPort (int): port of client
+        """
+        currThread = threading.currentThread()
+        
+        # since after a predefined number of request the status is printed on console
+        # number of handled requests is counted here
+        self.print_status_counter += 1
+        
+        requestStrShort = "{r1}{dots}".format( r1=receivedStr[:30] if len(receivedStr)>30 else receivedStr,
+                                               dots="..." if len(receivedStr)>30 else ""
+                                               )
+        
+        # add new attribute to Thread object
+        currThread.command = receivedStr
+        currThread.command_short = requestStrShort
+        
+        writeLog( "NEW REQUEST FROM {h}:{p}: {s}".format( s = requestStrShort,
+                                                             h = requestHost,
+                                                             p = requestPort ),
+                     logCategory='request_processing' )
+
+        t1 = datetime.now()
+
+        # process request
+        try:
+            self.processor.process(receivedStr, requestSocket, writeLog, self)
+        except:
+            # processing failed
+            tb = sys.exc_info()
+
+            writeLog('Error while processing request from {h}:{p}!\n'.format(h=requestHost,
+                                                                                p=requestPort),
+                        logCategory='error' )
+
+            traceback.print_exception(*tb,file=sys.stderr)
+
+            requestSocket.send("Error while processing request!\n%s" %  tb[1])
+        finally:
+            # workers process many requests. the session of the thread is disposed, so that no
+            # transaction is left open and the next request does not read an outdated snapshot
+            hQDBConnection().remove()
+
+        t2 = datetime.now()
+
+        writeLog( "REQUEST PROCESSED IN {dt}s.".format(dt=str(t2-t1) ),
+                     logCategory='request_processing')
+
+
     def after_request_processing( self ):
         """is executed after a request came in
 
@@ -211,6 +464,11 @@ class hQBaseServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer, Daemon):
     def run_loop( self, name, **kwargs ):
         """generic function for periodically executing a function
 
+        If the loop has a ``wakeup`` event, the function is executed as soon as the event is set
+        (see :meth:`wakeup_loop`) or at the latest after ``interval`` seconds. Before the function
+        is executed, the loop waits ``coalesce`` seconds, so that a burst of wakeups triggers a
+        single execution.
+
         **Args**
           | name (string): loop identifier
 
@@ -224,9 +482,19 @@ class hQBaseServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer, Daemon):
             
             interval = loop[ 'interval' ]
             fct = loop[ 'fct' ]
+            wakeup = loop.get( 'wakeup', None )
             
-            # wait a little bit
-            time.sleep( interval )
+            if wakeup:
+                # wait until loop is woken up or interval has passed
+                if wakeup.wait( interval ):
+                    # collect further wakeups
+                    time.sleep( loop.get( 'coalesce', 0 ) )
+
+                # wakeups from now on trigger another execution
+                wakeup.clear()
+            else:
+                # wait a little bit
+                time.sleep( interval )
 
             try:
                 if not loop[ 'is_running' ].is_set():
@@ -247,6 +515,20 @@ class hQBaseServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer, Daemon):
                 loop[ 'is_running' ].clear()
 
             
+    def wakeup_loop( self, name ):
+        """execute loop function without waiting for the end of the interval
+
+        has no effect on loops without ``wakeup`` event.
+        
+        **Args**
+          | name (string): loop identifier
+        """
+        wakeup = self.loops.get( name, {} ).get( 'wakeup', None )
+
+        if wakeup:
+            wakeup.set()
+
+            
     def start_loops( self ):
         """start loops """
 
@@ -319,15 +601,22 @@ class hQBaseServerHandler(SocketServer.BaseRequestHandler):
 
 
     def handle(self):
-        """request handler"""
+        """request handler
+
+        Usually a single request is processed per connection. If the first request is
+        ``keepalive``, the connection is kept open and further requests are processed until the
+        client closes the connection or it has been idle for :obj:`KEEPALIVE_TIMEOUT`
+        seconds. Each request on such a connection is answered with exactly one response, which
+        is empty if the command itself does not respond.
+
+        The worker is occupied as long as the connection is open. Therefore ``keepalive`` is
+        answered with :obj:`KEEPALIVE_REFUSED` if :attr:`hQBaseServer.keepaliveSlots` persistent
+        connections are already open. The client sends its requests over single connections then.
+        """
         if self.srv.shutdown_server_event.is_set():
             # do not process event while server ist shutting down
             return
 
-        # since after a predefined number of request the status is printed on console
-        # number of handled requests is counted here
-        self.srv.print_status_counter += 1
-        
         # create a hQSocket-instance
         requestSocket = hQSocket( sock = self.request, 
                                   serverSideSSLConn = True,
@@ -335,46 +624,56 @@ class hQBaseServerHandler(SocketServer.BaseRequestHandler):
                                   timeout = 10 )
         try:
             receivedStr = requestSocket.recv()
-        except socket.timeout:
-            self.writeLog( "Timeout while reading from socket {h}:{p}. Skip".format( h = self.requestHost,
-                                                                                   p = self.requestPort),
+        except (socket.timeout, socket.error):
+            # e.g., message is too long or truncated
+            self.writeLog( "Could not read from socket {h}:{p}: {e}. Skip".format( h = self.requestHost,
+                                                                                 p = self.requestPort,
+                                                                                 e = sys.exc_info()[1] ),
                          logCategory='warning' )
             return
 
-        requestStrShort = "{r1}{dots}".format( r1=receivedStr[:30] if len(receivedStr)>30 else receivedStr,
-                                               dots="..." if len(receivedStr)>30 else ""
-                                               )
-        
-        # add new attribute to Thread object
-        self.currThread.command = receivedStr
-        self.currThread.command_short = requestStrShort
-        
-        self.writeLog( "NEW REQUEST FROM {h}:{p}: {s}".format( s = requestStrShort,
-                                                             h = self.requestHost,
-                                                             p = self.requestPort ),
-                     logCategory='request_processing' )
+        if receivedStr.partition( ':' )[0]=="keepalive" and not self.srv.keepaliveSlots.acquire( False ):
+            requestSocket.send( KEEPALIVE_REFUSED )
+            return
 
-        t1 = datetime.now()
+        if not self.srv.accept_keepalive( receivedStr, requestSocket ):
+            self.process_request( receivedStr, requestSocket )
+            return
 
-        # process request
         try:
-            self.srv.processor.process(receivedStr, requestSocket, self.writeLog, self.srv)
-        except:
-            # processing failed
-            tb = sys.exc_info()
+            # persistent connection
+            requestSocket.socket.settimeout( KEEPALIVE_TIMEOUT )
 
-            self.writeLog('Error while processing request from {h}:{p}!\n'.format(h=self.requestHost,
-                                                                                p=self.requestPort),
-                        logCategory='error' )
+            while not self.srv.shutdown_server_event.is_set():
+                try:
+                    receivedStr = requestSocket.recv()
+                except (socket.timeout, socket.error):
+                    # connection has been idle for too long or is broken
+                    break
 
-            traceback.print_exception(*tb,file=sys.stderr)
+                if not receivedStr:
+                    # connection has been closed by client
+                    break
 
-            requestSocket.send("Error while processing request!\n%s" %  tb[1])
+                requestSocket.sentStr = None
 
-        t2 = datetime.now()
+                self.process_request( receivedStr, requestSocket )
+
+                if requestSocket.sentStr is None:
+                    # client expects exactly one response
+                    requestSocket.send( "" )
+        finally:
+            self.srv.keepaliveSlots.release()
 
-        self.writeLog( "REQUEST PROCESSED IN {dt}s.".format(dt=str(t2-t1) ),
-                     logCategory='request_processing')
+            
+    def process_request(self, receivedStr, requestSocket):
+        """process a single request
+
+        **Args**
+          | receivedStr (string): request
+          | requestSocket (hQSocket): socket of request
+        """
+        self.srv.process_message( receivedStr, requestSocket, self.writeLog, self.requestHost, self.requestPort )
             
 
     def finish(self):
@@ -407,20 +706,26 @@ class hQBaseRequestProcessor(object):
         
         self.commands = {}	# {<COMMAND>: hQCommand, ...}
 
+        # {<command name>: hQCommand, ...}. is built from self.commands with the first request
+        self.dispatchTable = None
         
         self.commands["HELP"] = hQCommand( name = "help",
+                                           readonly = True,
                                            regExp = "^help$",
                                            help = "return help",
                                            fct = self.process_help )
         self.commands["PING"] = hQCommand( name = "ping",
+                                           readonly = True,
                                            regExp = '^ping$',
                                            help = "return 'pong'",
                                            fct = self.process_ping )
         self.commands["INFO"] = hQCommand( name = "info",
+                                           readonly = True,
                                            regExp = "^info$",
                                            help = "return some information about server",
                                            fct = self.process_details )
         self.commands["STATUS"] = hQCommand( name = "status",
+                                             readonly = True,
                                              regExp = "^status$",
                                              help = "print status of server",
                                              fct = self.process_status )
@@ -429,15 +734,18 @@ class hQBaseRequestProcessor(object):
                                              help = "shutdown server",
                                              fct = self.process_shutdown )
         self.commands["LSTHREADS"] = hQCommand( name = "lsthreads",
+                                                readonly = True,
                                                 regExp = "^lsthreads$",
                                                 help = "return list of active threads with [start time] [thread id] [thread name] [shorted command]",
                                                 fct = self.process_lsthreads )
         self.commands["LSTHREAD"] = hQCommand( name = "lsthread",
+                                               readonly = True,
                                                regExp = "^lsthread:(.*)",
                                                arguments = ['thread_id'],
                                                help = "return details of thread with specified id (see lsthread)",
                                                fct = self.process_lsthread )
         self.commands["LSLOGGER"] = hQCommand( name = "lslogger",
+                                               readonly = True,
                                                regExp = "^lslogger$",
                                                help = "return logger setting",
                                                fct = self.process_lslogger )
@@ -452,6 +760,7 @@ class hQBaseRequestProcessor(object):
                                                        help = "deactivate logger",
                                                        fct = self.process_deactivatelogger )
         self.commands["LSLOOP"] = hQCommand( name = "lsloops",
+                                              readonly = True,
                                               regExp = "^lsloops$",
                                               help = "return list of loops",
                                               fct = self.process_lsloops )
@@ -460,6 +769,11 @@ class hQBaseRequestProcessor(object):
                                               arguments = ["loop_key","interval"],
                                               help = "set interval of loop with provided key (check lsloops) to interval in seconds",
                                               fct = self.process_updateloop )
+        self.commands["BATCH"] = hQCommand( name = "batch",
+                                            regExp = "^batch:(.*)",
+                                            arguments = ['json_str'],
+                                            help = "execute json list of commands and return json list of their responses in the same order. consecutive read-only commands are executed concurrently",
+                                            fct = self.process_batch )
         self.commands["SLEEP"] = hQCommand( name = "sleep",
                                             regExp = "^sleep:(.*)",
                                             arguments = ['time_in_secs'],
@@ -469,6 +783,43 @@ class hQBaseRequestProcessor(object):
         ## help fill be set with the first call of self.process
         ##self.help = {}
 
+
+    def get_dispatch_table( self ):
+        """get table of commands keyed by command name
+
+        the table is built with the first call. hence, all commands have to be defined in the
+        constructor.
+
+        **Returns**
+          dict: {<command name>: hQCommand, ...}
+        """
+        if self.dispatchTable is None:
+            self.dispatchTable = dict( (cmd.name,cmd) for cmd in self.commands.itervalues() )
+
+        return self.dispatchTable
+
+
+    def match_command( self, requestStr ):
+        """find command of request
+
+        the command is looked up by its name and only its regular expression is matched against
+        the request.
+
+        **Args**
+          | requestStr (string): request as string
+
+        **Returns**
+          tuple: (hQCommand, match object) or (None, None) if request is not a known command
+        """
+        cmd = self.get_dispatch_table().get( VERB_RE.match( requestStr ).group() )
+
+        if cmd:
+            match = cmd.match( requestStr )
+            if match:
+                return cmd,match
+
+        return None,None
+
     def process(self, requestStr, request, logger, server):
         """parse requst string and process command
 
@@ -487,13 +838,12 @@ class hQBaseRequestProcessor(object):
         #    help COMMAND_STR
         #    COMMAND
         # where COMMAND_STR is either a full name of a command and an incomplete command string
-        m = re.match( 'help ?(.*)', requestStr )
-        if m:
+        if requestStr.startswith( "help" ):
             # request string is
             #   help
             #   help COMMAND_STR
             
-            command = m.group(1)
+            command = requestStr[5:] if requestStr.startswith( "help " ) else requestStr[4:]
             
             if command=="":
                 # no command has been given
@@ -509,10 +859,7 @@ class hQBaseRequestProcessor(object):
                 # check if COMMAND_STR is known by server, i.e. is present in self.commands
                 # match COMMAND_STR against each hQCommand.name
                 try:
-                    # find first matching command
-                    key = next( key for key,c in self.commands.iteritems() if command==c.name )
-
-                    cmd = self.commands[ key ]
+                    cmd = self.get_dispatch_table()[ command ]
 
                     response = [ "help for '"+cmd.name+"':" ]
                     response.append( "--------------------" )
@@ -521,7 +868,7 @@ class hQBaseRequestProcessor(object):
                     response.append( cmd.get_fullhelp() )
 
                     request.send( '\n'.join( response ) )
-                except StopIteration:
+                except KeyError:
                     # COMMAND_STR ist not known. find all commands which begin with COMMAND_STR
                     matching_commands = [ c.name for key,c in self.commands.iteritems() if c.name.startswith( command ) ]
 
@@ -538,10 +885,10 @@ class hQBaseRequestProcessor(object):
                         request.send( 'no matching command.' )
         else:
             # request string does not beginn with 'help'
-            # find matching command and execute associate function
-            try:
-                cmd = next( cmd for cmd_str,cmd in self.commands.iteritems() if cmd.match( requestStr ) )
-            except:
+            # find command by its name and match its arguments
+            cmd,match = self.match_command( requestStr )
+            
+            if not cmd:
                 self.writeLog("unknown command.", logCategory='request_processing')
 
                 request.send("what do you want?")
@@ -551,7 +898,7 @@ class hQBaseRequestProcessor(object):
             try:
                 # call associated function (defined as method of hQBaseRequestProcessor or server
                 # specific processor) with the function arguments
-                self._call_fct( cmd, requestStr, request )
+                self._call_fct( cmd, requestStr, request, match.groups() )
             except:
                 self.writeLog("error while processing request.", logCategory='request_processing')
                 print traceback.print_exc()
@@ -561,7 +908,7 @@ class hQBaseRequestProcessor(object):
                 
 
             
-    def _call_fct( self, cmd, requestStr, request ):
+    def _call_fct( self, cmd, requestStr, request, groups=None ):
         """call function with right arguments
 
         The required arguments of the command are stored in the attribute :attr:`hQCommand.arguments`.
@@ -570,14 +917,131 @@ class hQBaseRequestProcessor(object):
           | cmd (hQCommand): instance
           | requestStr (string): original request string
           | request (object): request object
+          | groups (tuple): groups of the regular expression of the command if requestStr has
+          |   already been matched
           
         """
-
+        if groups is None:
+            groups = cmd.groups( requestStr )
+            
         # first map required commands given as string in cmd.arguments and found arguments from
         # regular expression. then call associated function
-        cmd.fct( request, **dict( zip(cmd.arguments,cmd.groups(requestStr)) ) )
+        cmd.fct( request, **dict( zip(cmd.arguments,groups) ) )
+
+        
+    def process_batch( self, request, json_str ):
+        """process 'batch' command
+
+        execute several commands which have been sent in a single request and return their
+        responses in the same order. consecutive read-only commands are executed by the current
+        worker together with the idle threads of the shared :attr:`hQBaseServer.batchPool`. if
+        the batch pool is busy, the current worker executes them alone. other commands are
+        executed one after another.
+
+        **Args**
+          | request (object): request object
+          | json_str (string): json list of commands
+        """
+        requestStrs = request.codec.loads( json_str )
 
+        responses = [ None ] * len( requestStrs )
         
+        # group consecutive read-only commands
+        groups = []
+        for idx,requestStr in enumerate( requestStrs ):
+            readonly = self.is_readonly( requestStr )
+            
+            if readonly and groups and groups[-1][0]:
+                groups[-1][1].append( idx )
+            else:
+                groups.append( (readonly, [ idx ]) )
+
+        for readonly,indices in groups:
+            if readonly and len( indices )>1:
+                pending = iter( indices )
+                lock = threading.Lock()
+
+                # number of commands of group which have not been executed yet
+                numOpen = [ len( indices ) ]
+                done = threading.Event()
+
+                def _work():
+                    while True:
+                        with lock:
+                            idx = next( pending, None )
+
+                        if idx is None:
+                            break
+
+                        try:
+                            responses[ idx ] = self._process_buffered( requestStrs[ idx ], request )
+                        finally:
+                            with lock:
+                                numOpen[0] -= 1
+                                if not numOpen[0]:
+                                    done.set()
+
+                def _help():
+                    try:
+                        _work()
+                    finally:
+                        # session of batch worker must not keep a snapshot (see process_message)
+                        hQDBConnection().remove()
+
+                # helpers which start after all commands have been taken return immediately
+                batchPool = self.server.batchPool
+                for i in xrange( min( batchPool.numWorkers, len( indices )-1 ) ):
+                    if not batchPool.submit( _help ):
+                        break
+
+                _work()
+                done.wait()
+            else:
+                for idx in indices:
+                    responses[ idx ] = self._process_buffered( requestStrs[ idx ], request )
+                
+        request.send( request.codec.dumps( responses ) )
+
+
+    def is_readonly( self, requestStr ):
+        """check whether request is a read-only command
+
+        help and unknown commands are read-only.
+
+        **Args**
+          | requestStr (string): request as string
+
+        **Returns**
+          bool
+        """
+        if requestStr.startswith( "help" ):
+            return True
+
+        cmd,match = self.match_command( requestStr )
+        
+        return cmd.readonly if cmd else True
+
+
+    def _process_buffered( self, requestStr, request ):
+        """process a single command of a batch and return its response
+
+        **Args**
+          | requestStr (string): request as string
+          | request (object): request object of batch
+
+        **Returns**
+          string: response. responses which have been sent several times are joined by newlines
+        """
+        if requestStr.startswith( "batch:" ):
+            return "batches cannot be nested."
+
+        bufferedRequest = hQBufferedRequest( request )
+        
+        self.process( requestStr, bufferedRequest, self.writeLog, self.server )
+
+        return '\n'.join( bufferedRequest.responses )
+
+    
     def process_help( self, request ):
         """process 'help' command
 
@@ -638,7 +1102,8 @@ class hQBaseRequestProcessor(object):
           
         """
         
-        status = self.server.print_status( returnString=True )
+        status = self.server.print_status( returnString=True ) or ""
+        status += self.server.get_load()
             
         request.send( status )
 
@@ -686,21 +1151,22 @@ class hQBaseRequestProcessor(object):
                      'name': t.getName() }
         
         threadList = [ "{idx:3d}. [{id}] {name}{cmd}".format( **_formatDict(idx,t) ) for idx,t in enumerate(threading.enumerate() ) ]
+        threadList.append( self.server.get_load() )
         request.send( '\n'.join( threadList ) )
             
 
-    def process_lsthread( self, request, ident ):
+    def process_lsthread( self, request, thread_id ):
         """process 'lsthreads' command
 
-        return rendered overview of a specific thread identified by :obj:`ident` via request object.
+        return rendered overview of a specific thread identified by :obj:`thread_id` via request object.
         
         **Args**
           | request (object): request object
-          | ident (int|string): thread identifier
+          | thread_id (int|string): thread identifier
         
         """
         try:
-            ident = int( ident )
+            ident = int( thread_id )
         except:
             request.send("invalid key.")
             return
@@ -745,9 +1211,10 @@ class hQBaseRequestProcessor(object):
             return { 'idx': idx,
                      'name': loopKey,
                      'interval': loop['interval'],
+                     'wakeup': ' or on event' if 'wakeup' in loop else '',
                      'description': loop['description'] }
         
-        loopList = [ "{idx:2d}. [every {interval}s] {name} - {description}".format( **_formatDict(idx,loop) ) for idx,loop in enumerate(self.server.loops) ]
+        loopList = [ "{idx:2d}. [every {interval}s{wakeup}] {name} - {description}".format( **_formatDict(idx,loop) ) for idx,loop in enumerate(self.server.loops) ]
         
         request.send( '\n'.join( loopList ) )
 
@@ -842,3 +1309,33 @@ class hQBaseRequestProcessor(object):
         request.send("nothing has been done.")
 
 
+class hQBufferedRequest( object ):
+    """request object which keeps responses instead of sending them
+
+    is used for the commands of a batch.
+
+    **Args**
+      | request (hQSocket): socket of batch request
+    """
+    def __init__( self, request ):
+        self.codec = request.codec
+        self.host = request.host
+        self.port = request.port
+        self.responses = []
+        self.sentStr = None
+
+
+    def send( self, s ):
+        """keep response"""
+        self.sentStr = s
+        self.responses.append( s )
+
+
+    def sendLines( self, lines ):
+        """keep lines as a single response"""
+        self.send( "\n".join( lines ) )
+
+
+    def recv( self ):
+        """commands of a batch cannot receive further messages"""
+        raise socket.error( "commands of a batch cannot receive further messages" )
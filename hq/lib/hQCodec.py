@@ -0,0 +1,87 @@
+"""codecs for structured payloads of messages between the servers
+
+A message with a payload consists of the command, a colon and the encoded payload, e.g.,
+``add:{"jobs": [...]}``. JSON is the default and is always used for messages of human clients.
+
+The servers may agree on another codec for a persistent connection (see
+:mod:`hq.lib.hQConnectionPool`). The client asks for the codec given by the option ``codec`` in
+section ``CONNECTION`` of :file:`etc/hq.cfg` with the request ``keepalive:<codec>`` and the server
+answers with ``ok:<codec>``, naming the codec which is used for all payloads on this connection.
+If the server does not support the requested codec, it answers with ``ok:json``.
+
+Binary codecs are only used with length-prefixed framing, since an encoded payload may contain
+the end of communication string.
+
+The binary codec ``msgpack`` requires the python package msgpack.
+"""
+
+import json
+
+try:
+    import msgpack
+except ImportError:
+    # binary codec is not available
+    msgpack = None
+
+
+class hQCodec( object ):
+    """encoder and decoder of payloads
+
+    **Args**
+      | name (string): name of codec
+      | dumps (function): encode object as string
+      | loads (function): decode object from string
+      | binary (bool): encoded payloads may contain arbitrary bytes
+    """
+    def __init__( self, name, dumps, loads, binary=False ):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+        self.binary = binary
+
+
+    def encode_message( self, command, payload ):
+        """construct message consisting of command and encoded payload
+
+        **Args**
+          | command (string): command, e.g., 'add'
+          | payload (object): payload. is omitted if it is None
+
+        **Returns**
+          string: message
+        """
+        if payload is None:
+            return command
+        else:
+            return command + ':' + self.dumps( payload )
+
+
+JSON_CODEC = hQCodec( 'json', json.dumps, json.loads )
+
+# {<name>: hQCodec, ...} of all available codecs
+CODECS = { JSON_CODEC.name: JSON_CODEC }
+
+if msgpack:
+    CODECS['msgpack'] = hQCodec( 'msgpack',
+                                 lambda obj: msgpack.packb( obj, use_bin_type=False ),
+                                 lambda s: msgpack.unpackb( s, raw=False ),
+                                 binary=True )
+
+
+def get_codec( name, framing='length' ):
+    """get codec which is used for the requested codec
+
+    **Args**
+      | name (string): name of requested codec
+      | framing (string): framing of messages of the connection ('eoc' or 'length')
+
+    **Returns**
+      hQCodec: requested codec if it is available and can be used with framing, otherwise the
+      JSON codec
+    """
+    codec = CODECS.get( name, JSON_CODEC )
+
+    if codec.binary and framing!='length':
+        return JSON_CODEC
+
+    return codec
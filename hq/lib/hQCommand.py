@@ -9,14 +9,19 @@ class hQCommand( object ):
                   permission = None,
                   fct = None,
                   help = "",
-                  fullhelp = "" ):
+                  fullhelp = "",
+                  readonly = False ):
         self.name = name
         self.arguments = arguments
-        self.re = re.compile(regExp)
+        # payloads of binary codecs may contain newlines
+        self.re = re.compile(regExp, re.DOTALL)
         self.permission = permission
         self.fct = fct
         self.help = help
         self.fullhelp = fullhelp
+        # command does not change anything and can be executed concurrently with other read-only
+        # commands of a batch
+        self.readonly = readonly
 
 
     def match( self, command_str ):
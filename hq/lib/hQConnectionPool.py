@@ -0,0 +1,394 @@
+"""pool of persistent connections to the servers
+
+A connection is opened with the request ``keepalive``. Afterwards the server answers each request
+on this connection with exactly one response (an empty response if the command itself does not
+respond) until the connection is closed by the client or has been idle for
+:obj:`hq.lib.hQBaseServer.KEEPALIVE_TIMEOUT` seconds.
+
+The codec of payloads is negotiated when a connection of :obj:`serverConnectionPool` is opened
+(see :mod:`hq.lib.hQCodec`). Connections of :obj:`connectionPool` always use JSON.
+
+Idle connections are kept per (host, port). Before a connection is reused it is checked that the
+server has not closed it in the meantime. Connections which have been idle for more than
+:obj:`MAX_IDLE_TIME` seconds are closed by a background thread of the pool, so that they do not
+occupy the server even if the process does not send further requests.
+
+A server refuses ``keepalive`` if it does not accept further persistent connections (see
+:obj:`hq.lib.hQBaseServer.MAX_KEEPALIVE`). Requests to this server are then sent over single
+connections for :obj:`MAX_IDLE_TIME` seconds.
+
+A single pool :obj:`connectionPool` for requests of clients and a single pool
+:obj:`serverConnectionPool` for messages between the servers are shared by all threads of a
+process.
+"""
+
+import select
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+
+# import hq libraries
+from hq.lib.hQSocket import hQSocket
+from hq.lib.hQCodec import JSON_CODEC, get_codec
+
+# connections which have been idle for a longer time are closed. has to be smaller than the
+# KEEPALIVE_TIMEOUT of the servers
+MAX_IDLE_TIME = 30
+
+# max number of idle connections per (host, port)
+MAX_IDLE_CONNECTIONS = 4
+
+# time in seconds between two checks for connections which have been idle for too long
+EVICT_INTERVAL = 5
+
+
+class hQConnectionPool( object ):
+    """pool of persistent connections keyed by (host, port)
+
+    **Args**
+      | maxIdleTime (int): close connections which have been idle for more than maxIdleTime seconds
+      | maxIdleConnections (int): max number of idle connections per (host, port)
+      | negotiateCodec (bool): ask for the codec configured in hq.cfg instead of JSON
+    """
+    def __init__( self, maxIdleTime=MAX_IDLE_TIME, maxIdleConnections=MAX_IDLE_CONNECTIONS, negotiateCodec=False ):
+        self.maxIdleTime = maxIdleTime
+        self.maxIdleConnections = maxIdleConnections
+        self.negotiateCodec = negotiateCodec
+
+        # idle connections {(<host>,<port>): deque( [ (<hQSocket>,<idle since>,<pending response>), ... ] ), ...}
+        self.idle = defaultdict( deque )
+        self.lock = threading.Lock()
+
+        # servers which have refused a persistent connection {(<host>,<port>): <time>, ...}
+        self.refused = {}
+
+        # thread which closes connections which have been idle for too long
+        self.evictThread = None
+
+
+    def connect( self, host, port ):
+        """open new persistent connection
+
+        **Args**
+          | host (string): host of server
+          | port (int): port of server
+
+        **Returns**
+          hQSocket: connected socket or None if server has refused a persistent connection
+        """
+        sock = hQSocket( host=host,
+                         port=port,
+                         catchErrors=False )
+        sock.keepalive = True
+
+        if not self.negotiateCodec or get_codec( sock.codecName, sock.framing ) is JSON_CODEC:
+            sock.send( "keepalive" )
+        else:
+            # ask for binary codec
+            sock.send( "keepalive:{c}".format( c=sock.codecName ) )
+
+        response = sock.recv()
+        if response!="ok" and not response.startswith( "ok:" ):
+            self.close( sock )
+
+            with self.lock:
+                self.refused[ (host,port) ] = time.time()
+
+            return None
+
+        # codec which has been chosen by the server
+        sock.codec = get_codec( response[3:], sock.framing )
+
+        return sock
+
+
+    def connect_once( self, host, port ):
+        """open connection for a single request
+
+        the connection is closed when it is returned to the pool.
+
+        **Args**
+          | host (string): host of server
+          | port (int): port of server
+
+        **Returns**
+          hQSocket: connected socket
+        """
+        sock = hQSocket( host=host,
+                         port=port,
+                         catchErrors=False )
+        sock.keepalive = False
+
+        return sock
+
+
+    def is_refused( self, host, port ):
+        """check whether server has recently refused a persistent connection"""
+        with self.lock:
+            refused = self.refused.get( (host,port) )
+
+            if refused is None:
+                return False
+            elif time.time()-refused>self.maxIdleTime:
+                del self.refused[ (host,port) ]
+                return False
+
+        return True
+
+
+    def is_alive( self, sock ):
+        """check whether the server has not closed an idle connection
+
+        an idle connection must not be readable. otherwise it has been closed.
+
+        **Args**
+          | sock (hQSocket): socket
+
+        **Returns**
+          bool
+        """
+        try:
+            readable,w,x = select.select( [ sock.socket ], [], [], 0 )
+        except (select.error, socket.error, ValueError):
+            return False
+
+        return not readable
+
+
+    def is_ready( self, sock ):
+        """check whether response of a request which was sent with :meth:`send` has arrived
+
+        **Args**
+          | sock (hQSocket): socket
+
+        **Returns**
+          bool
+        """
+        try:
+            readable,w,x = select.select( [ sock.socket ], [], [], 0 )
+        except (select.error, socket.error, ValueError):
+            return False
+
+        return bool( readable )
+
+
+    def checkout( self, host, port ):
+        """get idle connection to server or open a new one
+
+        the connection has to be returned with :meth:`checkin` or, after an error, with
+        :meth:`discard`.
+
+        **Args**
+          | host (string): host of server
+          | port (int): port of server
+
+        **Returns**
+          hQSocket: connected socket
+        """
+        if self.is_refused( host, port ):
+            return self.connect_once( host, port )
+
+        now = time.time()
+
+        with self.lock:
+            idle = self.idle[ (host,port) ]
+
+            candidates = []
+            while idle:
+                candidates.append( idle.popleft() )
+
+        sock = None
+        for candidate,idleSince,pendingResponse in candidates:
+            if sock or now-idleSince>self.maxIdleTime:
+                self.put_back( host, port, candidate, idleSince, pendingResponse )
+                continue
+
+            if pendingResponse:
+                if not self.is_ready( candidate ):
+                    # server is still processing the request
+                    self.put_back( host, port, candidate, idleSince, pendingResponse )
+                    continue
+
+                try:
+                    # drop response
+                    candidate.recv()
+                except:
+                    self.close( candidate )
+                    continue
+
+            if self.is_alive( candidate ):
+                sock = candidate
+            else:
+                self.close( candidate )
+
+        return sock or self.connect( host, port ) or self.connect_once( host, port )
+
+
+    def put_back( self, host, port, sock, idleSince, pendingResponse=False ):
+        """keep connection as idle connection. close connection if it is not persistent, has been
+        idle for too long or too many connections are idle"""
+        if sock.keepalive:
+            with self.lock:
+                idle = self.idle[ (host,port) ]
+
+                if time.time()-idleSince<=self.maxIdleTime and len(idle)<self.maxIdleConnections:
+                    idle.append( (sock,idleSince,pendingResponse) )
+
+                    if not self.evictThread or not self.evictThread.is_alive():
+                        # thread is not inherited by forked processes
+                        self.evictThread = threading.Thread( target=self.evict_loop )
+                        self.evictThread.setDaemon( True )
+                        self.evictThread.start()
+                    return
+
+        self.close( sock )
+
+
+    def evict_idle( self ):
+        """close connections of all servers which have been idle for too long"""
+        now = time.time()
+
+        expired = []
+        with self.lock:
+            for key,idle in self.idle.items():
+                keep = deque()
+                for connection in idle:
+                    if now-connection[1]>self.maxIdleTime:
+                        expired.append( connection[0] )
+                    else:
+                        keep.append( connection )
+
+                if keep:
+                    self.idle[ key ] = keep
+                else:
+                    del self.idle[ key ]
+
+        for sock in expired:
+            self.close( sock )
+
+
+    def evict_loop( self ):
+        """close idle connections periodically until no connection is idle"""
+        while True:
+            time.sleep( EVICT_INTERVAL )
+
+            self.evict_idle()
+
+            with self.lock:
+                if not self.idle:
+                    self.evictThread = None
+                    return
+
+
+    def checkin( self, host, port, sock, pendingResponse=False ):
+        """return connection to pool
+
+        **Args**
+          | host (string): host of server
+          | port (int): port of server
+          | sock (hQSocket): socket which has been returned by :meth:`checkout`
+          | pendingResponse (bool): response to the last request has not been received yet
+        """
+        self.put_back( host, port, sock, time.time(), pendingResponse )
+
+
+    def discard( self, sock ):
+        """close connection which is not used anymore, e.g., after an error"""
+        self.close( sock )
+
+
+    def close( self, sock ):
+        """close connection and ignore errors"""
+        try:
+            sock.close()
+        except:
+            pass
+
+
+    def send_request( self, host, port, request, payload=None ):
+        """send request over an idle or a new connection
+
+        if sending over an idle connection fails, the request is sent once more over a new
+        connection. the request has not been received by the server in this case.
+
+        **Args**
+          | host (string): host of server
+          | port (int): port of server
+          | request (string): request or command if payload is given
+          | payload (object): payload which is encoded with the codec of the connection
+
+        **Returns**
+          hQSocket: connection over which the request has been sent
+        """
+        sock = self.checkout( host, port )
+
+        try:
+            sock.send( sock.codec.encode_message( request, payload ) )
+        except:
+            self.discard( sock )
+
+            sock = self.connect( host, port ) or self.connect_once( host, port )
+            try:
+                sock.send( sock.codec.encode_message( request, payload ) )
+            except:
+                self.discard( sock )
+                raise
+
+        return sock
+
+    
+    def request( self, host, port, request, payload=None ):
+        """send request to server and receive response
+
+        **Args**
+          | host (string): host of server
+          | port (int): port of server
+          | request (string): request or command if payload is given
+          | payload (object): payload which is encoded with the codec of the connection
+
+        **Returns**
+          string: response of server
+        """
+        sock = self.send_request( host, port, request, payload )
+
+        try:
+            response = sock.recv()
+        except:
+            self.discard( sock )
+            raise
+
+        self.checkin( host, port, sock )
+
+        return response
+
+
+    def send( self, host, port, request, payload=None ):
+        """send request to server without waiting for the response
+
+        the response is dropped before the connection is used again.
+
+        **Args**
+          | host (string): host of server
+          | port (int): port of server
+          | request (string): request or command if payload is given
+          | payload (object): payload which is encoded with the codec of the connection
+        """
+        sock = self.send_request( host, port, request, payload )
+
+        self.checkin( host, port, sock, pendingResponse=True )
+
+
+    def close_all( self ):
+        """close all idle connections"""
+        with self.lock:
+            connections = [ sock for idle in self.idle.itervalues() for sock,t,p in idle ]
+            self.idle.clear()
+
+        for sock in connections:
+            self.close( sock )
+
+
+# shared by all threads of a process
+connectionPool = hQConnectionPool()
+serverConnectionPool = hQConnectionPool( negotiateCodec=True )
@@ -20,11 +20,18 @@ class hQDBConnection( object ):
     object. Any change made against the objects in the session won't be persisted into the database
     until you call session.commit(). If you're not happy about the changes, you can revert all of
     them back to the last commit by calling session.rollback()
+
+    Connections which are created with ``writer=True`` mark the sessions of the current thread as
+    sessions which are going to write (see :func:`hq.lib.hQDBSessionRegistry.set_writer`).
     """
     
-    def __init__( self, echo=False ):
+    def __init__( self, echo=False, writer=False ):
         # create a connection to the database
         self.session = DBSession()
+
+        if writer:
+            # transactions of this thread are going to write (see hQDBSessionRegistry.set_writer)
+            hQDBSessionRegistry.set_writer()
         
     #def __del__( self ):
     #    """! @brief Tidy up session upon destruction of the Connect object"""
@@ -98,15 +105,16 @@ class hQDBConnection( object ):
         """
         
         DBSession.remove()
+        hQDBSessionRegistry.set_writer( False )
         
     def create_all_tables( self ):
         """create tables defined in database model in database if not exist
 
         """
         
-        from hDatabase import Base
+        from hq.lib.hQDatabase import Base
         
-        Base.metadata.create_all( engine )
+        Base.metadata.create_all( hQDBSessionRegistry.engine )
 
     def drop_all_tables( self ):
         """drop all tables in database
@@ -115,7 +123,7 @@ class hQDBConnection( object ):
         """
 
 
-        meta = MetaData( engine )
+        meta = MetaData( hQDBSessionRegistry.engine )
         meta.reflect()
         meta.drop_all()
 
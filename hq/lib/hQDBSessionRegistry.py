@@ -44,8 +44,10 @@ If we call upon the registry DBSession a second time, we get back the same Sessi
 
 import os
 import sys
+import threading
 import ConfigParser
 import sqlalchemy.orm
+from sqlalchemy import event
 
 
 # import hq libraries
@@ -54,6 +56,15 @@ from hq.lib.hQDatabase import Base
 # use default config file
 ETCPATH = "{etcpath}/etc".format( etcpath=os.environ['HQPATH'] )
 
+# relative paths of SQLite database files are relative to this directory
+VARPATH = "{hqpath}/var".format( hqpath=os.environ['HQPATH'] )
+
+# max time in milliseconds a SQLite connection waits for a lock
+SQLITE_BUSY_TIMEOUT = 30000
+
+# threads whose sessions are going to write. see set_writer
+writerThreads = threading.local()
+
 # default config file for database connection
 configFileName = "{etcPath}/hq-db.cfg".format(etcPath=ETCPATH)
 
@@ -65,12 +76,21 @@ else:
     sys.stderr.write( "ERROR: Could not find Config file {c}!".format( c=configFileName) )
     sys.exit( -1 )
 
+def get_option( option, default='' ):
+    """get option of section DATABASE in hq-db.cfg or default if it is not set"""
+    if config.has_option( 'DATABASE', option ):
+        return config.get( 'DATABASE', option )
+    else:
+        return default
+
 databaseDialect = config.get( 'DATABASE', 'database_dialect' )
-databaseHost = config.get( 'DATABASE', 'database_host' )
-databasePort = config.get( 'DATABASE', 'database_port' )
 databaseName = config.get( 'DATABASE', 'database_name' )
-databaseUsername = config.get( 'DATABASE', 'database_username' )
-databasePassword = config.get( 'DATABASE', 'database_password' )
+
+# not needed for sqlite
+databaseHost = get_option( 'database_host' )
+databasePort = get_option( 'database_port' )
+databaseUsername = get_option( 'database_username' )
+databasePassword = get_option( 'database_password' )
 
 try:
     echo = config.getboolean( 'DATABASE', 'echo' )
@@ -92,6 +112,9 @@ def get_engine( echo=False ):
        connection details are stored in outer score
        
     """
+
+    if databaseDialect=='sqlite':
+        return get_sqlite_engine( databaseName, echo=echo )
     
     engine = sqlalchemy.create_engine( "{dialect}://{user}:{password}@{host}:{port}/{name}".format( dialect=databaseDialect,
                                                                                                     user=databaseUsername,
@@ -105,8 +128,80 @@ def get_engine( echo=False ):
                                        echo=echo )
     return engine
 
+def get_sqlite_engine( fileName, echo=False ):
+    """get a database engine for a SQLite database file
+
+    The database is used in WAL mode, so that readers do not block the writer and vice versa.
+
+    Transactions are started explicitly with the first statement of a session, also if it only
+    reads, so that a transaction which reads before it writes is atomic (the driver itself would
+    start a transaction only right before the first write). SQLite allows only a single writer at
+    a time. Sessions of threads which have been marked by :func:`set_writer` start their
+    transactions with ``BEGIN IMMEDIATE`` and thereby take the write lock right away. Hence, they
+    never fail when a transaction wants to write after another writer has committed since it
+    began. A transaction waits for the write lock for at most :obj:`SQLITE_BUSY_TIMEOUT`
+    milliseconds.
+
+    **Args**
+      fileName (str): path of database file. relative paths are relative to :file:`HQPATH/var`
+
+    **Kwargs**
+      echo (bool): if True print SQL printing statements to stdout
+
+    **Returns**
+      database engine
+    """
+    if fileName!=':memory:':
+        fileName = os.path.join( VARPATH, os.path.expanduser( fileName ) )
+
+    engine = sqlalchemy.create_engine( "sqlite:///{f}".format( f=fileName ),
+                                       connect_args={ 'check_same_thread': False,		# sessions are used in several threads
+                                                      'timeout': SQLITE_BUSY_TIMEOUT/1000. },
+                                       echo=echo )
+
+    @event.listens_for( engine, "connect" )
+    def connect( dbapiConnection, connectionRecord ):
+        # transactions are started by begin
+        dbapiConnection.isolation_level = None
+
+        cursor = dbapiConnection.cursor()
+        cursor.execute( "PRAGMA journal_mode=WAL" )
+        cursor.execute( "PRAGMA synchronous=NORMAL" )		# WAL is synced at checkpoints only
+        cursor.execute( "PRAGMA foreign_keys=ON" )
+        cursor.execute( "PRAGMA busy_timeout={t}".format( t=SQLITE_BUSY_TIMEOUT ) )
+        cursor.close()
+
+    @event.listens_for( engine, "begin" )
+    def begin( connection ):
+        if getattr( writerThreads, 'writer', False ):
+            connection.execute( "BEGIN IMMEDIATE" )
+        else:
+            connection.execute( "BEGIN" )
+
+    return engine
+
+
+def set_writer( writer=True ):
+    """mark sessions of the current thread as sessions which are going to write
+
+    On SQLite, the transactions of these sessions take the write lock when they begin (see
+    :func:`get_sqlite_engine`). Other databases are not affected. The mark has to be set before
+    the first statement of a transaction and is removed with the session by
+    :meth:`hq.lib.hQDBConnection.hQDBConnection.remove`.
+
+    **Kwargs**
+      writer (bool): mark or unmark current thread
+    """
+    writerThreads.writer = writer
+
+
 ## engine
-engine = get_engine( echo=echo )
+try:
+    engine = get_engine( echo=echo )
+except ImportError as e:
+    # database driver is not installed. sessions have to be bound to another engine by bind_engine
+    sys.stderr.write( "WARNING: Could not create database engine: {e}\n".format( e=e ) )
+    engine = None
 
 ## define a session factory
 SessionFactory = sqlalchemy.orm.sessionmaker( bind = engine )
@@ -115,6 +210,23 @@ SessionFactory = sqlalchemy.orm.sessionmaker( bind = engine )
 DBSession = sqlalchemy.orm.scoped_session( SessionFactory )
 
 
+def bind_engine( e ):
+    """bind sessions to another database engine
+
+    sessions which are created afterwards use the given engine. This is used, e.g., by
+    :class:`hq.lib.hQSimulator.hQSimulator` to run the scheduler against a local database.
+
+    **Args**
+      e (sqlalchemy engine): database engine
+    """
+    global engine
+
+    engine = e
+    
+    DBSession.remove()
+    SessionFactory.configure( bind=e )
+
+    
 def init_db( e=None ):
     """create all tables in the engine.
 
@@ -127,3 +239,94 @@ def init_db( e=None ):
     Base.metadata.create_all( bind=e if e else engine )
 
 
+
+def create_missing_columns( e=None ):
+    """add columns which are defined in the models but are missing in existing tables.
+
+    :func:`init_db` does not alter tables which already exist. Columns are added with ``ALTER
+    TABLE ... ADD COLUMN``, together with their foreign keys if the database supports adding
+    constraints. Existing rows are set to the default of the column. Columns which are present
+    are not touched, so this can be run repeatedly.
+
+    **Kwargs**
+      e (sqlalchemy engine): use this database engine instead of the one defined in the outer scope.
+
+    **Returns**
+      list of added columns as ``<table>.<column>``
+    """
+    e = e if e else engine
+    
+    inspector = sqlalchemy.inspect( e )
+    tableNames = set( inspector.get_table_names() )
+
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tableNames:
+            # table is created with all its columns by init_db
+            continue
+
+        existingColumns = set( c['name'] for c in inspector.get_columns( table.name ) )
+
+        for column in table.columns:
+            if column.name in existingColumns:
+                continue
+
+            columnSpec = sqlalchemy.schema.CreateColumn( column ).compile( dialect=e.dialect )
+            
+            e.execute( "ALTER TABLE {t} ADD COLUMN {c}".format( t=e.dialect.identifier_preparer.format_table( table ),
+                                                                c=columnSpec ) )
+
+            if e.dialect.name!='sqlite':
+                # sqlite cannot add constraints to existing tables
+                for foreignKey in column.foreign_keys:
+                    e.execute( sqlalchemy.schema.AddConstraint( foreignKey.constraint ) )
+
+            if column.default is not None and column.default.is_scalar:
+                e.execute( table.update()\
+                           .where( column==None )\
+                           .values( { column.name: column.default.arg } ) )
+
+            added.append( "{t}.{c}".format( t=table.name, c=column.name ) )
+
+    return added
+
+
+def create_missing_indexes( e=None ):
+    """create indexes which are defined in the models but are missing in an existing database.
+
+    :func:`init_db` does not add indexes to tables which already exist. An index is regarded as
+    present if the table has an index with the same name or on the same columns. Missing columns
+    have to be added before with :func:`create_missing_columns`.
+
+    **Kwargs**
+      e (sqlalchemy engine): use this database engine instead of the one defined in the outer scope.
+
+    **Returns**
+      list of names of created indexes
+    """
+    e = e if e else engine
+    
+    inspector = sqlalchemy.inspect( e )
+    tableNames = set( inspector.get_table_names() )
+
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tableNames:
+            # table is created with all its indexes by init_db
+            continue
+
+        existingIndexes = inspector.get_indexes( table.name )
+        existingNames = set( idx['name'] for idx in existingIndexes )
+        existingColumns = set( tuple( idx['column_names'] ) for idx in existingIndexes )
+        
+        for index in sorted( table.indexes, key=lambda idx: idx.name ):
+            columns = tuple( c.name for c in index.columns )
+            
+            if index.name in existingNames or columns in existingColumns:
+                continue
+
+            index.create( bind=e )
+            created.append( index.name )
+
+    return created
+
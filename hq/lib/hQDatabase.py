@@ -1,6 +1,6 @@
 import datetime
 
-from sqlalchemy import Column, ForeignKey
+from sqlalchemy import Column, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.types import Integer, SmallInteger, Float, String, DateTime, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
@@ -42,6 +42,21 @@ class User( Base ):
     
     roles = relationship("AssociationUserRole", backref="user")
     
+## @brief consumed resources of user
+#
+# usage is given in slot-seconds and decays with time. it is the usage at last_update.
+class UserUsage( Base ):
+    __tablename__ = 'user_usage'
+
+    id = Column( Integer, primary_key=True )
+
+    user_id = Column( Integer, ForeignKey( 'user.id' ), nullable=False, unique=True )
+    usage = Column( Float, default=0.0 )
+    last_update = Column( DateTime, default = datetime.datetime.now )
+
+    user = relationship( 'User', backref=backref( "usage", uselist=False ) )
+
+    
 ## @brief role of user
 #
 class Role( Base ):
@@ -92,8 +107,16 @@ class Job( Base ):
     excluded_hosts = Column( String(1024), default='[]' )	# json representation of a list of host's full names
     slots = Column( Integer, default=1 )
     priority_id = Column( Integer, ForeignKey( 'priority.id' ), nullable=False )	# the higher value indicates higher priority
-    estimated_time = Column( Float )
-    estimated_memory = Column( Float )
+    estimated_time = Column( Float )	# in minutes
+    estimated_memory = Column( Float )	# in MB
+    reservation_id = Column( Integer, ForeignKey( 'reservation.id' ) )	# job runs only in slots of this reservation
+    unresolved_dependencies = Column( Integer, default=0 )	# number of prerequisite jobs which have not been finished yet
+    array_id = Column( Integer, ForeignKey( 'job_array.id' ), index=True )	# job is a task of this job array
+    array_idx = Column( Integer )	# index of task in job array
+    submission_id = Column( String(32), index=True )	# jobs which have been added together share the same submission id
+    
+    # groups of a user (lsgroups, lagroup)
+    __table_args__ = ( Index( 'ix_job_user_id_group', 'user_id', 'group' ), )
     
     user = relationship( 'User' )
     #job_details = relationship( 'JobDetails', uselist=False, backref="job", cascade="all, delete, delete-orphan" )
@@ -102,6 +125,42 @@ class Job( Base ):
     def __repr__( self ):
         return "Job [{id}] command: {c}".format( id=self.id, c=self.command )
 
+## @brief job array
+#
+# a command template which is executed for each index between first_idx and last_idx. '{idx}' in
+# command, info text, stdout, stderr and logfile is replaced by the index. tasks are created as
+# jobs when there are free slots. next_idx is the index of the next task which will be created.
+class JobArray( Base ):
+    __tablename__ = 'job_array'
+
+    id = Column( Integer, primary_key=True )
+    user_id = Column( Integer, ForeignKey('user.id'), nullable=False )
+    
+    command = Column( String(2048) )
+    info_text = Column( String(512) )
+    group = Column( String(256) )
+    shell = Column( String(16) )
+    stdout = Column( String(256) )
+    stderr = Column( String(256) )
+    logfile = Column( String(256) )
+    excluded_hosts = Column( String(1024), default='[]' )	# json representation of a list of host's full names
+    slots = Column( Integer, default=1 )
+    priority_id = Column( Integer, ForeignKey( 'priority.id' ), nullable=False )
+    estimated_time = Column( Float )	# in minutes
+    estimated_memory = Column( Float )	# in MB
+    reservation_id = Column( Integer, ForeignKey( 'reservation.id' ) )
+    first_idx = Column( Integer, nullable=False )
+    last_idx = Column( Integer, nullable=False )
+    next_idx = Column( Integer, nullable=False )
+    datetime = Column( DateTime, default = datetime.datetime.now )
+
+    user = relationship( 'User' )
+    priority = relationship( 'Priority' )
+    
+    def __repr__( self ):
+        return "JobArray [{id}] {f}-{l} command: {c}".format( id=self.id, f=self.first_idx, l=self.last_idx, c=self.command )
+
+    
 ## @brief JobDetails
 #
 class JobDetails( Base ):
@@ -115,6 +174,10 @@ class JobDetails( Base ):
     pid = Column( Integer )
     return_code = Column( Integer )
 
+    # status of a job and number of jobs per status (get_status) are read from the index only. an
+    # index starting with the few distinct status ids would misguide the planner in _render_job_list
+    __table_args__ = ( Index( 'ix_job_details_job_id_job_status_id', 'job_id', 'job_status_id' ), )
+
     job = relationship( 'Job', uselist=False, single_parent=True, backref=backref("job_details", cascade="all, delete, delete-orphan", uselist=False, single_parent=True ) )
     job_status = relationship( 'JobStatus', uselist=False )
     host = relationship( 'Host' )
@@ -130,6 +193,11 @@ class JobHistory( Base ):
     datetime = Column( DateTime, default = datetime.datetime.now )
     job_status_id = Column( Integer, ForeignKey( 'job_status.id' ), nullable=False )
     checked  = Column( Boolean, default=False )
+
+    # time of a status change of a job (_render_job_list, scheduler) and
+    # latest status changes (lsfjobs, lscjobs, ...)
+    __table_args__ = ( Index( 'ix_job_history_job_id_job_status_id_datetime', 'job_id', 'job_status_id', 'datetime' ),
+                       Index( 'ix_job_history_job_status_id_datetime', 'job_status_id', 'datetime' ) )
     
     job = relationship( 'Job', uselist=False, single_parent=True, backref=backref("job_history", cascade="all, delete, delete-orphan") )
     job_status = relationship( 'JobStatus' )
@@ -139,21 +207,116 @@ class WaitingJob( Base ):
 
     id = Column( Integer, primary_key=True )
 
-    job_id = Column( Integer, ForeignKey( 'job.id' ), nullable=False )
+    job_id = Column( Integer, ForeignKey( 'job.id' ), nullable=False, index=True )
     user_id = Column( Integer, ForeignKey( 'user.id' ), nullable=False )
-    priorityValue = Column( Float, nullable=False )
+    priorityValue = Column( Float, nullable=False, index=True )	# waiting jobs are scheduled in order of descending priority value
     datetime = Column( DateTime, default = datetime.datetime.now )
     
     job = relationship( 'Job' )
     user = relationship( 'User' )
     
     
+## @brief dependency of a blocked job on a prerequisite job
+#
+# the entry is removed as soon as the prerequisite job has been finished or cancelled
+class JobDependency( Base ):
+    __tablename__ = 'job_dependency'
+
+    id = Column( Integer, primary_key=True )
+
+    job_id = Column( Integer, ForeignKey( 'job.id' ), nullable=False )
+    required_job_id = Column( Integer, ForeignKey( 'job.id' ), nullable=False, index=True )
+    type = Column( String(8), nullable=False )	# afterok or afterany
+
+    job = relationship( 'Job', foreign_keys=[ job_id ] )
+
+
+## @brief number of jobs of a user in a job status
+#
+# is changed in the same transaction as the status of the jobs (see hQJobStatusCounter). the total
+# number of jobs in a status is the sum over all users.
+class JobStatusCounter( Base ):
+    __tablename__ = 'job_status_counter'
+
+    id = Column( Integer, primary_key=True )
+
+    user_id = Column( Integer, ForeignKey( 'user.id' ), nullable=False )
+    job_status_id = Column( Integer, ForeignKey( 'job_status.id' ), nullable=False )
+    count = Column( Integer, nullable=False, default=0 )
+
+    __table_args__ = ( UniqueConstraint( 'user_id', 'job_status_id' ), )
+
+
+## @brief archived job
+#
+# append-only copy of a finished or cancelled job together with its details. jobs are moved here by
+# the archiver of hq-server (see hQArchiver) and keep their id. an archived job provides the
+# attributes of JobDetails itself, so that it can be rendered like a job.
+#
+# backrefs: job_history -> [ ArchivedJobHistory, ... ]
+class ArchivedJob( Base ):
+    __tablename__ = 'archived_job'
+
+    id = Column( Integer, primary_key=True, autoincrement=False )	# id of job
+    user_id = Column( Integer, ForeignKey('user.id'), nullable=False )
+
+    command = Column( String(2048) )
+    info_text = Column( String(512) )
+    group = Column( String(256) )
+    shell = Column( String(16) )
+    stdout = Column( String(256) )
+    stderr = Column( String(256) )
+    logfile = Column( String(256) )
+    excluded_hosts = Column( String(1024), default='[]' )
+    slots = Column( Integer, default=1 )
+    priority_id = Column( Integer )
+    estimated_time = Column( Float )
+    estimated_memory = Column( Float )
+    reservation_id = Column( Integer )
+    array_id = Column( Integer, index=True )
+    array_idx = Column( Integer )
+    submission_id = Column( String(32) )
+
+    # details of job
+    job_status_id = Column( Integer, ForeignKey('job_status.id') )
+    host_id = Column( Integer, ForeignKey('host.id') )
+    pid = Column( Integer )
+    return_code = Column( Integer )
+
+    archived = Column( DateTime, default = datetime.datetime.now )
+
+    user = relationship( 'User' )
+    job_status = relationship( 'JobStatus' )
+    host = relationship( 'Host' )
+
+    @property
+    def job_details( self ):
+        return self
+
+    def __repr__( self ):
+        return "ArchivedJob [{id}] command: {c}".format( id=self.id, c=self.command )
+
+
+class ArchivedJobHistory( Base ):
+    __tablename__ = 'archived_job_history'
+
+    id = Column( Integer, primary_key=True )
+
+    job_id = Column( Integer, ForeignKey( 'archived_job.id' ), nullable=False, index=True )
+    datetime = Column( DateTime )
+    job_status_id = Column( Integer, ForeignKey( 'job_status.id' ), nullable=False )
+    checked  = Column( Boolean, default=False )
+
+    job = relationship( 'ArchivedJob', backref=backref( "job_history", order_by="ArchivedJobHistory.id" ) )
+    job_status = relationship( 'JobStatus' )
+
+    
 class FinishedJob( Base ):
     __tablename__ = 'finished_job'
 
     id = Column( Integer, primary_key=True )
     
-    job_id = Column( Integer, ForeignKey( 'job.id' ), nullable=False )
+    job_id = Column( Integer, ForeignKey( 'job.id' ), nullable=False, index=True )
     job = relationship( 'Job' )
     
 
@@ -176,10 +339,11 @@ class Host( Base ):
 
     id = Column( Integer, primary_key=True )
 
-    full_name = Column( String(512) )
+    full_name = Column( String(512), index=True )
     short_name = Column( String(128) )
     max_number_occupied_slots = Column( Integer )
     total_number_slots = Column( Integer )
+    total_memory = Column( Integer )	# in MB. no limit if not given
     additional_info = Column( String(512) )
     allow_info_server = Column( Boolean )
     info_server_port = Column( Integer )
@@ -190,7 +354,7 @@ class HostSummary( Base ):
 
     id = Column( Integer, primary_key=True )
 
-    host_id = Column( Integer, ForeignKey( 'host.id' ), nullable=False )
+    host_id = Column( Integer, ForeignKey( 'host.id' ), nullable=False, index=True )
     
     available = Column( Boolean, default=False )  # whether host is in principle available to be included
     reachable = Column( Boolean, default=False )  # whether host is reachable, i.e., ready to be included
@@ -213,6 +377,9 @@ class HostLoad( Base ):
 
     host_id = Column( Integer, ForeignKey( 'host.id' ), nullable=False )
 
+    # latest load of a host
+    __table_args__ = ( Index( 'ix_host_load_host_id_datetime', 'host_id', 'datetime' ), )
+
     host = relationship( 'Host', backref="host_load" )
 
     def __repr__( self ):
@@ -240,6 +407,7 @@ class ReservedSlots( Base ):
     reservation_id = Column( Integer, ForeignKey( 'reservation.id' ), nullable=False )
     slots = Column( Integer, nullable=False )
     host_id = Column( Integer, ForeignKey( 'host.id' ), nullable=False )
+    host_slots_lowered = Column( Boolean )	# whether max_number_occupied_slots of host has been lowered by slots. NULL for reservations of older versions, which did so
     
     reservation = relationship( 'Reservation', backref=backref("reserved_slots", cascade="all, delete, delete-orphan") )
     host = relationship( 'Host', backref=backref("reserved_slots", cascade="all, delete, delete-orphan") )
@@ -0,0 +1,264 @@
+import os
+import select
+import socket
+import threading
+import time
+import errno
+from collections import deque
+from datetime import datetime
+
+# import hq libraries
+from hq.lib.hQSocket import hQSocket
+from hq.lib.hQLogger import wrapLogger
+
+
+class hQConnection( object ):
+    """state of a client connection of the event loop"""
+    __slots__ = ( 'sock', 'requestSocket', 'host', 'port', 'keepalive', 'lastActive' )
+
+    def __init__( self, sock, host, port ):
+        self.sock = sock
+        self.requestSocket = None
+        self.host = host
+        self.port = port
+        self.keepalive = False
+        self.lastActive = time.time()
+
+
+class hQEventLoop( object ):
+    """event loop based server core
+
+    A single thread waits with epoll (or poll, if epoll is not available) for new connections and
+    for requests on open connections. As soon as a request arrives, the connection is handed over
+    to a :class:`hq.lib.hQWorkerPool` which reads the request, processes it with the processor of
+    the server and sends the response. Afterwards persistent connections (see
+    :mod:`hq.lib.hQConnectionPool`) are handed back to the event loop.
+
+    Idle connections do not occupy a thread, so that the number of threads is bounded by the
+    number of workers regardless of the number of clients.
+
+    **Args**
+      | server (hQBaseServer): server
+      | workerPool (hQWorkerPool): workers which process the requests
+      | keepaliveTimeout (int): close persistent connections which have been idle for more than
+      |   keepaliveTimeout seconds
+    """
+    def __init__( self, server, workerPool, keepaliveTimeout ):
+        self.server = server
+        self.workerPool = workerPool
+        self.keepaliveTimeout = keepaliveTimeout
+
+        self.listenSocket = server.socket
+        self.listenSocket.setblocking( 0 )
+
+        if hasattr( select, 'epoll' ):
+            self.poller = select.epoll()
+            self.pollUnit = 1.		# timeout in seconds
+        else:
+            self.poller = select.poll()
+            self.pollUnit = 1000.	# timeout in milliseconds
+
+        self.readEvent = select.POLLIN | select.POLLPRI
+
+        # {<file descriptor>: hQConnection, ...} of connections waiting for a request
+        self.connections = {}
+
+        # connections which have been handed back by workers
+        self.returned = deque()
+
+        # workers wake up the event loop by writing to this pipe
+        self.wakeupRead, self.wakeupWrite = os.pipe()
+
+        self.poller.register( self.listenSocket.fileno(), self.readEvent )
+        self.poller.register( self.wakeupRead, self.readEvent )
+
+        self.writeLog = wrapLogger( self.server.logger, prefix='[event loop] ' )
+
+
+    def run( self, timeout=1 ):
+        """wait for and dispatch requests until server is shutting down
+
+        **Args**
+          | timeout (float): max time in seconds between two checks of the shutdown event
+        """
+        lastSweep = time.time()
+
+        while not self.server.shutdown_server_event.is_set():
+            try:
+                events = self.poller.poll( timeout*self.pollUnit )
+            except (IOError, select.error) as e:
+                if e.args[0]==errno.EINTR:
+                    continue
+                raise
+
+            for fd,event in events:
+                if fd==self.listenSocket.fileno():
+                    self.accept()
+                elif fd==self.wakeupRead:
+                    os.read( self.wakeupRead, 4096 )
+                else:
+                    self.dispatch( fd )
+
+            self.register_returned()
+
+            now = time.time()
+            if now-lastSweep>1:
+                self.close_idle( now )
+                lastSweep = now
+
+            self.server.after_request_processing()
+
+        self.close_all()
+
+
+    def accept( self ):
+        """accept all pending connections"""
+        while True:
+            try:
+                sock,address = self.listenSocket.accept()
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                elif e.args[0] in (errno.EMFILE, errno.ENFILE):
+                    self.writeLog( "too many open files. connection is not accepted.",
+                                   logCategory='warning' )
+                    break
+                raise
+
+            sock.setblocking( 1 )
+
+            connection = hQConnection( sock, *address[:2] )
+            self.connections[ sock.fileno() ] = connection
+            self.poller.register( sock.fileno(), self.readEvent )
+
+
+    def dispatch( self, fd ):
+        """hand over connection with a request to a worker"""
+        connection = self.connections.pop( fd, None )
+
+        if connection is None:
+            return
+
+        self.poller.unregister( fd )
+
+        if not self.workerPool.submit( self.process, connection ):
+            # answered and closed by the rejector thread of the server
+            self.server.reject( connection.sock, connection.requestSocket )
+
+
+    def process( self, connection ):
+        """read request from connection and process it. is executed by a worker
+
+        **Args**
+          | connection (hQConnection): connection with a pending request
+        """
+        currThread = threading.currentThread()
+        currThread.started = datetime.now()
+
+        writeLog = wrapLogger( self.server.logger, prefix='[{id}] '.format( id=currThread.ident ) )
+
+        try:
+            if not connection.requestSocket:
+                # ssl handshake is done here if ssl is enabled
+                connection.requestSocket = hQSocket( sock = connection.sock,
+                                                     serverSideSSLConn = True,
+                                                     catchErrors = False,
+                                                     timeout = 10 )
+            requestSocket = connection.requestSocket
+
+            receivedStr = requestSocket.recv()
+        except (socket.timeout, socket.error):
+            writeLog( "Timeout while reading from socket {h}:{p}. Skip".format( h=connection.host,
+                                                                                p=connection.port ),
+                      logCategory='warning' )
+            self.close( connection )
+            return
+
+        if not receivedStr:
+            # connection has been closed by client
+            self.close( connection )
+            return
+
+        try:
+            if not connection.keepalive and self.server.accept_keepalive( receivedStr, requestSocket ):
+                connection.keepalive = True
+            else:
+                requestSocket.sentStr = None
+
+                self.server.process_message( receivedStr, requestSocket, writeLog, connection.host, connection.port )
+
+                if connection.keepalive and requestSocket.sentStr is None:
+                    # client expects exactly one response
+                    requestSocket.send( "" )
+        except:
+            # connection is in an unknown state
+            self.close( connection )
+            raise
+
+        if connection.keepalive:
+            self.hand_back( connection )
+        else:
+            self.close( connection )
+
+
+    def hand_back( self, connection ):
+        """hand back persistent connection to event loop. is executed by a worker"""
+        connection.lastActive = time.time()
+
+        self.returned.append( connection )
+
+        # wake up event loop
+        try:
+            os.write( self.wakeupWrite, 'x' )
+        except OSError:
+            pass
+
+
+    def register_returned( self ):
+        """wait for further requests on connections which have been handed back by workers"""
+        while self.returned:
+            connection = self.returned.popleft()
+
+            sslPending = getattr( connection.requestSocket.socket, 'pending', None )
+            if sslPending and sslPending():
+                # ssl layer has already read the next request
+                if not self.workerPool.submit( self.process, connection ):
+                    self.server.reject( connection.sock, connection.requestSocket )
+                continue
+
+            fd = connection.sock.fileno()
+
+            self.connections[ fd ] = connection
+            self.poller.register( fd, self.readEvent )
+
+
+    def close_idle( self, now ):
+        """close persistent connections which have been idle for too long"""
+        for fd,connection in self.connections.items():
+            if now-connection.lastActive>self.keepaliveTimeout:
+                del self.connections[ fd ]
+                self.poller.unregister( fd )
+
+                self.close( connection )
+
+
+    def close( self, connection ):
+        """close connection and ignore errors"""
+        try:
+            connection.sock.shutdown( socket.SHUT_RDWR )
+        except:
+            pass
+
+        try:
+            connection.sock.close()
+        except:
+            pass
+
+
+    def close_all( self ):
+        """close all connections waiting for a request"""
+        for fd,connection in self.connections.items():
+            self.poller.unregister( fd )
+            self.close( connection )
+
+        self.connections = {}
@@ -19,8 +19,10 @@ import getpass
 from hq.lib.hQBaseServer import hQBaseServer,hQBaseServerHandler,hQBaseRequestProcessor
 from hq.lib.hQServerDetails import hQServerDetails
 from hq.lib.hQDBConnection import hQDBConnection
+from hq.lib.hQJobStatusCounter import hQJobStatusCounter, get_job_counts
 from hq.lib.hQCommand import hQCommand
 from hq.lib.hQSocket import hQSocket
+from hq.lib.hQConnectionPool import serverConnectionPool
 from hq.lib.daemon import Daemon
 import hq.lib.hQDatabase as db
 
@@ -31,6 +33,12 @@ hqServerDetails = hQServerDetails('hq-user-server')
 HQU_SERVER_HOST = hqServerDetails.get('host', None)
 HQU_SERVER_PORT = hqServerDetails.get('port', None)
 
+# get stored host and port from hq-server
+hqServerDetails = hQServerDetails('hq-server')
+
+HQ_SERVER_HOST = hqServerDetails.get('host', None)
+HQ_SERVER_PORT = hqServerDetails.get('port', None)
+
 USER = getpass.getuser()
 
 class hQExecServer(hQBaseServer, Daemon):
@@ -63,7 +71,7 @@ class hQExecServer(hQBaseServer, Daemon):
         # flags which indicate running processes
         self.printing_status = threading.Event()
 
-        self.user_id = dbconnection.query( db.User.id ).filter( db.User.name==self.user ).one()
+        self.user_id = dbconnection.query( db.User.id ).filter( db.User.name==self.user ).one()[0]
 
     def get_status( self, remove_connection=True ):
         """! @brief get status of server from database """
@@ -72,19 +80,8 @@ class hQExecServer(hQBaseServer, Daemon):
         self.logger.write( "print status: request database about status",
                            logCategory='debug' )
 
-        # get all number of jobs for each status type
-        query = dbconnection.query( db.JobStatus.name,
-                                    func.count('*') )\
-                                    .join( db.JobDetails )\
-                                    .join( db.Job )\
-                                    .filter( db.Job.user_id==self.user_id )\
-                                    .group_by( db.JobStatus.name )
-
-        counts = dict( query.all() )
-
-        if not counts:
-            # no jobs so far in the database
-            counts = {}
+        # get all number of jobs of user for each status type
+        counts = get_job_counts( dbconnection, user_id=self.user_id )
 
         self.logger.write( "print status: get slot info",
                            logCategory='debug' )
@@ -230,13 +227,14 @@ class hQExecServerRequestProcessor( hQBaseRequestProcessor ):
             job_id = int( job_id )
 
             # connect to database
-            dbconnection = hQDBConnection()
+            dbconnection = hQDBConnection( writer=True )
 
             # get job instance
             job = dbconnection.query( db.Job ).get( job_id )
 
             command = job.command
             shell = job.shell
+            user_id = job.user_id
 
             # create temporary file object for stdout and stderr of executing command
             fOut = tempfile.NamedTemporaryFile(prefix="hq-es.", bufsize=0, delete=True)
@@ -272,6 +270,9 @@ class hQExecServerRequestProcessor( hQBaseRequestProcessor ):
 
             # store info about running job in database
 
+            jobStatusCounter = hQJobStatusCounter()
+            jobStatusCounter.move( user_id, job.job_details.job_status_id, self.server.database_ids['running'] )
+
             # set job as running
             dbconnection.query( db.JobDetails.job_id ).\
               filter( db.JobDetails.job_id==job_id ).\
@@ -285,6 +286,7 @@ class hQExecServerRequestProcessor( hQBaseRequestProcessor ):
                                         job_status_id = self.server.database_ids['running'] )
 
             dbconnection.introduce( jobHistory )
+            jobStatusCounter.save( dbconnection )
             dbconnection.commit()
             dbconnection.remove()
 
@@ -385,6 +387,12 @@ class hQExecServerRequestProcessor( hQBaseRequestProcessor ):
             fOut.close()
             fErr.close()
 
+            # end transaction. the write lock is not held while output files are written
+            dbconnection.commit()
+            dbconnection = hQDBConnection( writer=True )
+
+            jobStatusCounter.move( user_id, self.server.database_ids['running'], self.server.database_ids['finished'] )
+
             # set job as finished
             dbconnection.query( db.JobDetails.job_id ).\
               filter( db.JobDetails.job_id==job_id ).\
@@ -401,9 +409,18 @@ class hQExecServerRequestProcessor( hQBaseRequestProcessor ):
             finishedJob = db.FinishedJob( job=job )
 
             dbconnection.introduce( finishedJob )
+            jobStatusCounter.save( dbconnection )
             dbconnection.commit()
             dbconnection.remove()
 
+            # tell hq-server that slots are free again. if hq-server is not reachable, the finished
+            # job is processed at its next periodic check of the database
+            try:
+                serverConnectionPool.request( HQ_SERVER_HOST, HQ_SERVER_PORT, "jobfinished:{j}".format( j=job_id ) )
+            except:
+                self.writeLog( 'could not notify hq-server about finished job ({j})'.format( j=job_id ),
+                               logCategory="warning" )
+
         except:
             # something went wrong.
             print traceback.print_exc()
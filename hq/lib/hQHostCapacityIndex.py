@@ -0,0 +1,313 @@
+
+from sqlalchemy import and_, func
+from collections import defaultdict
+
+# import hq libraries
+import hq.lib.hQDatabase as db
+
+
+class hQHostCapacity( object ):
+    """! @brief capacity of a single host within a scheduling round
+
+    The expected load is the latest 1-min load of the host plus the slots which have been assigned
+    to the host in the current scheduling round.
+
+    The free memory is the total memory of the host minus the estimated memory of all pending and
+    running jobs on the host. It is None if the memory of the host is not known.
+    """
+    __slots__ = ( 'id', 'full_name', 'short_name', 'total_slots', 'max_slots', 'free_slots', 'load', 'expected_load', 'total_memory', 'free_memory' )
+
+    def __init__( self, id, full_name, short_name, total_slots, max_slots, occupied_slots, load, total_memory=None ):
+        self.id = id
+        self.full_name = full_name
+        self.short_name = short_name
+        self.total_slots = total_slots or 0
+        self.max_slots = max_slots or 0
+        self.free_slots = self.max_slots - (occupied_slots or 0)
+        self.load = load
+        self.expected_load = load
+        self.total_memory = total_memory or None
+        self.free_memory = self.total_memory
+
+    def __repr__( self ):
+        return "hQHostCapacity [{id}] {n} free slots: {f}/{m} load: {l} free memory: {fm}/{tm}".format( id=self.id,
+                                                                                                         n=self.full_name,
+                                                                                                         f=self.free_slots,
+                                                                                                         m=self.max_slots,
+                                                                                                         l=self.expected_load,
+                                                                                                         fm=self.free_memory,
+                                                                                                         tm=self.total_memory )
+
+
+class hQHostCapacityIndex( object ):
+    """! @brief in-memory index of the capacity of all usable hosts
+
+    The index is build once per scheduling round with a single query. Afterwards all placement
+    decisions are made against the index and the index is updated locally by :meth:`assign` as
+    jobs are assigned to hosts.
+
+    Hosts are additionally grouped by their number of free slots, so that hosts with the fewest or
+    the most free slots can be found without looking at all hosts.
+
+    Slots of a reservation which are not occupied by jobs of the reservation are not free for
+    other jobs. They are kept in a separate pool per reservation.
+
+    @param dbconnection (hQDBConnection) connection to database
+    @param loadFactor (float) a host is considered as vacant as long as its expected load does not
+                      exceed loadFactor times its total number of slots
+    """
+    def __init__( self, dbconnection, loadFactor=1.10 ):
+        self.loadFactor = loadFactor
+
+        # {<Host.id>: hQHostCapacity, ...}
+        self.hosts = {}
+        
+        # {<free slots>: set(<Host.id>, ...), ...}
+        self.buckets = defaultdict( set )
+
+        # free reserved slots {<Reservation.id>: {<Host.id>: <free slots>, ...}, ...}
+        self.reserved = {}
+
+        self.build( dbconnection )
+
+
+    def build( self, dbconnection ):
+        """! @brief read capacity of all available, reachable and active hosts from database
+
+        hosts without any load information are not considered.
+
+        @param dbconnection (hQDBConnection) connection to database
+        """
+
+        # time of latest load of each host
+        latestLoad = dbconnection.query( db.HostLoad.host_id,
+                                         func.max( db.HostLoad.datetime ).label( 'datetime' ) )\
+                     .group_by( db.HostLoad.host_id )\
+                     .subquery()
+
+        rows = dbconnection.query( db.Host.id,
+                                   db.Host.full_name,
+                                   db.Host.short_name,
+                                   db.Host.total_number_slots,
+                                   db.Host.max_number_occupied_slots,
+                                   db.HostSummary.number_occupied_slots,
+                                   db.HostLoad.loadavg_1min,
+                                   db.Host.total_memory )\
+               .join( db.HostSummary, db.HostSummary.host_id==db.Host.id )\
+               .join( latestLoad, latestLoad.c.host_id==db.Host.id )\
+               .join( db.HostLoad, and_( db.HostLoad.host_id==db.Host.id,
+                                         db.HostLoad.datetime==latestLoad.c.datetime ) )\
+               .filter( and_( db.HostSummary.available==True,
+                              db.HostSummary.reachable==True,
+                              db.HostSummary.active==True ) )\
+               .all()
+
+        self.hosts = {}
+        self.buckets = defaultdict( set )
+        for row in rows:
+            # several loads with the same time stamp are possible. just take the first one
+            if row[0] not in self.hosts:
+                host = hQHostCapacity( *row )
+                
+                self.hosts[ host.id ] = host
+
+        self.build_memory( dbconnection )
+        self.build_reservations( dbconnection )
+        
+        for host in self.hosts.itervalues():
+            if host.free_slots>0:
+                self.buckets[ host.free_slots ].add( host.id )
+
+        return self
+
+
+    def build_memory( self, dbconnection ):
+        """! @brief subtract estimated memory of pending and running jobs from the memory of the hosts
+
+        @param dbconnection (hQDBConnection) connection to database
+        """
+        if not any( h.total_memory for h in self.hosts.itervalues() ):
+            return
+        
+        usedMemory = dbconnection.query( db.JobDetails.host_id,
+                                         func.sum( db.Job.estimated_memory ) )\
+                     .join( db.Job, db.Job.id==db.JobDetails.job_id )\
+                     .join( db.JobStatus, db.JobStatus.id==db.JobDetails.job_status_id )\
+                     .filter( db.JobStatus.name.in_( [ 'pending', 'running' ] ) )\
+                     .group_by( db.JobDetails.host_id )\
+                     .all()
+
+        for hostID,memory in usedMemory:
+            host = self.hosts.get( hostID, None )
+            
+            if host and host.total_memory and memory:
+                host.free_memory -= memory
+
+                
+    def build_reservations( self, dbconnection ):
+        """! @brief read reserved slots from database and subtract them from the free slots of the hosts
+
+        @param dbconnection (hQDBConnection) connection to database
+        """
+        self.reserved = {}
+
+        reservedSlots = dbconnection.query( db.ReservedSlots.reservation_id,
+                                            db.ReservedSlots.host_id,
+                                            db.ReservedSlots.slots )\
+                        .all()
+
+        if not reservedSlots:
+            return
+
+        # slots occupied by pending and running jobs of each reservation
+        occupiedSlots = dbconnection.query( db.Job.reservation_id,
+                                            db.JobDetails.host_id,
+                                            func.sum( db.Job.slots ) )\
+                        .join( db.JobDetails, db.JobDetails.job_id==db.Job.id )\
+                        .join( db.JobStatus, db.JobStatus.id==db.JobDetails.job_status_id )\
+                        .filter( and_( db.Job.reservation_id!=None,
+                                       db.JobStatus.name.in_( [ 'pending', 'running' ] ) ) )\
+                        .group_by( db.Job.reservation_id, db.JobDetails.host_id )\
+                        .all()
+        occupiedSlots = dict( ((r,h),s) for r,h,s in occupiedSlots )
+        
+        for reservationID,hostID,slots in reservedSlots:
+            if hostID not in self.hosts:
+                continue
+
+            freeSlots = max( slots - int( occupiedSlots.get( (reservationID,hostID), 0 ) ), 0 )
+
+            self.reserved.setdefault( reservationID, {} )[ hostID ] = freeSlots
+
+            # slots are occupied by jobs of the reservation or are kept for them
+            self.hosts[ hostID ].free_slots -= freeSlots
+
+
+    def __len__( self ):
+        return len( self.hosts )
+
+
+    def get( self, hostID ):
+        """! @brief return capacity of host with given id or None """
+        return self.hosts.get( hostID, None )
+
+
+    def free_slots( self ):
+        """! @brief return total number of free slots of all hosts in index including free reserved slots """
+        return sum( max( h.free_slots, 0 ) for h in self.hosts.itervalues() ) + \
+               sum( sum( r.itervalues() ) for r in self.reserved.itervalues() )
+
+
+    def has_memory( self, host, memory ):
+        """! @brief check whether host has at least memory MB free memory
+
+        hosts with unknown memory and jobs with unknown memory always fit.
+
+        @param host (hQHostCapacity) host
+        @param memory (float|None) required memory in MB
+
+        @return (bool)
+        """
+        return not memory or host.free_memory is None or host.free_memory >= memory
+
+    
+    def is_vacant( self, host, slots, memory=None ):
+        """! @brief check whether host has at least slots free slots and memory MB free memory
+        and whether its load allows to start a job with slots slots
+
+        @param host (hQHostCapacity) host
+        @param slots (int) number of required slots
+        @param memory (float|None) required memory in MB
+
+        @return (bool)
+        """
+        return host.free_slots >= slots and \
+               host.expected_load + slots <= self.loadFactor * host.total_slots and \
+               self.has_memory( host, memory )
+
+
+    def vacant_hosts( self, slots, excludedHosts=set([]), memory=None ):
+        """! @brief return list of vacant hosts which are not excluded
+
+        @param slots (int) number of required slots
+        @param excludedHosts (set) set of full names of hosts which should be excluded
+        @param memory (float|None) required memory in MB
+
+        @return (list) list of hQHostCapacity
+        """
+        return [ h for h in self.hosts.itervalues() if h.full_name not in excludedHosts and self.is_vacant( h, slots, memory ) ]
+
+
+    def iter_vacant_hosts( self, slots, excludedHosts=set([]), descending=False, memory=None ):
+        """! @brief iterate over vacant hosts which are not excluded ordered by their number of free slots
+
+        Only hosts with at least slots free slots are visited.
+
+        @param slots (int) number of required slots
+        @param excludedHosts (set) set of full names of hosts which should be excluded
+        @param descending (bool) if True start with the hosts with the most free slots, otherwise
+                          with the fewest free slots
+        @param memory (float|None) required memory in MB
+
+        @return (generator) hQHostCapacity instances
+        """
+        for freeSlots in sorted( [ f for f in self.buckets if f>=slots ], reverse=descending ):
+            for hostID in self.buckets[ freeSlots ]:
+                host = self.hosts[ hostID ]
+                
+                if host.full_name not in excludedHosts and self.is_vacant( host, slots, memory ):
+                    yield host
+
+
+    def iter_reserved_hosts( self, reservationID, slots, excludedHosts=set([]), memory=None ):
+        """! @brief iterate over vacant hosts with at least slots free slots of a reservation
+
+        hosts are ordered by their number of free reserved slots starting with the fewest.
+
+        @param reservationID (int) database id of reservation
+        @param slots (int) number of required slots
+        @param excludedHosts (set) set of full names of hosts which should be excluded
+        @param memory (float|None) required memory in MB
+
+        @return (generator) hQHostCapacity instances
+        """
+        pool = self.reserved.get( reservationID, {} )
+        
+        for hostID in sorted( pool, key=pool.get ):
+            host = self.hosts[ hostID ]
+            
+            if pool[ hostID ]>=slots and host.full_name not in excludedHosts and \
+                   host.expected_load + slots <= self.loadFactor * host.total_slots and \
+                   self.has_memory( host, memory ):
+                yield host
+
+                
+    def assign( self, hostID, slots, reservationID=None, memory=None ):
+        """! @brief occupy slots and memory on host
+
+        @param hostID (int) database id of host
+        @param slots (int) number of occupied slots
+        @param reservationID (int) occupy reserved slots of this reservation
+        @param memory (float|None) occupied memory in MB
+        """
+        host = self.hosts[ hostID ]
+
+        if memory and host.free_memory is not None:
+            host.free_memory -= memory
+
+        if reservationID:
+            self.reserved[ reservationID ][ hostID ] -= slots
+            host.expected_load += slots
+            
+            return
+
+        # move host into bucket of its new number of free slots
+        self.buckets[ host.free_slots ].discard( hostID )
+        if not self.buckets[ host.free_slots ]:
+            del self.buckets[ host.free_slots ]
+
+        host.free_slots -= slots
+        host.expected_load += slots
+
+        if host.free_slots>0:
+            self.buckets[ host.free_slots ].add( hostID )
@@ -1,27 +1,134 @@
 
 from sqlalchemy import and_, not_, func
+from datetime import datetime, timedelta
+from collections import defaultdict
+from bisect import insort
+import os
 import json
-from random import choice
+from random import choice, uniform
 import traceback
-from operator import attrgetter
-from collections import defaultdict
+import ConfigParser
+from sqlalchemy.orm import joinedload
 
 # import hq libraries
 from hq.lib.hQDBConnection import hQDBConnection
+from hq.lib.hQHostCapacityIndex import hQHostCapacityIndex
 import hq.lib.hQDatabase as db
 
+# path to config files
+ETCPATH = "{hqpath}/etc".format( hqpath=os.environ['HQPATH'] )
+
+# supported policies for choosing a host among all vacant hosts
+PLACEMENT_POLICIES = [ 'best-fit', 'worst-fit', 'load-weighted', 'random' ]
+DEFAULT_PLACEMENT_POLICY = 'best-fit'
+
+# fair-share priorities are updated at least every FAIRSHARE_INTERVAL seconds and, after the usage
+# of users has changed, at most every FAIRSHARE_MIN_INTERVAL seconds
+FAIRSHARE_INTERVAL = 60
+FAIRSHARE_MIN_INTERVAL = 5
+
 class hQJobSchedulerSimple( object ):
-    def __init__( self ):
-        pass
+    def __init__( self, placementPolicy=None, backfill=None, fairshare=None ):
+        """! @brief constructor
+
+        @param placementPolicy (string) one of PLACEMENT_POLICIES. if not given, the policy is
+                               read from section SCHEDULER in hq.cfg
+        @param backfill (bool) use backfilling. if not given, it is read from section SCHEDULER in
+                        hq.cfg
+        @param fairshare (bool) order waiting jobs by fair-share priorities. if not given, it is
+                         read from section SCHEDULER in hq.cfg
+        """
+        # read hQ config
+        self.config = ConfigParser.ConfigParser()
+        self.config.read( '{etcpath}/hq.cfg'.format(etcpath=ETCPATH) )
+
+        if not placementPolicy:
+            try:
+                placementPolicy = self.config.get( 'SCHEDULER', 'placement_policy' )
+            except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+                placementPolicy = DEFAULT_PLACEMENT_POLICY
+
+        if placementPolicy not in PLACEMENT_POLICIES:
+            raise ValueError( "unknown placement policy '{p}'. choose one of {l}".format( p=placementPolicy,
+                                                                                       l=', '.join( PLACEMENT_POLICIES ) ) )
+        
+        self.placementPolicy = placementPolicy
+
+        # reserve slots for the first job which cannot be started and let other jobs use idle slots
+        # only if they do not delay that job (EASY backfilling)
+        if backfill is None:
+            try:
+                backfill = self.config.getboolean( 'SCHEDULER', 'backfill' )
+            except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+                backfill = False
 
-    def next( self, numJobs=1, excludedJobIDs=set([]), returnInstances=False, logFct=None ):
+        self.backfill = backfill
+
+        # lower the priority of jobs of users who have consumed more than their share of slots
+        if fairshare is None:
+            try:
+                fairshare = self.config.getboolean( 'SCHEDULER', 'fairshare' )
+            except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+                fairshare = False
+
+        self.fairshare = fairshare
+
+        # half-life of consumed slot-seconds in hours
+        try:
+            self.usageHalfLife = self.config.getfloat( 'SCHEDULER', 'fairshare_half_life' )
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+            self.usageHalfLife = 24.0
+
+        # max time in seconds between two updates of the fair-share priorities
+        try:
+            self.fairshareInterval = self.config.getfloat( 'SCHEDULER', 'fairshare_interval' )
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+            self.fairshareInterval = FAIRSHARE_INTERVAL
+
+        # time of last update of priorities and whether usage has changed since then
+        self.lastPriorityUpdate = None
+        self.usageChanged = True
+
+        # fair-share factors of the last update of priorities: {<User.id>: <factor>, ...}, number
+        # of users with waiting jobs and their total decayed usage
+        self.shareFactors = {}
+        self.numShareUsers = 0
+        self.totalUsage = 0.0
+
+        # functions which pick a host according to the placement policy
+        self.placementFcts = { 'best-fit': self.get_best_fit_host,
+                               'worst-fit': self.get_worst_fit_host,
+                               'load-weighted': self.get_load_weighted_host,
+                               'random': self.get_random_host }
+        
+        # in-memory index of host capacities. it is build once per scheduling round
+        self.hostIndex = None
+
+        # expected releases of slots. they are read at most once per scheduling round (see
+        # get_expected_releases)
+        self.releases = None
+        self.numReleasedAssignments = 0
+
+        # {<JobStatus.name>: <JobStatus.id>, ...}
+        self.database_ids = None
+
+    def next( self, numJobs=1, excludedJobIDs=set([]), returnInstances=False, logFct=None, now=None ):
         """! @brief get next jobs which will be send to cluster
 
+        A scheduling round is executed against an in-memory index of the capacity of the hosts
+        (:class:`hq.lib.hQHostCapacityIndex.hQHostCapacityIndex`) which is build once at the
+        beginning of the round and which is updated locally as jobs are assigned to hosts.
+
+        If backfilling is used, the earliest start time of the first job which cannot be started
+        is reserved (see :meth:`reserve`). Subsequent jobs are only started if they do not delay
+        this job (see :meth:`get_backfill_host`).
+
         @param numJobs (int) maximal number of jobs which will be returned
         @param excludedJobIDs (set) set of jobIDs which should not be considered
         @param returnInstances (bool) if True return db.Job instances otherwise return job ids
+        @param now (datetime) current time. default: datetime.now()
 
-        @return (list) job ids or db.Job
+        @return (list) list of tuples (<user>,<job>,<host>) with either ids or instances
         
         @todo think about something more sophisticated than just taking the next in queue
         """
@@ -37,32 +144,52 @@ class hQJobSchedulerSimple( object ):
             
             self.logFct = dummyLog
         
+        if not now:
+            now = datetime.now()
+
+        if not self.database_ids:
+            self.database_ids = dict( dbconnection.query( db.JobStatus.name, db.JobStatus.id ).all() )
+            
+        if self.fairshare and self.priorities_outdated( now ):
+            self.setPriorities( dbconnection, now=now )
+            
         # get list of tuples (<job.id>,<host.id>)
         nextJobs = []
-        # get newly occupied slots grouped by host id
-        newlyOccupiedSlots = defaultdict( int )
+
+        # reservation for the first job which cannot be started
+        reservation = None
+        # list of tuples (<host.id>,<slots>,<estimated time>) of jobs assigned in this round
+        self.assignedJobs = []
+        self.releases = None
+
+        # build index of host capacities
+        self.hostIndex = hQHostCapacityIndex( dbconnection )
+
+        self.logFct( "   {n} vacant host{s} with {f} free slots".format( n=len(self.hostIndex),
+                                                                         s='s' if len(self.hostIndex)!=1 else '',
+                                                                         f=self.hostIndex.free_slots() ),
+                     logCategory="job_scheduler" )
+
+        if not self.hostIndex.free_slots():
+            # nothing to do
+            return nextJobs
 
         # get next waiting jobs in queue
         self.logFct( "   get {n} waiting jobs ...".format( n=numJobs ),
                      logCategory="job_scheduler" )
+
+        # load job and owner together with waiting job
+        query = dbconnection.query( db.WaitingJob )\
+                .join( db.User )\
+                .options( joinedload( db.WaitingJob.job ).joinedload( db.Job.user ) )\
+                .filter( db.User.enabled==True )
         
         if excludedJobIDs:
-            jobs = dbconnection.query( db.WaitingJob )\
-                   .join( db.User )\
-                   .join( db.Job )\
-                   .filter( db.User.enabled==True )\
-                   .filter( not_(db.Job.id.in_(excludedJobIDs) ) )\
-                   .order_by( db.WaitingJob.priorityValue )\
-                   .limit( numJobs )\
-                   .all()
-            
-        else:
-            jobs = dbconnection.query( db.WaitingJob )\
-                   .join( db.User )\
-                   .filter( db.User.enabled==True )\
-                   .order_by( db.WaitingJob.priorityValue.desc() )\
-                   .limit( numJobs )\
-                   .all()
+            query = query.filter( not_(db.WaitingJob.job_id.in_(excludedJobIDs) ) )
+
+        jobs = query.order_by( db.WaitingJob.priorityValue.desc() )\
+               .limit( numJobs )\
+               .all()
             
         self.logFct( "   ... found {n} jobs".format(n=len(jobs)),
                      logCategory="job_scheduler" )
@@ -83,11 +210,22 @@ class hQJobSchedulerSimple( object ):
             # get excluded hosts
             excludedHosts = json.loads( job.excluded_hosts )
 
-            # get vacant host which has the required number of free slots. jobs which have been
-            # processed here but have not been started are also considered
-            vacantHost = self.get_vacant_host( job.slots,
-                                               newlyOccupiedSlots,
-                                               excludedHosts=set( excludedHosts ) )
+            if job.reservation_id:
+                # job runs only in slots of its reservation
+                vacantHost = self.get_reserved_host( job,
+                                                     excludedHosts=set( excludedHosts ) )
+            elif reservation:
+                # a job has to wait. start this job only if it does not delay the waiting job
+                vacantHost = self.get_backfill_host( job,
+                                                     reservation,
+                                                     excludedHosts=set( excludedHosts ),
+                                                     now=now )
+            else:
+                # get vacant host which has the required number of free slots. jobs which have been
+                # processed here but have not been started are considered by the host index
+                vacantHost = self.get_vacant_host( job.slots,
+                                                   excludedHosts=set( excludedHosts ),
+                                                   memory=job.estimated_memory )
 
             if vacantHost:
                 if returnInstances:
@@ -95,102 +233,525 @@ class hQJobSchedulerSimple( object ):
                 else:
                     nextJobs.append( (user.id, job.id, vacantHost.id) )
                     
-                newlyOccupiedSlots[ vacantHost.id ] += job.slots
+                self.hostIndex.assign( vacantHost.id,
+                                       job.slots,
+                                       reservationID=job.reservation_id,
+                                       memory=job.estimated_memory )
+
+                if not job.reservation_id:
+                    self.assignedJobs.append( (vacantHost.id, job.slots, job.estimated_time) )
                 
+            elif self.backfill and not reservation and not job.reservation_id:
+                # reserve earliest start time for this job
+                reservation = self.reserve( job,
+                                            excludedHosts=set( excludedHosts ),
+                                            dbconnection=dbconnection,
+                                            now=now )
 
         return nextJobs
     
-        #if jobs:
-        #    # return job id
-        #    if returnInstances:
-        #        return jobs
-        #    else:
-        #        return [ j.job_id for j in jobs ]
-        #else:
-        #    # no job was found
-        #    return []
-
-        
-    def get_vacant_host( self, slots, slotDict, excludedHosts=set([]) ):
+        
+    def get_vacant_host( self, slots, excludedHosts=set([]), memory=None ):
         """! @brief get vacant host which is not in excludedHosts and has at least slots unused slots
+        and memory MB free memory
+
+        The host is looked up in the host index of the current scheduling round and chosen
+        according to the placement policy of the scheduler.
 
         @param slots (int) minimum number of free slots on vacant host
-        @param slotDict (dict) newly occupied slots grouped by host
         @param excludedHosts (set) set of full names of host which should be excluded
+        @param memory (float|None) minimum free memory in MB on vacant host
 
-        @return (@c Host|None)
+        @return (@c hQHostCapacity|None)
         """
 
-        #timeLogger = TimeLogger( prefix="getVacantHost" )
-        
-        dbconnection = hQDBConnection()
-        
-        self.logFct( "   find vacant host ...",
+        self.logFct( "   find vacant host ({p}) ...".format( p=self.placementPolicy ),
                      logCategory="job_scheduler" )
-        
-        if excludedHosts:
-            hosts = dbconnection.query( db.Host )\
-                    .join( db.HostSummary )\
-                    .filter( and_(db.HostSummary.available==True,
-                                  db.HostSummary.reachable==True,
-                                  db.HostSummary.active==True,
-                                  not_(db.Host.full_name.in_( excludedHosts ) ),
-                                  db.Host.max_number_occupied_slots >= db.HostSummary.number_occupied_slots+slots
-                                  ) )\
-                    .all()
-        else:
-            hosts = dbconnection.query( db.Host ). \
-              join( db.HostSummary ). \
-              filter( and_(db.HostSummary.available==True,
-                           db.HostSummary.reachable==True,
-                           db.HostSummary.active==True,
-                           db.Host.max_number_occupied_slots >= db.HostSummary.number_occupied_slots+slots ) ).all()
 
-        if not hosts:
+        host = self.placementFcts[ self.placementPolicy ]( slots, excludedHosts, memory )
+
+        if not host:
             self.logFct( "   ... no vacant host found.",
                          logCategory="sendingjobs" )
             
             return None
         else:
-            # check load
+            self.logFct( "   ... {h} is vacant. load is {l}. ok.".format(h=host.full_name,l=host.load),
+                         logCategory="job_scheduler" )
+
+            return host
 
-            # pick randomly a host from list
-            host = choice( hosts )
-            hostSummary = host.host_summary
+
+    def get_reserved_host( self, job, excludedHosts=set([]) ):
+        """! @brief get vacant host with enough free slots of the reservation of job
+
+        @param job (db.Job) job with reservation
+        @param excludedHosts (set) set of full names of host which should be excluded
+
+        @return (@c hQHostCapacity|None)
+        """
+        host = next( self.hostIndex.iter_reserved_hosts( job.reservation_id,
+                                                         job.slots,
+                                                         excludedHosts=excludedHosts,
+                                                         memory=job.estimated_memory ), None )
+
+        if host:
+            self.logFct( "   ... {h} has reserved slots. load is {l}. ok.".format( h=host.full_name, l=host.load ),
+                         logCategory="job_scheduler" )
+        else:
+            self.logFct( "   ... no reserved slots found.",
+                         logCategory="job_scheduler" )
+
+        return host
+
+    
+    def get_backfill_host( self, job, reservation, excludedHosts=set([]), now=None ):
+        """! @brief get vacant host for job without delaying the job for which the slots have been reserved
+
+        The job is preferably placed on any other than the reserved host. On the reserved host it
+        is only placed if it is expected to be finished before the reserved start time or if it
+        just uses slots which are not needed by the reserved job.
+
+        @param job (db.Job) job
+        @param reservation (dict) reservation returned by :meth:`reserve`
+        @param excludedHosts (set) set of full names of host which should be excluded
+        @param now (datetime) current time
+
+        @return (@c hQHostCapacity|None)
+        """
+
+        # try any other host
+        host = self.get_vacant_host( job.slots,
+                                     excludedHosts=excludedHosts | set( [ reservation['host_name'] ] ),
+                                     memory=job.estimated_memory )
+
+        if host or reservation['host_name'] in excludedHosts:
+            return host
+
+        host = self.hostIndex.get( reservation['host_id'] )
+
+        if not self.hostIndex.is_vacant( host, job.slots, job.estimated_memory ):
+            return None
+        
+        if job.estimated_time and now + timedelta( minutes=job.estimated_time ) <= reservation['start']:
+            # job is finished before the reserved job starts
+            self.logFct( "   ... backfill job {j} on {h}. it is finished before reserved start time.".format( j=job.id, h=host.full_name ),
+                         logCategory="job_scheduler" )
             
-            # get latest load
-            try:
-                hostLoad = sorted( host.host_load, key=attrgetter( 'datetime' ) )[-1]
-            except:
-                # no load is given
-                self.logFct( "   ... host {h} has no load in db. skip.".format(h=host.full_name),
-                             logCategory="job_scheduler" )
-                
-                # get another vacant host
-                excludedHosts.add( host.full_name )
+            return host
+        elif job.slots <= reservation['extra_slots']:
+            # job uses slots which are not needed by the reserved job
+            reservation['extra_slots'] -= job.slots
+
+            self.logFct( "   ... backfill job {j} on {h}. it uses slots not needed by reserved job.".format( j=job.id, h=host.full_name ),
+                         logCategory="job_scheduler" )
+            
+            return host
+
+        return None
+
+    
+    def reserve( self, job, excludedHosts=set([]), dbconnection=None, now=None ):
+        """! @brief reserve the earliest start time of job
+
+        The expected end of each pending and running job is the start time of the job in
+        JobHistory plus its estimated time. Jobs without estimated time are not expected to end.
+        The host on which job can be started earliest is reserved.
+
+        @param job (db.Job) job which has to wait
+        @param excludedHosts (set) set of full names of host which should be excluded
+        @param dbconnection (hQDBConnection) connection to database
+        @param now (datetime) current time
+
+        @return (dict|None) reservation::
+
+          {
+            'job_id': int,       # id of reserved job
+            'host_id': int,      # id of reserved host
+            'host_name': str,    # full name of reserved host
+            'start': datetime,   # expected start time of reserved job
+            'extra_slots': int   # slots on reserved host not needed by reserved job at start time
+          }
+        """
+
+        releases = self.get_expected_releases( dbconnection, now )
+
+        reservation = None
+        for host in self.hostIndex.hosts.itervalues():
+            if host.full_name in excludedHosts or host.max_slots < job.slots or \
+                   ( host.total_memory and job.estimated_memory > host.total_memory ):
+                continue
+
+            freeSlots = host.free_slots
+            start = now
+
+            # free slots until there are enough
+            for end,slots in releases[ host.id ]:
+                if freeSlots >= job.slots:
+                    break
                 
-                return self.get_vacant_host( slots, slotDict, excludedHosts=excludedHosts )
+                freeSlots += slots
+                start = max( end, now )
+
+            if freeSlots < job.slots:
+                # job cannot be started on this host in foreseeable time
+                continue
+
+            if not reservation or start < reservation['start']:
+                reservation = { 'job_id': job.id,
+                                'host_id': host.id,
+                                'host_name': host.full_name,
+                                'start': start,
+                                'extra_slots': freeSlots - job.slots }
+
+        if reservation:
+            self.logFct( "   reserve {h} at {t} for job {j}".format( h=reservation['host_name'],
+                                                                      t=str(reservation['start']),
+                                                                      j=job.id ),
+                         logCategory="job_scheduler" )
+        else:
+            self.logFct( "   start time of job {j} is unknown. nothing reserved".format( j=job.id ),
+                         logCategory="job_scheduler" )
+
+        return reservation
+
+    
+    def get_expected_releases( self, dbconnection, now ):
+        """! @brief get expected time when occupied slots are released
+
+        considers pending and running jobs as well as jobs assigned in the current round. jobs of
+        reservations are not considered since they do not release slots for other jobs.
+
+        The pending and running jobs are read only at the first call in a scheduling round. Jobs
+        which have been assigned since the previous call are added to the result of that call.
+        
+        @param dbconnection (hQDBConnection) connection to database
+        @param now (datetime) current time
+
+        @return (dict) {<Host.id>: [(<expected end>,<slots>), ...], ...} sorted by expected end
+        """
 
-            expectedNewLoad = hostLoad.loadavg_1min + slotDict[ host.id ] + slots
-            if expectedNewLoad <= 1.10 * host.total_number_slots:
-                self.logFct( "   ... {h} is vacant. load is {l}. ok.".format(h=host.full_name,l=hostLoad.loadavg_1min),
-                             logCategory="job_scheduler" )
+        if self.releases is None:
+            self.releases = self.read_expected_releases( dbconnection, now )
+            self.numReleasedAssignments = 0
+
+        # jobs assigned in this round start now
+        for hostID,slots,estimatedTime in self.assignedJobs[ self.numReleasedAssignments: ]:
+            if estimatedTime:
+                insort( self.releases[ hostID ], ( now + timedelta( minutes=estimatedTime ), slots ) )
+
+        self.numReleasedAssignments = len( self.assignedJobs )
+
+        return self.releases
+
+
+    def read_expected_releases( self, dbconnection, now ):
+        """! @brief read expected time when slots of pending and running jobs are released
+
+        @param dbconnection (hQDBConnection) connection to database
+        @param now (datetime) current time
+
+        @return (dict) {<Host.id>: [(<expected end>,<slots>), ...], ...} sorted by expected end
+        """
+        releases = defaultdict( list )
+
+        # start time of each pending or running job. pending jobs have not been started yet
+        rows = dbconnection.query( db.JobDetails.host_id,
+                                   db.Job.slots,
+                                   db.Job.estimated_time,
+                                   func.max( db.JobHistory.datetime ) )\
+               .select_from( db.JobDetails )\
+               .join( db.Job, db.Job.id==db.JobDetails.job_id )\
+               .outerjoin( db.JobHistory, and_( db.JobHistory.job_id==db.JobDetails.job_id,
+                                                db.JobHistory.job_status_id==self.database_ids['running'] ) )\
+               .filter( and_( db.JobDetails.job_status_id.in_( [ self.database_ids['pending'],
+                                                                 self.database_ids['running'] ] ),
+                              db.Job.reservation_id==None ) )\
+               .group_by( db.JobDetails.job_id, db.JobDetails.host_id, db.Job.slots, db.Job.estimated_time )\
+               .all()
+
+        for hostID,slots,estimatedTime,started in rows:
+            if estimatedTime:
+                releases[ hostID ].append( ( (started or now) + timedelta( minutes=estimatedTime ), slots ) )
+
+        for hostID in releases:
+            releases[ hostID ].sort()
+
+        return releases
+
+    
+    def get_best_fit_host( self, slots, excludedHosts, memory=None ):
+        """! @brief get vacant host with the fewest free slots
+
+        Jobs are packed onto as few hosts as possible, so that hosts with many free slots remain
+        for jobs which require many slots.
+        """
+        return next( self.hostIndex.iter_vacant_hosts( slots, excludedHosts=excludedHosts, memory=memory ), None )
+
+    
+    def get_worst_fit_host( self, slots, excludedHosts, memory=None ):
+        """! @brief get vacant host with the most free slots
+
+        Jobs are spread over all hosts.
+        """
+        return next( self.hostIndex.iter_vacant_hosts( slots, excludedHosts=excludedHosts, descending=True, memory=memory ), None )
+
+    
+    def get_load_weighted_host( self, slots, excludedHosts, memory=None ):
+        """! @brief pick randomly a vacant host. the probability of a host is proportional to the
+        load which can still be added to the host
+        """
+        hosts = self.hostIndex.vacant_hosts( slots, excludedHosts=excludedHosts, memory=memory )
+
+        if not hosts:
+            return None
+
+        # remaining load capacity of each host after the job has been started
+        weights = [ self.hostIndex.loadFactor * h.total_slots - h.expected_load - slots for h in hosts ]
+        total = sum( weights )
+
+        if total<=0:
+            return choice( hosts )
+        
+        r = uniform( 0, total )
+        for host,weight in zip( hosts, weights ):
+            r -= weight
+            if r<=0:
                 return host
+            
+        return hosts[-1]
+
+    
+    def get_random_host( self, slots, excludedHosts, memory=None ):
+        """! @brief pick randomly a vacant host """
+        hosts = self.hostIndex.vacant_hosts( slots, excludedHosts=excludedHosts, memory=memory )
+
+        if hosts:
+            return choice( hosts )
+        else:
+            return None
+
+            
+    def decay( self, usage, lastUpdate, now ):
+        """! @brief decay usage from lastUpdate to now with half-life :attr:`usageHalfLife`
+
+        @param usage (float) usage at lastUpdate
+        @param lastUpdate (datetime) time of usage
+        @param now (datetime) current time
+
+        @return (float) usage at now
+        """
+        if not usage or not lastUpdate:
+            return usage or 0.0
+        
+        hours = max( (now - lastUpdate).total_seconds(), 0 ) / 3600.0
+        
+        return usage * 0.5 ** ( hours / self.usageHalfLife )
+
+    
+    def update_usage( self, dbconnection, jobIDs, now=None ):
+        """! @brief add slot-seconds of finished jobs to the usage of their owners
+
+        The run time of a job is the time between its running and finished entries in
+        JobHistory. Only the given jobs are considered, so each finished job is accounted once
+        when it is processed and the history is never scanned as a whole. The consumed
+        slot-seconds are decayed from the end of the job to now.
+
+        The changes are not committed.
+
+        @param dbconnection (hQDBConnection) connection to database
+        @param jobIDs (list) ids of finished jobs
+        @param now (datetime) current time. default: datetime.now()
+        """
+        if not jobIDs:
+            return
+        
+        if not now:
+            now = datetime.now()
+            
+        if not self.database_ids:
+            self.database_ids = dict( dbconnection.query( db.JobStatus.name, db.JobStatus.id ).all() )
+
+        runningID = self.database_ids['running']
+        finishedID = self.database_ids['finished']
+        
+        rows = dbconnection.query( db.Job.id,
+                                   db.Job.user_id,
+                                   db.Job.slots,
+                                   db.JobHistory.job_status_id,
+                                   func.max( db.JobHistory.datetime ) )\
+               .join( db.JobHistory, db.JobHistory.job_id==db.Job.id )\
+               .filter( and_( db.Job.id.in_( jobIDs ),
+                              db.JobHistory.job_status_id.in_( [ runningID, finishedID ] ) ) )\
+               .group_by( db.Job.id, db.Job.user_id, db.Job.slots, db.JobHistory.job_status_id )\
+               .all()
+
+        # {<Job.id>: [<User.id>, <slots>, <start>, <end>], ...}
+        runs = {}
+        for jobID,userID,slots,statusID,dt in rows:
+            run = runs.setdefault( jobID, [ userID, slots, None, now ] )
+
+            if statusID==runningID:
+                run[2] = dt
             else:
-                # load is too high
-                self.logFct( "   ... {h} is vacant. load is {l}. too high. skip".format(h=host.full_name,l=hostLoad.loadavg_1min),
-                             logCategory="job_scheduler" )
+                run[3] = dt
 
-                # get another vacant host
-                excludedHosts.add( host.full_name )
-                
-                return self.get_vacant_host( slots, slotDict, excludedHosts=excludedHosts )
+        # {<User.id>: <slot-seconds>, ...}
+        consumed = defaultdict( float )
+        for userID,slots,start,end in runs.itervalues():
+            if start and end>start:
+                consumed[ userID ] += self.decay( slots * (end-start).total_seconds(), end, now )
+
+        if not consumed:
+            return
+
+        self.usageChanged = True
 
+        usages = dict( (u.user_id,u) for u in dbconnection.query( db.UserUsage ).filter( db.UserUsage.user_id.in_( consumed.keys() ) ).all() )
+        
+        for userID,slotSeconds in consumed.iteritems():
+            userUsage = usages.get( userID, None )
             
-    def setPriorities( self ):
+            if userUsage:
+                userUsage.usage = self.decay( userUsage.usage, userUsage.last_update, now ) + slotSeconds
+                userUsage.last_update = now
+            else:
+                dbconnection.introduce( db.UserUsage( user_id=userID,
+                                                      usage=slotSeconds,
+                                                      last_update=now ) )
+
+        
+    def priorities_outdated( self, now ):
+        """! @brief check whether the fair-share priorities of the waiting jobs have to be updated
+
+        The usages of all users decay with the same half-life, so that the priorities change only
+        if the usage of a user has changed by :meth:`update_usage`. They are updated then, but at
+        most every FAIRSHARE_MIN_INTERVAL seconds. Otherwise they are updated every
+        fairshareInterval seconds. Jobs which are added in the meantime get their priority from
+        :meth:`get_priority_value`.
+
+        @param now (datetime) current time
+
+        @return (bool)
+        """
+        if self.lastPriorityUpdate is None:
+            return True
+
+        elapsed = (now-self.lastPriorityUpdate).total_seconds()
+
+        if self.usageChanged and elapsed>=FAIRSHARE_MIN_INTERVAL:
+            return True
+
+        return elapsed>=self.fairshareInterval
+
+        
+    def share_factor( self, usage, numUsers, totalUsage ):
+        """! @brief fair-share factor of a user
+
+        @param usage (float) decayed usage of user
+        @param numUsers (int) number of users with waiting jobs
+        @param totalUsage (float) decayed usage of all users with waiting jobs
+
+        @return (float) 2**( -N * U/U_total ), 1.0 if nothing has been consumed
+        """
+        if totalUsage>0:
+            return 0.5 ** ( numUsers * usage / totalUsage )
+        else:
+            return 1.0
+
+
+    def get_priority_value( self, dbconnection, userID, value, now=None ):
+        """! @brief priority value of a job of a user which becomes a waiting job
+
+        Without fair-share, the priority value is the priority of the job. Otherwise, the
+        priority of the job is scaled with the fair-share factor of the user as in
+        :meth:`setPriorities`, so that new jobs are ordered consistently with the jobs which are
+        already waiting. Users who have had no waiting jobs at the last update are added to the
+        users of that update.
+
+        @param dbconnection (hQDBConnection) connection to database
+        @param userID (int) id of owner of job
+        @param value (int) priority of job (0..127)
+        @param now (datetime) current time. default: datetime.now()
+
+        @return (float) value of WaitingJob.priorityValue
+        """
+        if not self.fairshare:
+            return value
+
+        factor = self.shareFactors.get( userID, None )
+
+        if factor is None:
+            if not now:
+                now = datetime.now()
+
+            userUsage = dbconnection.query( db.UserUsage ).filter( db.UserUsage.user_id==userID ).first()
+            usage = self.decay( userUsage.usage, userUsage.last_update, now ) if userUsage else 0.0
+
+            factor = self.share_factor( usage, self.numShareUsers+1, self.totalUsage+usage )
+            self.shareFactors[ userID ] = factor
+
+        return (1.0 + value)/128.0 * factor
+
+        
+    def setPriorities( self, dbconnection=None, now=None ):
         """! @brief set priorities of all waiting jobs
 
-        1.0 + priority.value)/128
+        The priority of a waiting job is
+
+          (1.0 + priority.value)/128 * 2**( -N * U/U_total )
+
+        where U is the decayed usage of the owner, U_total the decayed usage of all N users with
+        waiting jobs. Hence, users who have consumed more than their share get a lower priority.
+        Priorities are updated in bulk with a single statement per user.
+
+        @param dbconnection (hQDBConnection) connection to database
+        @param now (datetime) current time. default: datetime.now()
         """
-        pass
+        if not dbconnection:
+            dbconnection = hQDBConnection()
+
+        if not now:
+            now = datetime.now()
+
+        self.lastPriorityUpdate = now
+        self.usageChanged = False
+
+        # users with waiting jobs and their usage
+        rows = dbconnection.query( db.WaitingJob.user_id,
+                                   db.UserUsage.usage,
+                                   db.UserUsage.last_update )\
+               .outerjoin( db.UserUsage, db.UserUsage.user_id==db.WaitingJob.user_id )\
+               .distinct()\
+               .all()
+
+        if not rows:
+            self.numShareUsers = 0
+            self.totalUsage = 0.0
+            self.shareFactors = {}
+            return
+        
+        usages = dict( (userID,self.decay( usage, lastUpdate, now )) for userID,usage,lastUpdate in rows )
+        totalUsage = sum( usages.values() )
+
+        shareFactors = dict( (userID,self.share_factor( usage, len(usages), totalUsage )) for userID,usage in usages.iteritems() )
+
+        # priority of job given at submission
+        priorityValue = dbconnection.query( db.Priority.value )\
+                        .join( db.Job, db.Job.priority_id==db.Priority.id )\
+                        .filter( db.Job.id==db.WaitingJob.job_id )\
+                        .as_scalar()
+
+        for userID,factor in shareFactors.iteritems():
+            dbconnection.query( db.WaitingJob )\
+              .filter( db.WaitingJob.user_id==userID )\
+              .update( { db.WaitingJob.priorityValue: (1.0 + priorityValue)/128.0 * factor },
+                       synchronize_session=False )
+
+        dbconnection.commit()
+
+        # new waiting jobs get their priority from these factors (see get_priority_value)
+        self.numShareUsers = len( usages )
+        self.totalUsage = totalUsage
+        self.shareFactors = shareFactors
     
@@ -0,0 +1,144 @@
+"""counters of the number of jobs per user and job status
+
+The number of jobs of each user in each job status is kept in the table ``job_status_counter``
+(:class:`hq.lib.hQDatabase.JobStatusCounter`), so that the status of the servers is read without
+counting the jobs. The counters are changed in the same transaction as the status of the jobs.
+The total number of jobs in a status is the sum over the counters of all users.
+
+The counters are rebuilt from the job details by :func:`rebuild_job_counters`, e.g., at the start
+of hq-server or with the command ``reconcilecounters``.
+"""
+
+from collections import defaultdict
+from sqlalchemy import and_, func
+
+# import hq libraries
+import hq.lib.hQDatabase as db
+
+
+class hQJobStatusCounter( object ):
+    """changes of the number of jobs per user and job status
+
+    Changes are collected while the status of jobs is changed and are written with :meth:`save`
+    before the transaction is committed.
+    """
+    def __init__( self ):
+        # {(<User.id>,<JobStatus.id>): <change of number of jobs>, ...}
+        self.changes = defaultdict( int )
+
+
+    def add( self, user_id, job_status_id, number=1 ):
+        """count new jobs
+
+        **Args**
+          | user_id (int): id of owner of jobs
+          | job_status_id (int): id of status of jobs
+          | number (int): number of jobs
+        """
+        self.changes[ (user_id, job_status_id) ] += number
+
+
+    def move( self, user_id, from_status_id, to_status_id, number=1 ):
+        """count change of status of jobs
+
+        **Args**
+          | user_id (int): id of owner of jobs
+          | from_status_id (int): id of previous status of jobs
+          | to_status_id (int): id of new status of jobs
+          | number (int): number of jobs
+        """
+        if from_status_id==to_status_id:
+            return
+
+        self.changes[ (user_id, from_status_id) ] -= number
+        self.changes[ (user_id, to_status_id) ] += number
+
+
+    def save( self, dbconnection ):
+        """write collected changes to database. the transaction is not committed.
+
+        The counters are changed in a fixed order, so that concurrent transactions do not
+        deadlock.
+
+        **Args**
+          | dbconnection (hQDBConnection): connection to database
+        """
+        for (user_id, job_status_id),number in sorted( self.changes.iteritems() ):
+            if number==0:
+                continue
+
+            updated = dbconnection.query( db.JobStatusCounter )\
+                      .filter( and_( db.JobStatusCounter.user_id==user_id,
+                                     db.JobStatusCounter.job_status_id==job_status_id ) )\
+                      .update( { db.JobStatusCounter.count: db.JobStatusCounter.count + number },
+                               synchronize_session=False )
+
+            if not updated:
+                # counters of a user are usually created by rebuild_job_counters
+                dbconnection.introduce( db.JobStatusCounter( user_id=user_id,
+                                                             job_status_id=job_status_id,
+                                                             count=number ) )
+
+        self.changes.clear()
+
+
+def get_job_counts( dbconnection, user_id=None ):
+    """get number of jobs in each job status
+
+    **Args**
+      | dbconnection (hQDBConnection): connection to database
+      | user_id (int): count only jobs of this user. all jobs are counted if None
+
+    **Returns**
+      dict: {<JobStatus.name>: <number of jobs>, ...}
+    """
+    query = dbconnection.query( db.JobStatus.name,
+                                func.sum( db.JobStatusCounter.count ) )\
+            .join( db.JobStatusCounter, db.JobStatusCounter.job_status_id==db.JobStatus.id )
+
+    if user_id is not None:
+        query = query.filter( db.JobStatusCounter.user_id==user_id )
+
+    return dict( (name, int( count )) for name,count in query.group_by( db.JobStatus.name ).all() if count is not None )
+
+
+def rebuild_job_counters( dbconnection ):
+    """set counters to the number of jobs of each user and job status in the job details
+
+    A counter is created for each user and job status. The transaction is not committed.
+
+    **Args**
+      | dbconnection (hQDBConnection): connection to database
+
+    **Returns**
+      dict: {(<User.id>,<JobStatus.id>): (<previous count>,<count>), ...} of changed counters
+    """
+    counts = dict( ((user_id, job_status_id), count) for user_id,job_status_id,count in dbconnection.query( db.Job.user_id,
+                                                                                                            db.JobDetails.job_status_id,
+                                                                                                            func.count('*') )\
+                                                                                           .join( db.JobDetails, db.JobDetails.job_id==db.Job.id )\
+                                                                                           .group_by( db.Job.user_id, db.JobDetails.job_status_id )\
+                                                                                           .all() )
+
+    counters = dict( ((c.user_id, c.job_status_id), c) for c in dbconnection.query( db.JobStatusCounter ).all() )
+
+    userIDs = [ user_id for user_id, in dbconnection.query( db.User.id ).all() ]
+    jobStatusIDs = [ job_status_id for job_status_id, in dbconnection.query( db.JobStatus.id ).all() ]
+
+    keys = set( (user_id, job_status_id) for user_id in userIDs for job_status_id in jobStatusIDs ) | set( counts ) | set( counters )
+
+    changed = {}
+    for key in sorted( keys ):
+        count = counts.get( key, 0 )
+
+        if key not in counters:
+            dbconnection.introduce( db.JobStatusCounter( user_id=key[0],
+                                                         job_status_id=key[1],
+                                                         count=count ) )
+            if count:
+                changed[ key ] = (0, count)
+        elif counters[ key ].count!=count:
+            changed[ key ] = (counters[ key ].count, count)
+            counters[ key ].count = count
+
+    return changed
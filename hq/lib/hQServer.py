@@ -2,16 +2,18 @@
 from datetime import datetime,timedelta
 from time import sleep
 import threading
-from sqlalchemy import and_, or_, not_, func
+from sqlalchemy import and_, or_, not_, func, select
 from operator import itemgetter, attrgetter
 from sqlalchemy.orm.exc import NoResultFound
 import json
 import traceback
 import sys
 from collections import defaultdict
+from itertools import chain
 from pprint import pprint as pp
 import random
 import gc
+import uuid
 
 
 
@@ -20,11 +22,106 @@ from hq.lib.hQBaseServer import hQBaseServer,hQBaseServerHandler,hQBaseRequestPr
 from hq.lib.hQServerDetails import hQServerDetails
 from hq.lib.hQDBConnection import hQDBConnection
 from hq.lib.hQSocket import hQSocket
+from hq.lib.hQConnectionPool import serverConnectionPool
 from hq.lib.hQCommand import hQCommand
 from hq.lib.hQUtils import hQPingHost, hQHostLoad, qprint
 from hq.lib.hQJobSchedulerSimple import hQJobSchedulerSimple
+from hq.lib.hQArchiver import hQArchiver, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE
+from hq.lib.hQJobStatusCounter import hQJobStatusCounter, get_job_counts, rebuild_job_counters
 import hq.lib.hQDatabase as db
 
+# supported types of job dependencies
+DEPENDENCY_TYPES = [ 'afterok', 'afterany' ]
+
+# max number of rows in a single multi-row insert
+BULK_INSERT_SIZE = 1000
+
+
+def parse_dependencies( dependencies ):
+    """parse dependencies of a job
+
+    **Args**
+      | dependencies (string): comma separated list of ``TYPE:ID[:ID...]``, e.g., ``afterok:12:13,afterany:14``.
+      |   ``afterok``: job starts after the given jobs have been finished successfully. job is cancelled if one of them fails.
+      |   ``afterany``: job starts after the given jobs have been finished or cancelled.
+
+    **Returns**
+      list: list of tuples (<type>,<job id>)
+
+    **Raises**
+      ValueError: if dependencies are malformed
+    """
+    parsed = []
+    for entry in dependencies.split(','):
+        entry = entry.strip()
+        
+        if not entry:
+            continue
+
+        fields = entry.split(':')
+        
+        if fields[0] not in DEPENDENCY_TYPES or len(fields)<2:
+            raise ValueError( "invalid dependency '{d}'".format( d=entry ) )
+
+        parsed.extend( (fields[0], int(jobID)) for jobID in fields[1:] )
+
+    return parsed
+
+
+def compress_ids( ids ):
+    """compress ids into ranges of consecutive ids
+
+    **Args**
+      | ids (list): list of ints
+
+    **Returns**
+      list: list of strings ``FIRST-LAST`` or ``ID``, e.g., ``['12-110', '114']``
+    """
+    ranges = []
+    for jobID in ids:
+        if ranges and ranges[-1][1]+1==jobID:
+            ranges[-1][1] = jobID
+        else:
+            ranges.append( [ jobID, jobID ] )
+
+    return [ "{f}-{l}".format( f=f, l=l ) if f!=l else str(f) for f,l in ranges ]
+
+
+def bulk_insert( dbconnection, table, rows ):
+    """insert rows into table with multi-row inserts of at most :obj:`BULK_INSERT_SIZE` rows
+
+    **Args**
+      | dbconnection (hQDBConnection): connection to database
+      | table (Table): table
+      | rows (list): list of dicts. each dict has the same keys
+    """
+    for idx in xrange( 0, len(rows), BULK_INSERT_SIZE ):
+        dbconnection.session.execute( table.insert(), rows[ idx:idx+BULK_INSERT_SIZE ] )
+
+
+def parse_array_range( arrayRange ):
+    """parse index range of a job array
+
+    **Args**
+      | arrayRange (string): ``FIRST-LAST``, e.g., ``1-100``
+
+    **Returns**
+      tuple: (<first index>,<last index>)
+
+    **Raises**
+      ValueError: if range is malformed
+    """
+    try:
+        first,last = [ int(i) for i in arrayRange.split('-') ]
+    except ValueError:
+        raise ValueError( "invalid array range '{r}'".format( r=arrayRange ) )
+    
+    if last<first:
+        raise ValueError( "invalid array range '{r}'".format( r=arrayRange ) )
+    
+    return first,last
+
+
 class hQServer(hQBaseServer):
     """main hq server
 
@@ -49,8 +146,13 @@ class hQServer(hQBaseServer):
                                               'interval': 5,
                                               'description': "update periodically load of hosts" },
                        'check_database': { 'fct': self.check_database,
-                                           'interval': 1,
-                                           'description': "check database for finished jobs and free occupied slots. afterwards, send jobs to user if there are free slots."},
+                                           'interval': 30,
+                                           'wakeup': threading.Event(),
+                                           'coalesce': 0.05,
+                                           'description': "check database for finished jobs and free occupied slots. afterwards, send jobs to user if there are free slots. is woken up by new, finished and reset jobs."},
+                       'archive_jobs': { 'fct': self.archive_jobs,
+                                         'interval': 3600,
+                                         'description': "move jobs which have been finished long ago into the archive tables."},
                        'do_nothing': { 'fct': self.do_nothing,
                                       'interval': 1,
                                       'description': "just for debugging."},
@@ -64,10 +166,25 @@ class hQServer(hQBaseServer):
         self.updating_load_hosts = threading.Event()
 
         self.jobScheduler = hQJobSchedulerSimple()
+
+        # archival of finished jobs. is disabled if archive_after_days is 0
+        archiveAfterDays = float( self.get_server_option( 'archive_after_days', ARCHIVE_AFTER_DAYS ) )
+        if archiveAfterDays>0:
+            self.archiver = hQArchiver( archiveAfterDays=archiveAfterDays,
+                                        batchSize=int( self.get_server_option( 'archive_batch_size', ARCHIVE_BATCH_SIZE ) ) )
+        else:
+            self.archiver = None
+            del self.loops[ 'archive_jobs' ]
+
+        # serializes the resolution of job dependencies and the submission of dependent jobs
+        self.dependencyLock = threading.Lock()
         
         # activity status of cluster
         self.active = threading.Event()
 
+        # counters might be out of sync with the jobs after a restart or an update of hq
+        self.reconcile_job_counters()
+
     
     def init_database_ids( self ):
         """save some database ids in :attr:`hQBaseServer.database_ids`
@@ -78,6 +195,28 @@ class hQServer(hQBaseServer):
         self.database_ids = dict( dbconnection.query( db.JobStatus.name, db.JobStatus.id ).all() )
         
 
+    def reconcile_job_counters( self ):
+        """rebuild the counters of jobs per user and job status from the jobs in the database
+
+        **Returns**
+          dict: {(<User.id>,<JobStatus.id>): (<previous count>,<count>), ...} of corrected counters
+        """
+        dbconnection = hQDBConnection( writer=True )
+
+        changed = rebuild_job_counters( dbconnection )
+        dbconnection.commit()
+
+        for (user_id,job_status_id),(previousCount,count) in sorted( changed.iteritems() ):
+            self.logger.write( "job counter of user {u} and status {s} corrected from {p} to {c}".format( u=user_id,
+                                                                                                          s=job_status_id,
+                                                                                                          p=previousCount,
+                                                                                                          c=count ),
+                               logCategory='debug' )
+
+        dbconnection.remove()
+
+        return changed
+
         
     def get_status( self, remove_connection=True ):
         """get status of server from database
@@ -106,16 +245,7 @@ class hQServer(hQBaseServer):
                            logCategory='debug' )
 
         # get all number of jobs for each status type
-        query = dbconnection.query( db.JobStatus.name,
-                                    func.count('*') )\
-                .join( db.JobDetails )\
-                .group_by( db.JobStatus.name )
-
-        counts = dict( query.all() )
-
-        if not counts:
-            # no jobs so far in the database
-            counts = {}
+        counts = get_job_counts( dbconnection )
 
         self.logger.write( "print status: get slot info",
                            logCategory='debug' )
@@ -200,7 +330,7 @@ class hQServer(hQBaseServer):
                            logCategory='debug')
 
         # connection to database
-        dbconnection = hQDBConnection()
+        dbconnection = hQDBConnection( writer=True )
         
         #timeLogger.log( "get finished jobs ..." )
         finishedJobs = dbconnection.query( db.FinishedJob ).all()
@@ -220,6 +350,13 @@ class hQServer(hQBaseServer):
 
                 dbconnection.delete( finishedJob )
 
+            # account consumed slot-seconds of the owners of the finished jobs
+            self.jobScheduler.update_usage( dbconnection, [ f.job_id for f in finishedJobs ] )
+
+            # release jobs which have been waiting for the finished jobs
+            with self.dependencyLock:
+                self.resolve_dependencies( dbconnection, [ f.job_id for f in finishedJobs ] )
+
             # free occupied slots on host
             for h in occupiedSlots:
                 oSlots = occupiedSlots[h]
@@ -269,65 +406,98 @@ class hQServer(hQBaseServer):
                                    logCategory="debug" )
 
                 if freeSlots>0:
+                    # create tasks of job arrays for free slots
+                    self.expand_job_arrays( dbconnection, freeSlots )
+                    
                     # get list [ (<jobID>,<hostID>), ... ]
                     jobs = self.jobScheduler.next( numJobs=freeSlots,
                                                    returnInstances=True,
                                                    logFct=self.logger.write  )
                     
+                    # {<User.id>: [ (<Job.id>,<slots>,<Host.id>,<Host.full_name>), ... ], ...}
                     jobsDict = defaultdict( list )
 
-                    [ jobsDict[user.id].append( {'job': job,
-                                                 'host': host } ) for (user,job,host) in jobs ]
+                    [ jobsDict[user.id].append( (job.id, job.slots, host.id, host.full_name) ) for (user,job,host) in jobs ]
+
+                    # hq-user-servers are contacted outside of any transaction, so that the write
+                    # lock (on SQLite) is not held during network I/O. jobs and users are kept as
+                    # plain values which are not reloaded from the database
+                    users = dict( (u.id, { 'id': u.id,
+                                           'name': u.name,
+                                           'hq_user_server_host': u.hq_user_server_host,
+                                           'hq_user_server_port': u.hq_user_server_port,
+                                           'last_check': u.last_check,
+                                           'idle_time': u.idle_time } )
+                                  for u in dbconnection.query( db.User ).filter( db.User.id.in_( jobsDict.keys() ) ) ) if jobsDict else {}
+
+                    dbconnection.commit()
+
+                    jobStatusCounter = hQJobStatusCounter()
 
                     for user_id in jobsDict:
-                        user = dbconnection.query( db.User ).get( user_id )
+                        user = users[ user_id ]
+
+                        reachable = self.ping_user( user )
+
+                        if reachable is not None:
+                            # store result of ping
+                            dbconnection.query( db.User )\
+                              .filter( db.User.id==user_id )\
+                              .update( { db.User.last_check: user['last_check'],
+                                         db.User.idle_time: user['idle_time'] } )
 
-                        if not self.ping_user( user, dbconnection ):
+                        if not reachable:
                             # hq user host is not reachable
                             # skip this user
+                            dbconnection.commit()
                             break
                         
                         # group jobs by host
                         jobsGroupedByHost = {}
                         
-                        for d in jobsDict[ user_id ]:
-                            job = d['job']
-                            host = d['host']
-
-                            if host.id not in jobsGroupedByHost:
-                                jobsGroupedByHost[ host.id ] = { 'host_id': host.id,
-                                                                 'host_full_name': host.full_name,
-                                                                 'jobs': []
-                                                                 }
-                            # set job as pending
-                            dbconnection.query( db.JobDetails.job_id ).\
-                              filter( db.JobDetails.job_id==job.id ).\
-                              update( { db.JobDetails.job_status_id: self.database_ids['pending'],
-                                        db.JobDetails.host_id: host.id } )
+                        for jobID,slots,hostID,hostFullName in jobsDict[ user_id ]:
+                            # set job as pending if it is still waiting, i.e., it has not been
+                            # cancelled since it has been chosen
+                            updated = dbconnection.query( db.JobDetails.job_id ).\
+                                      filter( and_( db.JobDetails.job_id==jobID,
+                                                    db.JobDetails.job_status_id==self.database_ids['waiting'] ) ).\
+                                      update( { db.JobDetails.job_status_id: self.database_ids['pending'],
+                                                db.JobDetails.host_id: hostID },
+                                              synchronize_session=False )
+
+                            if not updated:
+                                continue
 
                             # reduce slots in host
                             dbconnection.query( db.HostSummary ).\
-                              filter( db.HostSummary.host_id==host.id ).\
-                              update( { db.HostSummary.number_occupied_slots: db.HostSummary.number_occupied_slots+job.slots })
+                              filter( db.HostSummary.host_id==hostID ).\
+                              update( { db.HostSummary.number_occupied_slots: db.HostSummary.number_occupied_slots+slots })
 
                             # set history
-                            jobHistory = db.JobHistory( job=job,
+                            jobHistory = db.JobHistory( job_id=jobID,
                                                         job_status_id = self.database_ids['pending'] )
 
                             # remove job from waiting list
-                            dbconnection.query( db.WaitingJob ).filter( db.WaitingJob.job_id==job.id ).delete()
+                            dbconnection.query( db.WaitingJob ).filter( db.WaitingJob.job_id==jobID ).delete()
 
                             dbconnection.introduce( jobHistory )
+
+                            jobStatusCounter.move( user_id, self.database_ids['waiting'], self.database_ids['pending'] )
                             
-                            jobsGroupedByHost[ host.id ][ 'jobs' ].append( job.id )
-                            
-                            freeSlots -= job.slots
+                            if hostID not in jobsGroupedByHost:
+                                jobsGroupedByHost[ hostID ] = { 'host_id': hostID,
+                                                                'host_full_name': hostFullName,
+                                                                'jobs': []
+                                                                }
+
+                            jobsGroupedByHost[ hostID ][ 'jobs' ].append( jobID )
+
+                        jobStatusCounter.save( dbconnection )
                                             
                         dbconnection.commit()
 
-                        cmd = 'run:{l}'.format( l=json.dumps( jobsGroupedByHost ) )
-
-                        self.send_to_user( cmd, user, dbconnection )
+                        if jobsGroupedByHost:
+                            self.send_to_user( 'run', user, dbconnection, payload=jobsGroupedByHost )
                         
                 t2 = datetime.now()
                 self.logger.write( "... done in {dt}s.".format(dt=str(t2-t1) ),
@@ -345,6 +515,24 @@ class hQServer(hQBaseServer):
                            logCategory='debug')
 
     
+    def archive_jobs( self ):
+        """move jobs which have been finished before the archival period into the archive tables
+
+        see :class:`hq.lib.hQArchiver.hQArchiver`
+        """
+        dbconnection = hQDBConnection( writer=True )
+
+        numArchived = self.archiver.archive( dbconnection,
+                                             stopEvent=self.shutdown_server_event,
+                                             logFct=self.logger.write )
+
+        if numArchived:
+            self.logger.write( "archived {n} job{s}".format( n=numArchived, s='s' if numArchived>1 else '' ),
+                               logCategory='system' )
+
+        dbconnection.remove()
+
+        
     def set_reachability_hosts( self, hosts=[] ):
         """set reachability of hosts given in list or check all in database 
 
@@ -366,6 +554,9 @@ class hQServer(hQBaseServer):
         if not hosts:
             # get all hosts given in database
             hosts = map(itemgetter(0), dbconnection.query( db.Host.full_name ).all())
+
+        # end transaction. the write lock is not held while hosts are pinged
+        dbconnection.commit()
         
         self.logger.write( "Checking reachabilty of {n} host{s} ...".format( n=len(hosts), s="s" * int( len(hosts)>1 ) ),
                          logCategory='debug' )
@@ -376,9 +567,13 @@ class hQServer(hQBaseServer):
             pingList.append( current )
             current.start()
 
-        reachability = {}
         for p in pingList:
              p.join()
+
+        dbconnection = hQDBConnection( writer=True )
+
+        reachability = {}
+        for p in pingList:
              if p.status[1]>0:	# p.status: (transmitted,received)
                  # successful ping
                  self.logger.write( "     {h} ... is reachable".format( h=p.host ),
@@ -429,10 +624,10 @@ class hQServer(hQBaseServer):
           str | None: either 'activated' if activation was successful or None
         """
 
-        dbconnection = hQDBConnection()
-        
         reachability = self.set_reachability_hosts( hosts=[host] )
         
+        dbconnection = hQDBConnection( writer=True )
+
         if reachability[ host ]:
             try:
                 hostSummaryInstance = dbconnection.query( db.HostSummary )\
@@ -461,7 +656,7 @@ class hQServer(hQBaseServer):
           
         """
 
-        dbconnection = hQDBConnection()
+        dbconnection = hQDBConnection( writer=True )
 
         try:
             hostSummaryInstance = dbconnection.query( db.HostSummary )\
@@ -505,6 +700,9 @@ class hQServer(hQBaseServer):
 
                 hostsDict = { h.full_name: h for h in hosts }
 
+                # end transaction. the write lock is not held while the load of hosts is fetched
+                dbconnection.commit()
+
                 self.logger.write( "Checking load of {n} host{s} ...".format( n=len(hosts), s="s" * int( len(hostsDict)>1 ) ),
                                    logCategory='debug' )
 
@@ -518,6 +716,9 @@ class hQServer(hQBaseServer):
                 for p in hostLoadList:
                      p.join()
 
+                dbconnection = hQDBConnection( writer=True )
+
+                for p in hostLoadList:
                      if p.load:
                          self.logger.write( "     {h} has load {l}".format( h=p.host, l=p.load[0] ),
                                             logCategory='debug' )
@@ -570,52 +771,218 @@ class hQServer(hQBaseServer):
                     # unset flag
                     self.updating_load_hosts.clear()
         
+    def expand_job_arrays( self, dbconnection, freeSlots ):
+        """create tasks of job arrays as waiting jobs
+
+        Tasks are created only for free slots. Tasks of a job array which are still waiting are
+        taken into account, so a job array never has more waiting tasks than fit into the free
+        slots. Job arrays with higher priority are expanded first.
+
+        **Args**
+          | dbconnection (hQDBConnection): connection to database
+          | freeSlots (int): number of free slots in cluster
+        """
+
+        jobArrays = dbconnection.query( db.JobArray )\
+                    .join( db.Priority )\
+                    .join( db.User )\
+                    .filter( and_( db.JobArray.next_idx<=db.JobArray.last_idx,
+                                   db.User.enabled==True ) )\
+                    .order_by( db.Priority.value.desc(), db.JobArray.id )\
+                    .all()
+
+        if not jobArrays:
+            return
+
+        jobStatusCounter = hQJobStatusCounter()
+
+        # number of waiting tasks of each job array
+        waitingTasks = dict( dbconnection.query( db.Job.array_id,
+                                                 func.count('*') )\
+                             .join( db.WaitingJob, db.WaitingJob.job_id==db.Job.id )\
+                             .filter( db.Job.array_id.in_( [ a.id for a in jobArrays ] ) )\
+                             .group_by( db.Job.array_id )\
+                             .all() )
+
+        for jobArray in jobArrays:
+            if freeSlots<jobArray.slots:
+                break
+
+            numTasks = min( jobArray.last_idx - jobArray.next_idx + 1,
+                            freeSlots // jobArray.slots - waitingTasks.get( jobArray.id, 0 ) )
+
+            if numTasks<=0:
+                continue
+            
+            self.logger.write( "create {n} tasks of job array {a}".format( n=numTasks, a=jobArray.id ),
+                               logCategory='debug' )
+            
+            for idx in xrange( jobArray.next_idx, jobArray.next_idx + numTasks ):
+                newJob = db.Job( user_id=jobArray.user_id,
+                                 command=jobArray.command.replace( '{idx}', str(idx) ),
+                                 slots=jobArray.slots,
+                                 priority_id=jobArray.priority_id,
+                                 info_text=jobArray.info_text.replace( '{idx}', str(idx) ),
+                                 group=jobArray.group,
+                                 shell=jobArray.shell,
+                                 stdout=jobArray.stdout.replace( '{idx}', str(idx) ),
+                                 stderr=jobArray.stderr.replace( '{idx}', str(idx) ),
+                                 logfile=jobArray.logfile.replace( '{idx}', str(idx) ),
+                                 excluded_hosts=jobArray.excluded_hosts,
+                                 estimated_time=jobArray.estimated_time,
+                                 estimated_memory=jobArray.estimated_memory,
+                                 reservation_id=jobArray.reservation_id,
+                                 array_id=jobArray.id,
+                                 array_idx=idx )
+
+                dbconnection.introduce( newJob,
+                                        db.JobDetails( job=newJob,
+                                                       job_status_id=self.database_ids['waiting'] ),
+                                        db.WaitingJob( job=newJob,
+                                                       user_id=jobArray.user_id,
+                                                       priorityValue=self.jobScheduler.get_priority_value( dbconnection,
+                                                                                                           jobArray.user_id,
+                                                                                                           jobArray.priority.value ) ),
+                                        db.JobHistory( job=newJob,
+                                                       job_status_id=self.database_ids['waiting'] ) )
+
+            jobArray.next_idx += numTasks
+            freeSlots -= numTasks * jobArray.slots
+
+            jobStatusCounter.add( jobArray.user_id, self.database_ids['waiting'], numTasks )
+
+        jobStatusCounter.save( dbconnection )
+
+        dbconnection.commit()
+
+        
+    def resolve_dependencies( self, dbconnection, jobIDs ):
+        """resolve dependencies of blocked jobs on finished jobs
+
+        Only the dependencies on the given jobs are looked up. The number of unresolved
+        dependencies of each dependent job is decreased and jobs without unresolved dependencies
+        become waiting jobs. A job with an ``afterok`` dependency on a failed job is cancelled. In
+        turn, dependencies on cancelled jobs are resolved. Resolved dependencies are deleted.
+
+        The changes are not committed. Has to be called with :attr:`dependencyLock` acquired.
+
+        **Args**
+          | dbconnection (hQDBConnection): connection to database
+          | jobIDs (list): ids of finished jobs
+        """
+
+        # {<Job.id>: <bool>, ...} whether prerequisite job has been finished successfully
+        succeeded = dict( (jobID, returnCode in (0,None)) for jobID,returnCode in dbconnection.query( db.JobDetails.job_id,
+                                                                                                      db.JobDetails.return_code )\
+                                                                                        .filter( db.JobDetails.job_id.in_( jobIDs ) )\
+                                                                                        .all() )
+
+        jobStatusCounter = hQJobStatusCounter()
+
+        while succeeded:
+            dependencies = dbconnection.query( db.JobDependency.job_id,
+                                               db.JobDependency.required_job_id,
+                                               db.JobDependency.type )\
+                           .filter( db.JobDependency.required_job_id.in_( succeeded.keys() ) )\
+                           .all()
+
+            if not dependencies:
+                break
+
+            cancelJobIDs = set()
+            resolved = defaultdict( int )
+            for jobID,requiredJobID,dependencyType in dependencies:
+                if dependencyType=='afterok' and not succeeded[ requiredJobID ]:
+                    cancelJobIDs.add( jobID )
+                else:
+                    resolved[ jobID ] += 1
+
+            dbconnection.query( db.JobDependency )\
+              .filter( db.JobDependency.required_job_id.in_( succeeded.keys() ) )\
+              .delete( synchronize_session=False )
+
+            # only blocked jobs are considered. jobs might have been cancelled before
+            blockedJobs = dbconnection.query( db.Job )\
+                          .join( db.JobDetails, db.JobDetails.job_id==db.Job.id )\
+                          .filter( and_( db.Job.id.in_( set( resolved ) | cancelJobIDs ),
+                                         db.JobDetails.job_status_id==self.database_ids['blocked'] ) )\
+                          .all()
+
+            # cancelled jobs resolve dependencies of other jobs in next iteration
+            succeeded = {}
+            for job in blockedJobs:
+                if job.id in cancelJobIDs:
+                    newStatus = 'cancelled'
+                    succeeded[ job.id ] = False
+                else:
+                    job.unresolved_dependencies -= resolved[ job.id ]
+
+                    if job.unresolved_dependencies>0:
+                        continue
+                    
+                    newStatus = 'waiting'
+                    dbconnection.introduce( db.WaitingJob( job=job,
+                                                           user_id=job.user_id,
+                                                           priorityValue=self.jobScheduler.get_priority_value( dbconnection,
+                                                                                                               job.user_id,
+                                                                                                               job.priority.value ) ) )
+
+                job.unresolved_dependencies = 0
+                job.job_details.job_status_id = self.database_ids[ newStatus ]
+                dbconnection.introduce( db.JobHistory( job_id=job.id,
+                                                       job_status_id=self.database_ids[ newStatus ] ) )
+
+                jobStatusCounter.move( job.user_id, self.database_ids['blocked'], self.database_ids[ newStatus ] )
+
+                self.logger.write( "job {j} is {s}".format( j=job.id, s=newStatus ),
+                                   logCategory='debug' )
+
+        jobStatusCounter.save( dbconnection )
+
+                
     def after_request_processing( self ):
         """is executed after a request came in
         """
         pass
 
 
-    def ping_user( self, user, con ):
+    def ping_user( self, user ):
         """send ping to user's hq-user-server
 
+        The database is not accessed. The caller stores the changed ``last_check`` and
+        ``idle_time`` of the user.
+
         **Args**
-          | user (string): user name
-          | con (DBConnection): connection to database
+          | user (dict): ``name``, ``hq_user_server_host``, ``hq_user_server_port``,
+          |   ``last_check`` and ``idle_time`` of user. ``last_check`` and ``idle_time`` are updated
 
         **Returns**
-          bool: ``True`` if user's hq-user-server is pingable otherwise ``False``
+          bool | None: ``True`` if user's hq-user-server is pingable, ``False`` if not and
+          ``None`` if user is still temporarily disabled
           
         """
         now = datetime.now()
 
         try:
-            if user.last_check + timedelta( seconds=user.idle_time ) < now:
-                # create socket connection to hq-user-server
-                sock = hQSocket( host=user.hq_user_server_host,
-                                 port=user.hq_user_server_port,
-                                 catchErrors=False)
-
-                sock.send( "ping" )
-                response = sock.recv()
+            if user['last_check'] + timedelta( seconds=user['idle_time'] ) < now:
+                # use persistent connection to hq-user-server
+                response = serverConnectionPool.request( user['hq_user_server_host'],
+                                                         user['hq_user_server_port'],
+                                                         "ping" )
 
                 if response == 'pong':
                     # server responsed with 'pong'
-                    user.idle_time = 0
-                    user.last_check = now
+                    user['idle_time'] = 0
+                    user['last_check'] = now
 
-                    con.commit()
-                    
                     return True
                 else:
-                    self.logger.write( "hq-user-server of user {u} is not accesible.".format(u=user.name),
+                    self.logger.write( "hq-user-server of user {u} is not accesible.".format(u=user['name']),
                                        logCategory="error")
-                    user.idle_time = 1 if not user.idle_time else user.idle_time*2
-                    user.last_check = now
+                    user['idle_time'] = 1 if not user['idle_time'] else user['idle_time']*2
+                    user['last_check'] = now
                     
-                    con.commit()
-                    
-                    self.logger.write( "{i}s until next check.".format(i=user.idle_time),
+                    self.logger.write( "{i}s until next check.".format(i=user['idle_time']),
                                        logCategory="error")
                     
                     return False
@@ -625,42 +992,47 @@ class hQServer(hQBaseServer):
                 pass
         except:
             #print traceback.print_exc()
-            self.logger.write( "hq-user-server of user {u} is not accesible.".format(u=user.name),
+            self.logger.write( "hq-user-server of user {u} is not accesible.".format(u=user['name']),
                                logCategory="error")
             
-            user.idle_time = 1 if not user.idle_time else user.idle_time*2
-            user.last_check = now
+            user['idle_time'] = 1 if not user['idle_time'] else user['idle_time']*2
+            user['last_check'] = now
 
-            con.commit()
-            
-            self.logger.write( "{i}s until next check.".format(i=user.idle_time),
+            self.logger.write( "{i}s until next check.".format(i=user['idle_time']),
                                logCategory="error")
                     
             return False
 
         
-    def send_to_user( self, cmd, user, con ):
+    def send_to_user( self, cmd, user, con, payload=None ):
         """send command to user, i.e., to the user's hq-user-server
 
+        The database is accessed only if the command could not be sent.
+
         **Args**
           | cmd (string): command for hq-user-server
-          | user (string): name of user
+          | user (dict): user as passed to :meth:`ping_user`
           | con (DBConnection): connection to database
+          | payload (object): payload of command. is encoded with the codec of the connection
           
         """
         try:
-            sock = hQSocket( host=user.hq_user_server_host,
-                             port=user.hq_user_server_port,
-                             catchErrors=False)
-
-            sock.send( cmd )
+            # use persistent connection to hq-user-server. do not wait for response
+            serverConnectionPool.send( user['hq_user_server_host'],
+                                       user['hq_user_server_port'],
+                                       cmd,
+                                       payload )
         except:
-            user.idle_time = 1 if not user.idle_time else user.idle_time*2
-            user.last_check = now
-                                              
+            user['idle_time'] = 1 if not user['idle_time'] else user['idle_time']*2
+            user['last_check'] = datetime.now()
+
+            con.query( db.User )\
+               .filter( db.User.id==user['id'] )\
+               .update( { db.User.last_check: user['last_check'],
+                          db.User.idle_time: user['idle_time'] } )
             con.commit()
             
-            self.logger.write( "error while sending somthing to hq-user-server of user {u}.".format(u=user.name),
+            self.logger.write( "error while sending somthing to hq-user-server of user {u}.".format(u=user['name']),
                                logCategory="error")
 
     def do_nothing( self ):
@@ -730,6 +1102,7 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
                                               help = "deactivate cluster",
                                               fct = self.process_deactivatecluster )
         self.commands["LSCLUSTER"] = hQCommand( name = "lscluster",
+                                              readonly = True,
                                               regExp = "^lscluster$",
                                               help = "return cluster details",
                                               fct = self.process_lscluster )
@@ -759,14 +1132,16 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
                                                  fct = self.process_enableuser )
         self.commands["DISABLEUSER"] = hQCommand( name = "disableuser",
                                                   arguments = ["user_name"],
-                                                  regExp = "^enableuser:(.*)",
-                                                  help = "enable user.",
+                                                  regExp = "^disableuser:(.*)",
+                                                  help = "disable user.",
                                                   fct = self.process_disableuser)
         self.commands["LSUSERS"] = hQCommand( name = "lsusers",
+                                              readonly = True,
                                               regExp = "^lsusers$",
                                               help = "return list of users",
                                               fct = self.process_lsusers )
         self.commands["LSUSER"] = hQCommand( name = "lsuser",
+                                             readonly = True,
                                              regExp = "^lsuser:(.*)$",
                                              arguments = ["user_name"],
                                              help = "show all details about user.",
@@ -776,33 +1151,49 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
                                           arguments = ["json_str"],
                                           help = "add (multiple) jobs to hq.",
                                           fct = self.process_addjobs )
+        self.commands["ADDJOBSTREAM"] = hQCommand( name = "addjobstream",
+                                                   regExp = "^addjobstream:(.*)",
+                                                   arguments = ["json_str"],
+                                                   help = "add jobs to hq which are streamed over the same connection as newline-delimited json. an empty message ends the stream.",
+                                                   fct = self.process_addjobstream )
         self.commands["LSWJOBS"] = hQCommand( name = 'lswjobs',
+                                              readonly = True,
                                               regExp = '^lswjobs:?(.*)',
                                               arguments = ['num'],
                                               help = "return the last num waiting jobs. default: return the last 10. specify 'all' in order to return all waiting jobs",
                                               fct = self.process_lswjobs )
         self.commands["LSPJOBS"] = hQCommand( name = 'lspjobs',
+                                              readonly = True,
                                               regExp = '^lspjobs:?(.*)',
                                               arguments = ['num'],
                                               help = "return the last num pending jobs. default: return the last 10. specify 'all' in order to return all pending jobs",
                                               fct = self.process_lspjobs )
         self.commands["LSRJOBS"] = hQCommand( name = 'lsrjobs',
+                                              readonly = True,
                                               regExp = '^lsrjobs:?(.*)',
                                               arguments = ['num'],
                                               help = "return the last num running jobs. default: return the last 10. specify 'all' in order to return all running jobs",
                                               fct = self.process_lsrjobs )
         self.commands["LSFJOBS"] = hQCommand( name = 'lsfjobs',
+                                              readonly = True,
                                               regExp = '^lsfjobs:?(.*)',
                                               arguments = ['num'],
                                               help = "return the last num finished jobs. default: return the last 10. specify 'all' in order to return all finished jobs",
                                               fct = self.process_lsfjobs )
+        self.commands["LSARRAYS"] = hQCommand( name = 'lsarrays',
+                                               readonly = True,
+                                               regExp = '^lsarrays$',
+                                               help = "return job arrays which are not finished yet together with the number of tasks in each status",
+                                               fct = self.process_lsarrays )
         self.commands["LAJOB"] = hQCommand( name = 'lajob',
-                                            regExp = 'lajob:(.*)',
+                                            readonly = True,
+                                            regExp = '^lajob:(.*)',
                                             arguments = ["job_id"],
                                             help = "return job info about job with given jobID",
                                             fct = self.process_lajob )
         self.commands["FINDJOBS"] = hQCommand( name = 'findjobs',
-                                               regExp = 'findjobs:(.*)',
+                                               readonly = True,
+                                               regExp = '^findjobs:(.*)',
                                                arguments = ["match_str"],
                                                help = "return all jobs which match the search string in command, info text or group.",
                                                fct = self.process_findjobs )
@@ -810,11 +1201,20 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
                                                  regExp = "^resetpjobs$",
                                                  help = "set all pending jobs as waiting. free occupied slots on hosts.",
                                                  fct = self.process_resetpjobs )
+        self.commands["RECONCILECOUNTERS"] = hQCommand( name = "reconcilecounters",
+                                                        regExp = "^reconcilecounters$",
+                                                        help = "rebuild the counters of jobs per user and job status from the jobs in the database.",
+                                                        fct = self.process_reconcilecounters )
         self.commands["FAILEDJOBS"] = hQCommand( name = "failedjobs",
                                                  regExp = "^failedjobs:(.*)",
                                                  arguments = ["json_str"],
                                                  help = "info about jobs which could not be started",
                                                  fct = self.process_failedjobs )
+        self.commands["JOBFINISHED"] = hQCommand( name = "jobfinished",
+                                                  regExp = "^jobfinished:(.*)",
+                                                  arguments = ["job_ids"],
+                                                  help = "notification about finished jobs. comma separated list of job ids.",
+                                                  fct = self.process_jobfinished )
         self.commands["COLLECTGARBAGE"] = hQCommand( name = "collectgarbage",
                                               regExp = "^collectgarbage$",
                                               help = "use garbage collector to explicitly collect the garbage",
@@ -841,7 +1241,7 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
           | request (object): request object
         """
 
-        dbconnection = hQDBConnection()
+        dbconnection = hQDBConnection( writer=True )
         
         counts = dict( dbconnection.query( db.Host.id, func.sum( db.Job.slots ) ).\
                        join( db.JobDetails, db.JobDetails.host_id==db.Host.id ).\
@@ -869,6 +1269,7 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
         """
 
         self.server.active.set()
+        self.server.wakeup_loop( 'check_database' )
 
         request.send('cluster has been activated')
 
@@ -907,9 +1308,9 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
             
         """
 
-        userDetails = json.loads( json_obj )
+        userDetails = request.codec.loads( json_obj )
         
-        con = hQDBConnection()
+        con = hQDBConnection( writer=True )
 
         try:
             user = con.query( db.User ).filter( db.User.name==userDetails['user'] ).one()
@@ -925,13 +1326,17 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
 
         user.last_check = datetime.now()
         user.idle_time = 0
+
+        # user is not reloaded after commit, so that no further transaction is started
+        userName = user.name
+        userID = user.id
         
         con.commit()
         
-        self.writeLog( 'user {u} has been registered.'.format(u=user.name),
+        self.writeLog( 'user {u} has been registered.'.format(u=userName),
                        logCategory='system' )
 
-        request.send( json.dumps( {'status': 'approved', 'user_id': user.id} ) )
+        request.send( json.dumps( {'status': 'approved', 'user_id': userID} ) )
 
         
     def process_enableuser( self, request, user_name ):
@@ -945,7 +1350,7 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
           
         """
 
-        con = hQDBConnection()
+        con = hQDBConnection( writer=True )
 
         try:
             con.query( db.User ).filter( db.User.name==user_name ).update( {db.User.enabled: True} )
@@ -966,7 +1371,7 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
           | user_name (string): name of user
         """
 
-        con = hQDBConnection()
+        con = hQDBConnection( writer=True )
 
         try:
             con.query( db.User ).filter( db.User.name==user_name ).update( {db.User.enabled: False} )
@@ -1106,6 +1511,8 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
         status = self.server.activate_host( host )
 
         if status=='activated':
+            self.server.wakeup_loop( 'check_database' )
+            
             request.send( "host {h} has been activated".format(h=host) )
         else:
             request.send( "nothing has been done" )
@@ -1181,10 +1588,88 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
           
         """
         
-        jsonObj = json.loads( json_str )
+        jsonObj = request.codec.loads( json_str )
 
-        dbconnection = hQDBConnection()
+        dbconnection = hQDBConnection( writer=True )
+        
+        user_id = jsonObj['user_id']
+
+        if not self._register_user_server( dbconnection, jsonObj ):
+            request.send('Unknown user.')
+            return
+
+        jobIDs = self._add_job_batch( dbconnection, user_id, jsonObj['jobs'] )
+
+        request.send( json.dumps( jobIDs ) )
+
+
+    def process_addjobstream( self, request, json_str ):
+        """process 'addjobstream' command
+
+        jobs are received in batches over the same connection. each batch contains one job per
+        line given as json representation of a dict. each batch is added within a single
+        transaction and the ids of the added jobs are sent back as compact ranges. an empty
+        message ends the stream. hence, only a single batch is kept in memory. the stream is
+        acknowledged with 'ready'.
+        
+        **Args**
+          | request (object): request object
+          | json_str (string): json representation of user's hq-user-server
+
+            ::
+
+             {
+                'user_id': int,  # id of user
+                'host': str,     # host of user's hq-user-server
+                'port': int,     # port of user's hq-user-server
+                'id': str        # id of user's hq-user-server
+             }
+
+        """
+        
+        jsonObj = request.codec.loads( json_str )
+
+        dbconnection = hQDBConnection( writer=True )
         
+        user_id = jsonObj['user_id']
+
+        if not self._register_user_server( dbconnection, jsonObj ):
+            request.send('Unknown user.')
+            return
+
+        # client may start streaming
+        request.send( "ready" )
+
+        numJobs = 0
+        while True:
+            batch = request.recv()
+
+            if not batch:
+                # end of stream
+                self.writeLog( "Job stream with {n} job{s} done.".format( n=numJobs,
+                                                                          s='s' if numJobs!=1 else '' ),
+                               logCategory='system' )
+                request.send( "done" )
+                break
+
+            jobs = [ json.loads( line ) for line in batch.split('\n') if line.strip() ]
+            numJobs += len(jobs)
+
+            jobIDs = self._add_job_batch( dbconnection, user_id, jobs )
+
+            request.send( json.dumps( jobIDs ) )
+
+
+    def _register_user_server( self, dbconnection, jsonObj ):
+        """helper function for addjobs and addjobstream. store details of user's hq-user-server
+
+        **Args**
+          | dbconnection (hQDBConnection): connection to database
+          | jsonObj (dict): dict with keys user_id, host, port and id
+
+        **Returns**
+          bool: False if user is unknown
+        """
         user_id = jsonObj['user_id']
         hqUserServerHost = jsonObj['host']
         hqUserServerPort = jsonObj['port']
@@ -1205,17 +1690,106 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
             self.writeLog( 'Unknown user {u}'.format(u=user_id),
                            logCategory='error' )
             traceback.print_exc(file=sys.stderr)
-            request.send('Unknown user.')
+            
+            return False
+
+        return True
 
-        numJobs = len( jsonObj['jobs'] ) 
-        jobIDs = []
+    
+    def _add_job_batch( self, dbconnection, user_id, jobs ):
+        """helper function for addjobs and addjobstream. add jobs and wake up the scheduler
+
+        **Args**
+          | dbconnection (hQDBConnection): connection to database
+          | user_id (int): id of user
+          | jobs (list): list of jobs. each job is given as dict
+
+        **Returns**
+          list: ids of added jobs (see :meth:`_add_jobs`)
+        """
+        numJobs = len( jobs )
+
+        # {<Reservation.code>: <Reservation.id>, ...}
+        if any( job.get('reservation','') for job in jobs ):
+            reservations = dict( dbconnection.query( db.Reservation.code, db.Reservation.id ).all() )
+        else:
+            reservations = {}
         
         self.writeLog( "Add {n} job{s} ...".format(n=numJobs,
                                                    s='s' if numJobs>1 else '' ),
                      logCategory='system' )
 
+        if any( job.get('dependencies','') for job in jobs ):
+            # prerequisite jobs must not be finished while dependencies are added
+            with self.server.dependencyLock:
+                jobIDs = self._add_jobs( dbconnection, user_id, jobs, reservations )
+        else:
+            jobIDs = self._add_jobs( dbconnection, user_id, jobs, reservations )
+
+        # send jobs immediately
+        self.server.wakeup_loop( 'check_database' )
+
+        return jobIDs
+
+
+    def _add_jobs( self, dbconnection, user_id, jobs, reservations ):
+        """helper function for addjobs
+
+        All jobs are added within a single transaction. Excluded hosts and priorities are resolved
+        once for all jobs and the rows of the jobs are inserted with multi-row inserts of at most
+        :obj:`BULK_INSERT_SIZE` rows.
+
+        **Args**
+          | dbconnection (hQDBConnection): connection to database
+          | user_id (int): id of user
+          | jobs (list): list of jobs. each job is given as dict
+          | reservations (dict): {<Reservation.code>: <Reservation.id>, ...}
+
+        **Returns**
+          list: ids of added jobs as compact ranges and ids of added job arrays, e.g., ``['12-110', '114', 'array:3']``
+        """
+
+        # full names of all hosts in cluster
+        hostNames = set( hostName for hostName, in dbconnection.query( db.Host.full_name ).all() )
+
+        # {<Priority.value>: <Priority.id>, ...}
+        priorities = dict( dbconnection.query( db.Priority.value, db.Priority.id ).all() )
+
+        # {<Job.id>: (<JobDetails.job_status_id>,<JobDetails.return_code>), ...} of prerequisite jobs
+        requiredJobIDs = set()
+        for job in jobs:
+            try:
+                requiredJobIDs.update( jobID for t,jobID in parse_dependencies( job.get('dependencies','') ) )
+            except ValueError:
+                pass
+
+        if requiredJobIDs:
+            requiredJobs = dict( (jobID,(statusID,returnCode)) for jobID,statusID,returnCode in dbconnection.query( db.JobDetails.job_id,
+                                                                                                                    db.JobDetails.job_status_id,
+                                                                                                                    db.JobDetails.return_code )\
+                                                                                                     .filter( db.JobDetails.job_id.in_( requiredJobIDs ) )\
+                                                                                                     .all() )
+
+            # prerequisite jobs might have been archived
+            archivedJobIDs = requiredJobIDs - set( requiredJobs )
+            if archivedJobIDs:
+                requiredJobs.update( (jobID,(statusID,returnCode)) for jobID,statusID,returnCode in dbconnection.query( db.ArchivedJob.id,
+                                                                                                                        db.ArchivedJob.job_status_id,
+                                                                                                                        db.ArchivedJob.return_code )\
+                                                                                                         .filter( db.ArchivedJob.id.in_( archivedJobIDs ) )\
+                                                                                                         .all() )
+        else:
+            requiredJobs = {}
+
+        # all jobs of this submission are identified by the submission id after they have been inserted
+        submissionID = uuid.uuid4().hex
+        
+        # list of tuples (<values of Job>,<job status>,<unresolved dependencies>,<priority value>)
+        newJobs = []
+        arrayIDs = []
+        
         # iterate over all jobs
-        for idx,job in enumerate(jsonObj['jobs']):
+        for idx,job in enumerate(jobs):
             command = job['command']
             slots = int(job['slots'])
             infoText = job.get('infoText','')
@@ -1226,134 +1800,290 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
             shell = job['shell']
             excludedHosts = job.get("excludedHosts","").split(',')
             priorityValue = job.get('priority',0)
-            estimatedTime = int(job.get("estimatedTime",0))
-            estimatedMemory = int(job.get("estimatedMemory",0))
+            estimatedTime = float(job.get("estimatedTime",0)) or None	# in minutes
+            estimatedMemory = float(job.get("estimatedMemory",0)) or None	# in MB
+            reservationCode = job.get('reservation','')
+            arrayRange = job.get('array','')
 
-            # check excluded hosts
-            excludedHostsList = []
-            for h in excludedHosts:
+            if arrayRange:
                 try:
-                    dbconnection.query( db.Host ).filter( db.Host.full_name==h ).one()
-                    excludedHostsList.append( h )
-                except NoResultFound:
-                    # do not consider this host
+                    arrayRange = parse_array_range( arrayRange )
+                except ValueError as e:
+                    self.writeLog( 'Invalid job array: {e}. Job is not added.'.format( e=e ),
+                                   logCategory='warning' )
+                    continue
+
+                if job.get('dependencies',''):
+                    self.writeLog( 'Dependencies are not supported for job arrays. Job is not added.',
+                                   logCategory='warning' )
+                    continue
+
+            # get unresolved dependencies
+            try:
+                dependencies = parse_dependencies( job.get('dependencies','') )
+            except ValueError as e:
+                self.writeLog( 'Invalid dependencies: {e}. Job is not added.'.format( e=e ),
+                               logCategory='warning' )
+                continue
+
+            unknownJobIDs = [ jobID for t,jobID in dependencies if jobID not in requiredJobs ]
+            if unknownJobIDs:
+                self.writeLog( 'Unknown jobs {j} in dependencies. Job is not added.'.format( j=unknownJobIDs ),
+                               logCategory='warning' )
+                continue
+
+            jobStatus = 'waiting'
+            unresolvedDependencies = []
+            for dependencyType,requiredJobID in dependencies:
+                statusID,returnCode = requiredJobs[ requiredJobID ]
+
+                if statusID==self.server.database_ids['finished'] and returnCode in (0,None):
+                    # dependency is fulfilled
                     continue
+                elif statusID in (self.server.database_ids['finished'], self.server.database_ids['cancelled']):
+                    if dependencyType=='afterok':
+                        # dependency cannot be fulfilled anymore
+                        jobStatus = 'cancelled'
+                else:
+                    unresolvedDependencies.append( (dependencyType,requiredJobID) )
+
+            if jobStatus!='cancelled' and unresolvedDependencies:
+                jobStatus = 'blocked'
+
+            # get database id of reservation
+            if reservationCode:
+                if reservationCode not in reservations:
+                    self.writeLog( 'Unknown reservation {r}. Job is not added.'.format( r=reservationCode ),
+                                   logCategory='warning' )
+                    continue
+                
+                reservationID = reservations[ reservationCode ]
+            else:
+                reservationID = None
+
+            # consider only known hosts
+            excludedHostsList = [ h for h in excludedHosts if h in hostNames ]
 
             # priority value is supposed to be between  0 and 127
             priorityValue = 127 if priorityValue > 127 else 0 if priorityValue<0 else priorityValue
             # get database id of priority
-            try:
-                priority = dbconnection.query( db.Priority ).filter( db.Priority.value==priorityValue ).one()
-            except NoResultFound:
+            if priorityValue not in priorities:
                 priority = db.Priority( value=priorityValue )
                 dbconnection.introduce( priority )
+                dbconnection.session.flush()
+                
+                priorities[ priorityValue ] = priority.id
+
+            if arrayRange:
+                # tasks are created by the hq-server when there are free slots
+                newArray = db.JobArray( user_id=user_id,
+                                        command=command,
+                                        slots=int(slots),
+                                        priority_id=priorities[ priorityValue ],
+                                        info_text=infoText,
+                                        group=group,
+                                        shell=shell,
+                                        stdout=stdout,
+                                        stderr=stderr,
+                                        logfile=logfile,
+                                        excluded_hosts=json.dumps( excludedHostsList ),
+                                        estimated_time=estimatedTime,
+                                        estimated_memory=estimatedMemory,
+                                        reservation_id=reservationID,
+                                        first_idx=arrayRange[0],
+                                        last_idx=arrayRange[1],
+                                        next_idx=arrayRange[0] )
+
+                dbconnection.introduce( newArray )
+                dbconnection.session.flush()
+
+                arrayIDs.append( "array:{i}".format( i=newArray.id ) )
+                
+                continue
+            
+            newJobs.append( ( { 'user_id': user_id,
+                                'command': command,
+                                'slots': int(slots),
+                                'priority_id': priorities[ priorityValue ],
+                                'info_text': infoText,
+                                'group': group,
+                                'shell': shell,
+                                'stdout': stdout,
+                                'stderr': stderr,
+                                'logfile': logfile,
+                                'excluded_hosts': json.dumps( excludedHostsList ),
+                                'estimated_time': estimatedTime,
+                                'estimated_memory': estimatedMemory,
+                                'reservation_id': reservationID,
+                                'unresolved_dependencies': len( unresolvedDependencies ) if jobStatus=='blocked' else 0,
+                                'submission_id': submissionID },
+                              jobStatus,
+                              unresolvedDependencies,
+                              priorityValue ) )
+
+        jobIDs = self._insert_jobs( dbconnection, user_id, submissionID, newJobs ) if newJobs else []
+        
+        dbconnection.commit()
 
-            # create database entry for the new job
-            newJob = db.Job( user_id=user_id,
-                             command=command,
-                             slots=int(slots),
-                             priority=priority,
-                             info_text=infoText,
-                             group=group,
-                             shell=shell,
-                             stdout=stdout,
-                             stderr=stderr,
-                             logfile=logfile,
-                             excluded_hosts=json.dumps( excludedHostsList ) )
-
-            # set jobstatus for this job
-            jobDetails = db.JobDetails( job=newJob,
-                                        job_status_id=self.server.database_ids['waiting'] )
-
-            # add as waiting job
-            waitingJob = db.WaitingJob( job=newJob,
-                                        user_id=user_id,
-                                        priorityValue=priority.value )	# calculate a priority value
+        return compress_ids( jobIDs ) + arrayIDs
 
-            # set history
-            jobHistory = db.JobHistory( job=newJob,
-                                        job_status_id = self.server.database_ids['waiting'] )
 
-            dbconnection.introduce( newJob, jobDetails, waitingJob, jobHistory )
+    def _insert_jobs( self, dbconnection, user_id, submissionID, newJobs ):
+        """insert jobs together with their details, history, waiting jobs and dependencies
 
-            dbconnection.commit()
+        rows are inserted with multi-row inserts. the transaction is not committed.
 
-            #self.writeLog( '  {idx}/{n}: added job with id {i}'.format( idx=idx+1,
-            #                                                            n=numJobs,
-            #                                                            i=newJob.id ),
-            #             logCategory='request_processing')
+        **Args**
+          | dbconnection (hQDBConnection): connection to database
+          | user_id (int): id of user
+          | submissionID (str): submission id of all jobs
+          | newJobs (list): list of tuples (<values of Job>,<job status>,<unresolved dependencies>,<priority value>)
+
+        **Returns**
+          list: ids of inserted jobs in the order of newJobs
+        """
+        bulk_insert( dbconnection, db.Job.__table__, [ values for values,s,d,p in newJobs ] )
 
-            jobIDs.append( str(newJob.id) )
+        # ids increase in the order in which the jobs have been inserted
+        jobIDs = [ jobID for jobID, in dbconnection.query( db.Job.id )\
+                                       .filter( db.Job.submission_id==submissionID )\
+                                       .order_by( db.Job.id )\
+                                       .all() ]
 
-        request.send( json.dumps( jobIDs ) )
+        now = datetime.now()
+
+        jobStatusCounter = hQJobStatusCounter()
+        
+        jobDetails = []
+        jobHistory = []
+        waitingJobs = []
+        jobDependencies = []
+        for jobID,(values,jobStatus,unresolvedDependencies,priorityValue) in zip( jobIDs, newJobs ):
+            jobStatusID = self.server.database_ids[ jobStatus ]
+
+            jobDetails.append( { 'job_id': jobID,
+                                 'job_status_id': jobStatusID } )
+            jobHistory.append( { 'job_id': jobID,
+                                 'job_status_id': jobStatusID,
+                                 'datetime': now } )
+
+            jobStatusCounter.add( user_id, jobStatusID )
+
+            if jobStatus=='waiting':
+                # add as waiting job
+                waitingJobs.append( { 'job_id': jobID,
+                                      'user_id': user_id,
+                                      'priorityValue': self.server.jobScheduler.get_priority_value( dbconnection,
+                                                                                                   user_id,
+                                                                                                   priorityValue,
+                                                                                                   now=now ),
+                                      'datetime': now } )
+            elif jobStatus=='blocked':
+                # job becomes waiting job after prerequisite jobs have been finished
+                jobDependencies.extend( { 'job_id': jobID,
+                                          'required_job_id': requiredJobID,
+                                          'type': dependencyType } for dependencyType,requiredJobID in unresolvedDependencies )
+
+        bulk_insert( dbconnection, db.JobDetails.__table__, jobDetails )
+        bulk_insert( dbconnection, db.JobHistory.__table__, jobHistory )
+        bulk_insert( dbconnection, db.WaitingJob.__table__, waitingJobs )
+        bulk_insert( dbconnection, db.JobDependency.__table__, jobDependencies )
+
+        jobStatusCounter.save( dbconnection )
+
+        return jobIDs
 
 
     def _render_job_list( self, num, job_type ):
         """helper function for lswjobs, lspjobs, ...
+
+        the jobs are read with a single query which selects only the rendered columns. the rows
+        are fetched in batches while the lines are generated, so that all jobs are listed with
+        bounded memory.
         
         **Args**
-          | request (object): request object
           | num (str|int): number of requested jobs
           | job_type (string): either ``waiting``, ``pending``, ``running``, ``finished``
+
+        **Returns**
+          generator: lines of list. no lines are generated if there are no jobs
         """
 
         if not num:
             # default
             num=10
 
-        # connect to database
-        dbconnection = hQDBConnection()
-
-        query = dbconnection.query( db.Job )\
-                .join( db.JobDetails )\
-                .join( db.JobHistory )\
-                .filter( db.JobDetails.job_status_id==self.server.database_ids[job_type] )\
-                .filter( db.JobHistory.job_status_id==self.server.database_ids[job_type] )\
-                .order_by( db.JobHistory.datetime.desc() )
-        
-        if num!='all':
-            query = query.limit( int(num) )
-
-        jobs = query.all()
-
-        header = []
-        response = []
+        jobStatusID = self.server.database_ids[job_type]
 
         if job_type=="waiting":
-            header.append( "Waiting jobs" )
-            header.append( "------------" )
+            header = [ "Waiting jobs",
+                       "------------" ]
             
             jobString = "{i:3d} - [jobid:{id}] [user:{user}] [status:waiting since {t}] [group:{group}] [info:{info}] [command:{command}{dots}]"
 
         elif job_type=="pending":
-            header.append( "Pending jobs" )
-            header.append( "------------" )
+            header = [ "Pending jobs",
+                       "------------" ]
             
-            jobString = "{i:3d} - [jobid:{id}] [user:{user}] [status:pending on {host} since {t}] [group:{group}] [info:{info}] [command:{command}{dots}]\n"
+            jobString = "{i:3d} - [jobid:{id}] [user:{user}] [status:pending on {host} since {t}] [group:{group}] [info:{info}] [command:{command}{dots}]"
 
         elif job_type=="running":
-            header.append( "Running jobs" )
-            header.append( "------------" )
+            header = [ "Running jobs",
+                       "------------" ]
             
             jobString = "{i:3d} - [jobid:{id}] [user:{user}] [status:running on {host} since {t}] [group:{group}] [info:{info}] [command:{command}{dots}]"
 
         elif job_type=="finished":
-            header.append( "Finished jobs" )
-            header.append( "------------" )
+            header = [ "Finished jobs",
+                       "------------" ]
             
             jobString = "{i:3d} - [jobid:{id}] [user:{user}] [status:finished since {t}] [group:{group}] [info:{info}] [command:{command}{dots}]"
+
+        # connect to database
+        dbconnection = hQDBConnection()
+
+        # time at which job entered its current status
+        since = select( [ func.max( db.JobHistory.datetime ) ] )\
+                .where( and_( db.JobHistory.job_id==db.Job.id,
+                              db.JobHistory.job_status_id==jobStatusID ) )\
+                .correlate( db.Job.__table__ )\
+                .as_scalar()\
+                .label( 'since' )
+
+        query = dbconnection.query( db.Job.id,
+                                    db.User.name,
+                                    db.Host.full_name,
+                                    since,
+                                    db.Job.group,
+                                    db.Job.info_text,
+                                    db.Job.command )\
+                .join( db.User, db.User.id==db.Job.user_id )\
+                .join( db.JobDetails, db.JobDetails.job_id==db.Job.id )\
+                .outerjoin( db.Host, db.Host.id==db.JobDetails.host_id )\
+                .filter( db.JobDetails.job_status_id==jobStatusID )\
+                .order_by( since.desc() )
         
-        
-        for idx,job in enumerate(jobs):
-            response.append( jobString.format( i=idx,
-                                               id=job.id,
-                                               user=job.user.name,
-                                               t=str(job.job_history[-1].datetime),
-                                               group=job.group,
-                                               info=job.info_text,
-                                               command=job.command[:30],
-                                               dots="..." if len(job.command)>30 else "" ) )
-        return "\n".join( header + response )
+        if num!='all':
+            query = query.limit( int(num) )
+
+        try:
+            for idx,(jobID,userName,hostName,t,group,infoText,command) in enumerate( query.yield_per( 1000 ) ):
+                if idx==0:
+                    for line in header:
+                        yield line
+
+                yield jobString.format( i=idx,
+                                        id=jobID,
+                                        user=userName,
+                                        host=hostName,
+                                        t=str(t),
+                                        group=group,
+                                        info=infoText,
+                                        command=command[:30],
+                                        dots="..." if len(command)>30 else "" )
+        finally:
+            # rows are streamed from the connection until all lines have been sent
+            dbconnection.remove()
                 
 
     def process_lswjobs( self, request, num ):
@@ -1369,9 +2099,10 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
         
         rendered_response = self._render_job_list( num=num,
                                                    job_type='waiting' )
+        firstLine = next( rendered_response, None )
                              
-        if rendered_response:
-            request.send( rendered_response )
+        if firstLine is not None:
+            request.sendLines( chain( [ firstLine ], rendered_response ) )
         else:
             request.send("no waiting jobs")
 
@@ -1388,9 +2119,10 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
         
         rendered_response = self._render_job_list( num=num,
                                                    job_type='pending' )
+        firstLine = next( rendered_response, None )
                              
-        if rendered_response:
-            request.send( rendered_response )
+        if firstLine is not None:
+            request.sendLines( chain( [ firstLine ], rendered_response ) )
         else:
             request.send("no pending jobs")
 
@@ -1407,9 +2139,10 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
         
         rendered_response = self._render_job_list( num=num,
                                                    job_type='running' )
+        firstLine = next( rendered_response, None )
                              
-        if rendered_response:
-            request.send( rendered_response )
+        if firstLine is not None:
+            request.sendLines( chain( [ firstLine ], rendered_response ) )
         else:
             request.send("no running jobs")
 
@@ -1426,13 +2159,97 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
 
         rendered_response = self._render_job_list( num=num,
                                                    job_type='finished' )
+        firstLine = next( rendered_response, None )
                              
-        if rendered_response:
-            request.send( rendered_response )
+        if firstLine is not None:
+            request.sendLines( chain( [ firstLine ], rendered_response ) )
         else:
             request.send("no finished jobs")
 
                 
+    def _render_job_arrays( self ):
+        """helper function for lsarrays
+
+        number of tasks of all job arrays in each status are counted with a single query.
+        """
+
+        # connect to database
+        dbconnection = hQDBConnection()
+
+        # job arrays with tasks which are not created yet or which are not finished yet
+        unfinishedArrayIDs = dbconnection.query( db.Job.array_id )\
+                             .join( db.JobDetails )\
+                             .filter( and_( db.Job.array_id!=None,
+                                            db.JobDetails.job_status_id.in_( [ self.server.database_ids[ s ] for s in ('waiting','pending','running') ] ) ) )\
+                             .distinct()\
+                             .subquery()
+        
+        query = dbconnection.query( db.JobArray )\
+                .filter( or_( db.JobArray.next_idx<=db.JobArray.last_idx,
+                              db.JobArray.id.in_( unfinishedArrayIDs ) ) )\
+                .order_by( db.JobArray.id )
+
+        jobArrays = query.all()
+
+        if not jobArrays:
+            return ""
+        
+        # number of tasks in each status {<JobArray.id>: {<JobStatus.name>: <number of tasks>, ...}, ...}
+        counts = defaultdict( dict )
+        for arrayID,status,num in dbconnection.query( db.Job.array_id,
+                                                      db.JobStatus.name,
+                                                      func.count('*') )\
+                                   .join( db.JobDetails, db.JobDetails.job_id==db.Job.id )\
+                                   .join( db.JobStatus, db.JobStatus.id==db.JobDetails.job_status_id )\
+                                   .filter( db.Job.array_id.in_( [ a.id for a in jobArrays ] ) )\
+                                   .group_by( db.Job.array_id, db.JobStatus.name )\
+                                   .all():
+            counts[ arrayID ][ status ] = num
+
+        header = [ "Job arrays",
+                   "----------" ]
+        response = []
+
+        arrayString = "{i:3d} - [arrayid:{id}] [user:{user}] [tasks:{first}-{last}] [not created:{n}] [waiting:{w}] [pending:{p}] [running:{r}] [finished:{f}] [cancelled:{c}] [info:{info}] [command:{command}{dots}]"
+        
+        for idx,jobArray in enumerate(jobArrays):
+            c = counts[ jobArray.id ]
+            
+            response.append( arrayString.format( i=idx,
+                                                 id=jobArray.id,
+                                                 user=jobArray.user.name,
+                                                 first=jobArray.first_idx,
+                                                 last=jobArray.last_idx,
+                                                 n=jobArray.last_idx - jobArray.next_idx + 1,
+                                                 w=c.get( 'waiting', 0 ),
+                                                 p=c.get( 'pending', 0 ),
+                                                 r=c.get( 'running', 0 ),
+                                                 f=c.get( 'finished', 0 ),
+                                                 c=c.get( 'cancelled', 0 ),
+                                                 info=jobArray.info_text,
+                                                 command=jobArray.command[:30],
+                                                 dots="..." if len(jobArray.command)>30 else "" ) )
+        return "\n".join( header + response )
+                
+
+    def process_lsarrays( self, request ):
+        """process 'lsarrays' command
+
+        return rendered list of job arrays which are not finished yet via request object.
+        
+        **Args**
+          | request (object): request object
+          
+        """
+        
+        rendered_response = self._render_job_arrays()
+                             
+        if rendered_response:
+            request.send( rendered_response )
+        else:
+            request.send("no job arrays")
+
+
     def process_lajob( self, request, job_id ):
         """process 'lajob' command
 
@@ -1449,6 +2266,10 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
             
         job = dbconnection.query( db.Job ).get( int(job_id) )
 
+        if not job:
+            # job might have been archived
+            job = dbconnection.query( db.ArchivedJob ).get( int(job_id) )
+
         if job:
             response = ""
             response += "{s:>20} : {value}\n".format(s="job id", value=job.id )
@@ -1493,9 +2314,12 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
         # connect to database
         dbconnection = hQDBConnection()
 
-        jobs = dbconnection.query( db.Job ).filter( or_( db.Job.command.ilike( '%{s}%'.format(s=match_str) ),
-                                                         db.Job.info_text.ilike( '%{s}%'.format(s=match_str) ),
-                                                         db.Job.group.ilike( '%{s}%'.format(s=match_str) ) ) ).all()
+        # jobs which have been finished long ago are found in the archive
+        jobs = []
+        for model in (db.Job, db.ArchivedJob):
+            jobs += dbconnection.query( model ).filter( or_( model.command.ilike( '%{s}%'.format(s=match_str) ),
+                                                             model.info_text.ilike( '%{s}%'.format(s=match_str) ),
+                                                             model.group.ilike( '%{s}%'.format(s=match_str) ) ) ).all()
 
         response = []
         response.append( "Matching jobs" )
@@ -1528,7 +2352,7 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
           | request (object): request object
         """
         
-        dbconnection = hQDBConnection()
+        dbconnection = hQDBConnection( writer=True )
         
         # get all pending jobs
         pJobs = dbconnection.query( db.Job )\
@@ -1539,10 +2363,14 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
         # get occupied slots of each host
         slots = dict( dbconnection.query( db.HostSummary.host_id, db.HostSummary.number_occupied_slots ).all() )
 
+        jobStatusCounter = hQJobStatusCounter()
+
         occupiedSlots = defaultdict( int )
         for job in pJobs:
             occupiedSlots[ job.job_details.host_id ] += job.slots
 
+            jobStatusCounter.move( job.user_id, self.server.database_ids['pending'], self.server.database_ids['waiting'] )
+
             # set job as waiting
             dbconnection.query( db.JobDetails.job_id ).\
               filter( db.JobDetails.job_id==job.id ).\
@@ -1551,7 +2379,9 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
             # add to waiting jobs
             wJob = db.WaitingJob( job=job,
                                   user_id=job.user_id,
-                                  priorityValue=job.priority.value )
+                                  priorityValue=self.server.jobScheduler.get_priority_value( dbconnection,
+                                                                                             job.user_id,
+                                                                                             job.priority.value ) )
 
             # set history
             jobHistory = db.JobHistory( job=job,
@@ -1559,6 +2389,8 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
 
             dbconnection.introduce( jobHistory, wJob )
 
+        jobStatusCounter.save( dbconnection )
+
         dbconnection.commit()
 
         # free occupied slots from host
@@ -1569,8 +2401,24 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
 
         dbconnection.commit()
 
+        self.server.wakeup_loop( 'check_database' )
+
         request.send( "set {n} jobs as waiting".format(n=len(pJobs)) )
 
+    def process_reconcilecounters( self, request ):
+        """process 'reconcilecounters' command
+
+        rebuild the counters of jobs per user and job status, which are shown by the status of the
+        servers, from the jobs in the database.
+        
+        **Args**
+          | request (object): request object
+        """
+        
+        changed = self.server.reconcile_job_counters()
+
+        request.send( "corrected {n} counter{s}".format( n=len(changed), s='s' if len(changed)!=1 else '' ) )
+
     def process_failedjobs( self, request, json_str ):
         """process 'failedjobs' command
 
@@ -1581,9 +2429,9 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
           | json_str (json) json representation of a list with job_ids
         """
 
-        job_ids = json.loads( json_str )
+        job_ids = request.codec.loads( json_str )
         
-        dbconnection = hQDBConnection()
+        dbconnection = hQDBConnection( writer=True )
 
         # get job instances
         jobs = dbconnection.query( db.Job )\
@@ -1594,10 +2442,14 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
         slots = dict( dbconnection.query( db.HostSummary.host_id,
                                           db.HostSummary.number_occupied_slots ).all() )
 
+        jobStatusCounter = hQJobStatusCounter()
+
         occupiedSlots = defaultdict( int )
         for job in jobs:
             occupiedSlots[ job.job_details.host_id ] += job.slots
 
+            jobStatusCounter.move( job.user_id, job.job_details.job_status_id, self.server.database_ids['waiting'] )
+
             # set job as waiting
             dbconnection.query( db.JobDetails.job_id ).\
               filter( db.JobDetails.job_id==job.id ).\
@@ -1606,7 +2458,9 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
             # add to waiting jobs
             wJob = db.WaitingJob( job=job,
                                   user_id=job.user_id,
-                                  priorityValue=job.priority.value )
+                                  priorityValue=self.server.jobScheduler.get_priority_value( dbconnection,
+                                                                                             job.user_id,
+                                                                                             job.priority.value ) )
 
             # set history
             jobHistory = db.JobHistory( job=job,
@@ -1614,6 +2468,8 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
 
             dbconnection.introduce( jobHistory, wJob )
 
+        jobStatusCounter.save( dbconnection )
+
         dbconnection.commit()
 
         # free occupied slots from host
@@ -1624,8 +2480,25 @@ class hQRequestProcessor( hQBaseRequestProcessor ):
 
         dbconnection.commit()
 
+        self.server.wakeup_loop( 'check_database' )
+
         request.send( "set {n} jobs as waiting".format(n=len(jobs)) )
 
+    def process_jobfinished( self, request, job_ids ):
+        """process 'jobfinished' command
+
+        a hq-exec-server notifies that jobs have been finished. finished jobs are processed and
+        freed slots are occupied immediately by waking up loop ``check_database``.
+        
+        **Args**
+          | request (object): request object
+          | job_ids (string): comma separated list of job ids
+        """
+        self.server.wakeup_loop( 'check_database' )
+
+        request.send( 'ok' )
+
+        
     def process_collectgarbage( self, request ):
         """process 'updateload' command
 
@@ -9,6 +9,7 @@ import re
 import ConfigParser
 import socket
 import getpass
+import json
 
 # logging
 import sys
@@ -34,12 +35,16 @@ ETCPATH = "{hqpath}/etc".format( hqpath=os.environ['HQPATH'] )
 
 # import hq libraries
 from hq.lib.hQSocket import hQSocket
+from hq.lib.hQConnectionPool import connectionPool
 from hq.lib.hQServerDetails import hQServerDetails
 import hq.lib.hQUtils as hQUtils
 
 HOMEDIR = os.environ['HOME']
 USER = getpass.getuser()
 
+# max number of commands which are sent in a single batch request
+BATCH_SIZE = 1000
+
 class hQServerProxy(object):
     """! @brief Class for establishing a running Server, such as hq-user-server or hq-exec-server and connect to it"""
     def __init__(self,
@@ -323,17 +328,99 @@ class hQServerProxy(object):
 
 
     def sendAndRecv(self,request):
-        """ send request to server and receive response"""
-        self.send(request)
+        """ send request to server and receive response over a pooled connection"""
+        logger.info( "send request: {c}".format(c=request) )
+
+        try:
+            recv = connectionPool.request( self.host, self.port, request )
 
-        return self.recv()
+            recvShort = recv.replace('\n', '\\')[:30]
+            logger.info( "response from server: {r}{dots}".format(r=recvShort, dots="..." if len(recv)>30 else "" ) )
+
+            return recv
+        except socket.error,msg:
+            return msg.message
 
 
+    def sendBatch(self, requests):
+        """! @brief send many requests to server and receive their responses with few round trips
+
+        the requests are sent in batches of BATCH_SIZE requests with the command 'batch'. if the
+        server does not understand batches, the requests are sent one after another.
+
+        @param requests (list) requests
+
+        @return (list) response of server to each request in the same order
+        """
+        responses = []
+        for idx in xrange( 0, len(requests), BATCH_SIZE ):
+            batch = requests[ idx:idx+BATCH_SIZE ]
+
+            logger.info( "send batch of {n} requests".format( n=len(batch) ) )
+
+            recv = self.sendAndRecv( "batch:{j}".format( j=json.dumps( batch ) ) )
+
+            try:
+                batchResponses = json.loads( recv )
+            except ValueError:
+                # server does not understand batches
+                batchResponses = [ self.sendAndRecv( request ) for request in batch ]
+
+            responses.extend( batchResponses )
+
+        return responses
+
+
+    def sendStream(self, request, messages):
+        """! @brief send request and stream messages to server over a single connection
+
+        the server answers the request with 'ready'. afterwards, the response of the server is
+        received after each message. the end of the stream is indicated by an empty message.
+
+        @param request (string) request which opens the stream, e.g., addjobstream
+        @param messages (iterable) strings which are sent one after another
+
+        @return (generator) response of server to each message and to the end of the stream or
+                the response of the server if it refused the stream
+        """
+        logger.info( "open stream: {r}".format( r=request ) )
+
+        clientSock = connectionPool.send_request( self.host, self.port, request )
+
+        # connection can be reused only if stream has been completed
+        completed = False
+        try:
+            response = clientSock.recv()
+            if response!="ready":
+                # server refused the stream
+                completed = True
+                yield response
+                return
+
+            for message in messages:
+                clientSock.send( message )
+
+                yield clientSock.recv()
+
+            # end of stream
+            clientSock.send( "" )
+            response = clientSock.recv()
+            completed = True
+
+            yield response
+        finally:
+            logger.info( "close stream" )
+            
+            if completed:
+                connectionPool.checkin( self.host, self.port, clientSock )
+            else:
+                connectionPool.discard( clientSock )
+        
+        
     def sendAndClose(self,request):
-        """ send request to server and close connection"""
+        """ send request to server over a pooled connection without waiting for the response"""
         try:
-            self.send(request)
-            self.close()
+            connectionPool.send( self.host, self.port, request )
         except socket.error,msg:
             self.openConnection = False
             sys.stderr.write("SOCKET ERROR: % s\n" % msg)
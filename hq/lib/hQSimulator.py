@@ -0,0 +1,398 @@
+
+import heapq
+import random
+import time
+from datetime import datetime, timedelta
+from collections import defaultdict
+
+import sqlalchemy
+from sqlalchemy.pool import StaticPool
+
+# import hq libraries
+import hq.lib.hQDBSessionRegistry as hQDBSessionRegistry
+from hq.lib.hQDBConnection import hQDBConnection
+from hq.lib.hQJobSchedulerSimple import hQJobSchedulerSimple
+import hq.lib.hQDatabase as db
+
+
+class hQSimulator( object ):
+    """! @brief offline simulation of the job scheduler
+
+    A job trace is replayed on a set of hosts with a discrete-event clock. The scheduler classes
+    run unchanged against a local SQLite database (in-memory by default), so neither a MySQL
+    server nor a cluster is needed.
+
+    Events are the submission and the end of jobs. After all events at a given time have been
+    processed, a scheduling round is executed as in :meth:`hq.lib.hQServer.hQServer.check_database`.
+    Jobs which are sent to a host start immediately and end after their run time. The load of a
+    host is its number of occupied slots at the beginning of a round.
+
+    Jobs which do not fit on any active host, i.e., which require more slots or memory than any
+    host offers, are not submitted. They are counted as unplaceable in the report.
+
+    Each job in the trace is a dict::
+
+      {
+        'submit': float,           # submission time in seconds since start of simulation
+        'slots': int,              # number of slots
+        'runtime': float,          # run time in seconds
+        'user': str,               # name of user
+        'estimated_time': float,   # (optional) estimated run time in minutes
+        'estimated_memory': float  # (optional) estimated memory in MB
+      }
+
+    @param hosts (list) list of tuples (<host settings>,<host status>) as returned by
+                 :func:`hq.lib.hQUtils.read_cluster_table`
+    @param trace (list) list of jobs
+    @param placementPolicy (string) placement policy of scheduler
+    @param backfill (bool) use backfilling
+    @param fairshare (bool) use fair-share priorities
+    @param databaseFile (string) SQLite database file. in-memory database if not given
+    """
+    def __init__( self, hosts, trace, placementPolicy=None, backfill=None, fairshare=None, databaseFile=None ):
+        self.hosts = hosts
+        self.trace = sorted( trace, key=lambda j: j['submit'] )
+        self.placementPolicy = placementPolicy
+        self.backfill = backfill
+        self.fairshare = fairshare
+        self.databaseFile = databaseFile
+
+        # start of simulated time
+        self.startTime = datetime( 2000, 1, 1 )
+
+
+    def init_database( self ):
+        """! @brief create a fresh database with job states, users and hosts """
+        if self.databaseFile:
+            engine = sqlalchemy.create_engine( "sqlite:///{f}".format( f=self.databaseFile ) )
+        else:
+            engine = sqlalchemy.create_engine( "sqlite://",
+                                               connect_args={ 'check_same_thread': False },
+                                               poolclass=StaticPool )
+
+        hQDBSessionRegistry.bind_engine( engine )
+        db.Base.metadata.drop_all( bind=engine )
+        hQDBSessionRegistry.init_db( engine )
+
+        dbconnection = hQDBConnection()
+
+        for name in [ 'waiting', 'pending', 'running', 'finished' ]:
+            dbconnection.introduce( db.JobStatus( name=name ) )
+
+        self.priority = db.Priority( value=0 )
+        dbconnection.introduce( self.priority )
+
+        self.users = {}
+        for name in sorted( set( j['user'] for j in self.trace ) ):
+            self.users[ name ] = db.User( name=name, enabled=True )
+            dbconnection.introduce( self.users[ name ] )
+
+        for hostSettings,hostStatus in self.hosts:
+            if not hostStatus['active']:
+                continue
+
+            host = db.Host( **hostSettings )
+            dbconnection.introduce( host,
+                                    db.HostSummary( host=host, available=True, reachable=True, active=True ),
+                                    db.HostLoad( host=host, loadavg_1min=0, datetime=self.startTime ) )
+
+        dbconnection.commit()
+
+        self.database_ids = dict( dbconnection.query( db.JobStatus.name, db.JobStatus.id ).all() )
+        self.totalSlots = sum( h[0]['max_number_occupied_slots'] for h in self.hosts if h[1]['active'] )
+
+        return dbconnection
+
+
+    def fits( self, job ):
+        """! @brief check whether job fits on at least one active host
+
+        @param job (dict) job of trace
+
+        @return (bool)
+        """
+        memory = job.get( 'estimated_memory', None )
+
+        for hostSettings,hostStatus in self.hosts:
+            if hostStatus['active'] and \
+               job['slots'] <= hostSettings['max_number_occupied_slots'] and \
+               ( not memory or not hostSettings.get( 'total_memory', None ) or memory <= hostSettings['total_memory'] ):
+                return True
+
+        return False
+
+
+    def run( self ):
+        """! @brief replay trace
+
+        @return (dict) report, see :meth:`get_report`
+        """
+        dbconnection = self.init_database()
+
+        scheduler = hQJobSchedulerSimple( placementPolicy=self.placementPolicy,
+                                          backfill=self.backfill,
+                                          fairshare=self.fairshare )
+        self.scheduler = scheduler
+
+        # queue of events (<time>,<sequence number>,<kind>,<job>)
+        events = []
+        # jobs which would wait forever
+        self.unplaceable = 0
+        for idx,job in enumerate( self.trace ):
+            if self.fits( job ):
+                heapq.heappush( events, ( job['submit'], idx, 'submit', job ) )
+            else:
+                self.unplaceable += 1
+        seq = len( self.trace )
+
+        # {<Job.id>: <trace job>, ...}
+        jobs = {}
+
+        self.starts = {}
+        self.ends = {}
+        self.roundTimes = []
+
+        while events:
+            now = events[0][0]
+
+            # process all events at current time
+            while events and events[0][0]==now:
+                t,_,kind,job = heapq.heappop( events )
+
+                if kind=='submit':
+                    jobs[ self.submit_job( dbconnection, job, now ) ] = job
+                else:
+                    self.finish_job( dbconnection, job, now )
+
+            dbconnection.commit()
+
+            # scheduling round
+            for jobID,hostID in self.schedule( dbconnection, scheduler, now ):
+                self.starts[ jobID ] = now
+
+                heapq.heappush( events, ( now + jobs[ jobID ]['runtime'], seq, 'end', jobID ) )
+                seq += 1
+
+        return self.get_report( jobs )
+
+
+    def get_time( self, seconds ):
+        """! @brief convert simulated seconds into datetime """
+        return self.startTime + timedelta( seconds=seconds )
+
+
+    def submit_job( self, dbconnection, job, now ):
+        """! @brief add job as waiting job
+
+        @return (int) database id of job
+        """
+        dt = self.get_time( now )
+
+        newJob = db.Job( user=self.users[ job['user'] ],
+                         command='sleep {t}'.format( t=job['runtime'] ),
+                         slots=job['slots'],
+                         priority=self.priority,
+                         shell='bash',
+                         estimated_time=job.get( 'estimated_time', None ),
+                         estimated_memory=job.get( 'estimated_memory', None ) )
+
+        dbconnection.introduce( newJob,
+                                db.JobDetails( job=newJob, job_status_id=self.database_ids['waiting'] ),
+                                db.WaitingJob( job=newJob,
+                                               user=newJob.user,
+                                               priorityValue=self.scheduler.get_priority_value( dbconnection, newJob.user.id, self.priority.value, now=dt ),
+                                               datetime=dt ),
+                                db.JobHistory( job=newJob, job_status_id=self.database_ids['waiting'], datetime=dt ) )
+        dbconnection.session.flush()
+
+        return newJob.id
+
+
+    def finish_job( self, dbconnection, jobID, now ):
+        """! @brief set job as finished as done by the hq-exec-server """
+        self.ends[ jobID ] = now
+
+        dbconnection.query( db.JobDetails )\
+          .filter( db.JobDetails.job_id==jobID )\
+          .update( { db.JobDetails.job_status_id: self.database_ids['finished'] } )
+
+        dbconnection.introduce( db.JobHistory( job_id=jobID,
+                                               job_status_id=self.database_ids['finished'],
+                                               datetime=self.get_time( now ) ),
+                                db.FinishedJob( job_id=jobID ) )
+
+
+    def schedule( self, dbconnection, scheduler, now ):
+        """! @brief process finished jobs and start waiting jobs on vacant hosts
+
+        @return (list) list of tuples (<Job.id>,<Host.id>) of started jobs
+        """
+        dt = self.get_time( now )
+
+        # free slots of finished jobs
+        finishedJobs = dbconnection.query( db.FinishedJob ).all()
+        if finishedJobs:
+            occupiedSlots = defaultdict( int )
+
+            for finishedJob in finishedJobs:
+                occupiedSlots[ finishedJob.job.job_details.host_id ] += finishedJob.job.slots
+                dbconnection.delete( finishedJob )
+
+            scheduler.update_usage( dbconnection, [ f.job_id for f in finishedJobs ], now=dt )
+
+            for hostID,slots in occupiedSlots.iteritems():
+                dbconnection.query( db.HostSummary )\
+                  .filter( db.HostSummary.host_id==hostID )\
+                  .update( { db.HostSummary.number_occupied_slots: db.HostSummary.number_occupied_slots - slots } )
+
+            dbconnection.commit()
+
+        # load of each host is its number of occupied slots
+        self.update_load( dbconnection )
+
+        freeSlots = self.totalSlots - sum( s for s, in dbconnection.query( db.HostSummary.number_occupied_slots ).all() )
+
+        if freeSlots<=0:
+            return []
+
+        t1 = time.time()
+        jobs = scheduler.next( numJobs=freeSlots, now=dt )
+        self.roundTimes.append( time.time() - t1 )
+
+        startedJobs = []
+        for userID,jobID,hostID in jobs:
+            slots, = dbconnection.query( db.Job.slots ).filter( db.Job.id==jobID ).one()
+
+            dbconnection.query( db.JobDetails )\
+              .filter( db.JobDetails.job_id==jobID )\
+              .update( { db.JobDetails.job_status_id: self.database_ids['running'],
+                         db.JobDetails.host_id: hostID } )
+            dbconnection.query( db.HostSummary )\
+              .filter( db.HostSummary.host_id==hostID )\
+              .update( { db.HostSummary.number_occupied_slots: db.HostSummary.number_occupied_slots + slots } )
+            dbconnection.query( db.WaitingJob ).filter( db.WaitingJob.job_id==jobID ).delete()
+            dbconnection.introduce( db.JobHistory( job_id=jobID,
+                                                   job_status_id=self.database_ids['running'],
+                                                   datetime=dt ) )
+
+            startedJobs.append( (jobID,hostID) )
+
+        dbconnection.commit()
+
+        return startedJobs
+
+
+    def update_load( self, dbconnection ):
+        """! @brief set load of each host to its number of occupied slots """
+        for hostID,occupied in dbconnection.query( db.HostSummary.host_id, db.HostSummary.number_occupied_slots ).all():
+            dbconnection.query( db.HostLoad )\
+              .filter( db.HostLoad.host_id==hostID )\
+              .update( { db.HostLoad.loadavg_1min: occupied } )
+
+
+    def get_report( self, jobs ):
+        """! @brief summarize simulation
+
+        @param jobs (dict) {<Job.id>: <trace job>, ...}
+
+        @return (dict) report::
+
+          {
+            'jobs': int,                # number of submitted jobs
+            'unplaceable': int,         # number of jobs which do not fit on any host
+            'unfinished': int,          # number of submitted jobs which have never been started
+            'makespan': float,          # time between first submission and last end in seconds
+            'mean_wait': float,         # mean time between submission and start in seconds
+            'utilization': float,       # used slot-seconds / available slot-seconds
+            'rounds': int,              # number of scheduling rounds
+            'mean_round_latency': float, # mean wall time of a scheduling round in ms
+            'max_round_latency': float  # maximal wall time of a scheduling round in ms
+          }
+        """
+        started = [ jobID for jobID in jobs if jobID in self.starts ]
+
+        if self.ends:
+            makespan = max( self.ends.itervalues() ) - min( j['submit'] for j in jobs.itervalues() )
+        else:
+            makespan = 0.0
+
+        usedSlotSeconds = sum( jobs[ jobID ]['slots'] * jobs[ jobID ]['runtime'] for jobID in started )
+
+        report = { 'jobs': len( jobs ),
+                   'unplaceable': self.unplaceable,
+                   'unfinished': len( jobs ) - len( started ),
+                   'makespan': makespan,
+                   'mean_wait': sum( self.starts[ jobID ] - jobs[ jobID ]['submit'] for jobID in started ) / max( len( started ), 1 ),
+                   'utilization': usedSlotSeconds / float( self.totalSlots * makespan ) if makespan and self.totalSlots else 0.0,
+                   'rounds': len( self.roundTimes ),
+                   'mean_round_latency': 1000 * sum( self.roundTimes ) / max( len( self.roundTimes ), 1 ),
+                   'max_round_latency': 1000 * max( self.roundTimes or [0] ) }
+
+        return report
+
+
+def read_trace( fileName ):
+    """! @brief read job trace from tab delimited file
+
+    each line contains: submit time (s), slots, run time (s), user[, estimated time (min)[,
+    estimated memory (MB)]]. lines starting with '#' are skipped.
+
+    @param fileName (string) path to trace file
+
+    @return (list) list of jobs, see :class:`hQSimulator`
+    """
+    trace = []
+    with open( fileName ) as f:
+        for line in f:
+            line = line.strip()
+
+            if not line or line[0]=='#':
+                continue
+
+            columns = line.split( '\t' )
+
+            job = { 'submit': float( columns[0] ),
+                    'slots': int( columns[1] ),
+                    'runtime': float( columns[2] ),
+                    'user': columns[3] }
+
+            if len( columns )>4 and columns[4]:
+                job['estimated_time'] = float( columns[4] )
+            if len( columns )>5 and columns[5]:
+                job['estimated_memory'] = float( columns[5] )
+
+            trace.append( job )
+
+    return trace
+
+
+def generate_trace( numJobs, numUsers=4, maxSlots=4, meanRuntime=600, meanInterarrival=5, seed=None ):
+    """! @brief generate synthetic job trace
+
+    submissions follow a Poisson process, run times are exponentially distributed. Each job carries
+    its exact run time as estimated time.
+
+    @param numJobs (int) number of jobs
+    @param numUsers (int) number of users
+    @param maxSlots (int) maximal number of slots of a job
+    @param meanRuntime (float) mean run time in seconds
+    @param meanInterarrival (float) mean time between two submissions in seconds
+    @param seed (int) seed of random number generator
+
+    @return (list) list of jobs, see :class:`hQSimulator`
+    """
+    rand = random.Random( seed )
+
+    trace = []
+    t = 0.0
+    for idx in xrange( numJobs ):
+        t += rand.expovariate( 1.0/meanInterarrival )
+        runtime = max( 1.0, round( rand.expovariate( 1.0/meanRuntime ) ) )
+
+        trace.append( { 'submit': round( t ),
+                        'slots': rand.randint( 1, maxSlots ),
+                        'runtime': runtime,
+                        'user': 'user{i}'.format( i=rand.randrange( numUsers ) ),
+                        'estimated_time': runtime/60.0 } )
+
+    return trace
@@ -2,14 +2,76 @@ import os
 import socket
 import ssl
 import re
+import struct
 from datetime import datetime,timedelta,date
 import traceback
 import sys
 import ConfigParser
+import threading
+
+# import hq libraries
+from hq.lib.hQCodec import JSON_CODEC
 
 # path to config files
 ETCPATH = "{hqpath}/etc".format( hqpath=os.environ['HQPATH'] )
 
+# header of a length-prefixed message: length of message as unsigned 4-byte int in network byte order
+LENGTH_HEADER = struct.Struct( '!I' )
+
+# max number of bytes read with a single call of recv
+RECV_SIZE = 65536
+
+# default max length in bytes of a length-prefixed message. the header is sent by the peer, so
+# the buffer for a message must not be allocated without a limit
+MAX_MESSAGE_SIZE = 128*1024*1024
+
+# ssl contexts shared by all connections of a process {(<server side>,<certfile>,<keyfile>,<ca_certs>): ssl.SSLContext, ...}
+SSL_CONTEXTS = {}
+SSL_CONTEXTS_LOCK = threading.Lock()
+
+
+def get_ssl_context( serverSide, certfile=None, keyfile=None, ca_certs=None ):
+    """get ssl context which is shared by all connections of a process
+
+    certificates are loaded only once per process. only TLS 1.2 and newer is accepted. the
+    server side keeps a session cache and issues session tickets. the peer has to present a
+    certificate signed by ca_certs if ca_certs is given.
+
+    **Args**
+      | serverSide (bool): context for server side of connections
+      | certfile (string): file with certificate
+      | keyfile (string): file with private key. default: key is part of certfile
+      | ca_certs (string): file with certificates of trusted certificate authorities
+
+    **Returns**
+      ssl.SSLContext: context
+    """
+    key = ( serverSide, certfile, keyfile, ca_certs )
+    
+    with SSL_CONTEXTS_LOCK:
+        if key not in SSL_CONTEXTS:
+            context = ssl.SSLContext( ssl.PROTOCOL_SSLv23 )
+            context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3 | ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
+            context.options |= getattr( ssl, 'OP_NO_COMPRESSION', 0 )
+
+            if serverSide:
+                context.options |= getattr( ssl, 'OP_CIPHER_SERVER_PREFERENCE', 0 )
+
+            if certfile:
+                context.load_cert_chain( certfile, keyfile )
+
+            if ca_certs:
+                context.load_verify_locations( ca_certs )
+                context.verify_mode = ssl.CERT_REQUIRED
+            elif not serverSide:
+                context.load_default_certs()
+                context.verify_mode = ssl.CERT_REQUIRED
+
+            SSL_CONTEXTS[ key ] = context
+
+        return SSL_CONTEXTS[ key ]
+
+
 class hQSocket( object ):
     """ class for socket communication"""
     def __init__(self,
@@ -41,12 +103,32 @@ class hQSocket( object ):
         
         self.serverSideSSLConn=serverSideSSLConn
         
-        self.certfile=certfile
-        self.keyfile=keyfile
-        self.ca_certs=ca_certs
+        # certificates are taken from hq.cfg if not given
+        self.certfile=certfile or self.getOption('certfile')
+        self.keyfile=keyfile or self.getOption('keyfile')
+        self.ca_certs=ca_certs or self.getOption('ca_certs')
 
         self.EOCString = self.hqConfig.get('CONNECTION','EOCString')	# end of communication string
+        # 'eoc': messages end with EOCString, 'length': messages are prefixed by their length
+        if self.hqConfig.has_option('CONNECTION','framing'):
+            self.framing = self.hqConfig.get('CONNECTION','framing')
+        else:
+            self.framing = 'eoc'
         self.sslConnection = self.hqConfig.getboolean('CONNECTION','sslConnection')
+
+        # max length of length-prefixed messages
+        if self.hqConfig.has_option('CONNECTION','max_message_size'):
+            self.maxMessageSize = self.hqConfig.getint('CONNECTION','max_message_size')
+        else:
+            self.maxMessageSize = MAX_MESSAGE_SIZE
+
+        # codec which is requested for payloads of persistent connections
+        if self.hqConfig.has_option('CONNECTION','codec'):
+            self.codecName = self.hqConfig.get('CONNECTION','codec')
+        else:
+            self.codecName = JSON_CODEC.name
+        # codec of payloads on this connection. is negotiated for persistent connections
+        self.codec = JSON_CODEC
         
         if self.host and self.port:
             self.initSocket(self.host,self.port)
@@ -62,6 +144,13 @@ class hQSocket( object ):
             if self.sslConnection and type(self.socket)!=ssl.SSLSocket:
                 self.wrapSocket()
                 
+    def getOption(self, option):
+        # get option of section CONNECTION in hq.cfg or None if not set
+        if self.hqConfig.has_option('CONNECTION',option):
+            return self.hqConfig.get('CONNECTION',option) or None
+        else:
+            return None
+
     def initSocket(self,host,port):
         self.host = host
         self.port = port
@@ -82,18 +171,17 @@ class hQSocket( object ):
                 raise
 
     def wrapSocket(self):
-        # wrap socket as ssl socket
+        # wrap socket as ssl socket. the ssl context is shared by all connections of the process
         try:
-            self.socket = ssl.wrap_socket( self.socket,
-                                           server_side = self.serverSideSSLConn,
-                                           certfile = self.certfile,
-                                           keyfile = self.keyfile,
-                                           ca_certs = self.ca_certs,
-                                           cert_reqs = ssl.CERT_REQUIRED,
-                                           ssl_version = ssl.PROTOCOL_SSLv3)
+            context = get_ssl_context( self.serverSideSSLConn,
+                                       certfile = self.certfile,
+                                       keyfile = self.keyfile,
+                                       ca_certs = self.ca_certs )
+            
+            self.socket = context.wrap_socket( self.socket,
+                                               server_side = self.serverSideSSLConn )
             
         except ssl.SSLError,msg:
-            traceback.print_exc(file=sys.stdout)
             self.connectionError = True
             if self.catchErrors:
                 sys.stderr.write("[%s] hQSocket: Could not connect to %s:%s\n" % (datetime.now().strftime("%Y.%m.%d %H:%M:%S"),self.host,self.port))
@@ -101,6 +189,8 @@ class hQSocket( object ):
                 #sys.stderr.wrtie("TRACBACK:")
                 #traceback.print_exc(file=sys.stderr)
                 #sys.stderr.write("-------------------------\n")
+            else:
+                raise
                 
 
         
@@ -110,26 +200,14 @@ class hQSocket( object ):
             h,p = self.socket.getpeername()
             self.receivedStr = ""
 
-            if self.EOCString:
-                m = re.compile( "{eoc}$".format(eoc=self.EOCString) )
-                
-                # listen to socket until EOC string appears
-                while 1:
-                    if self.logFileIn:
-                        self.logFileIn.write("[%s] [%s:%s] reading from socket ...\n" % (datetime.now().strftime("%Y.%m.%d %H:%M:%S"),h,p))
-                        self.logFileIn.flush()
-
-                    s = self.socket.recv(1024)
-                    if not s:
-                        # probably socket has been closed
-                        break
-                    elif m.search(self.receivedStr+s):
-                        #s = s.replace(self.EOCString,"")
-                        self.receivedStr += s
-                        self.receivedStr = m.sub("",self.receivedStr)
-                        break
-
-                    self.receivedStr += s
+            if self.logFileIn:
+                self.logFileIn.write("[%s] [%s:%s] reading from socket ...\n" % (datetime.now().strftime("%Y.%m.%d %H:%M:%S"),h,p))
+                self.logFileIn.flush()
+
+            if self.framing=='length':
+                self.receivedStr = self.recvLengthPrefixed()
+            elif self.EOCString:
+                self.receivedStr = self.recvEOC()
             else:
                 self.receivedStr = self.socket.recv(2048)
 
@@ -191,15 +269,101 @@ class hQSocket( object ):
             else:
                 raise
                 
+    def recvEOC(self):
+        """ read message which ends with EOC string
+
+        only the end of the received data is checked for the EOC string, so the time is linear in
+        the length of the message.
+        """
+        chunks = []
+        # last bytes of received data
+        tail = ""
+        
+        # listen to socket until EOC string appears
+        while 1:
+            s = self.socket.recv(RECV_SIZE)
+            if not s:
+                # probably socket has been closed
+                break
+
+            chunks.append( s )
+            tail = (tail + s)[ -len(self.EOCString): ]
+
+            if tail==self.EOCString:
+                break
+
+        receivedStr = "".join( chunks )
+        
+        if receivedStr.endswith( self.EOCString ):
+            receivedStr = receivedStr[ :-len(self.EOCString) ]
+
+        return receivedStr
+
+    
+    def recvExactly(self, buf):
+        """ fill buffer from socket
+
+        returns number of received bytes which is less than the size of the buffer only if the
+        socket has been closed.
+        """
+        view = memoryview( buf )
+        size = len( buf )
+        
+        numBytes = 0
+        while numBytes<size:
+            n = self.socket.recv_into( view[ numBytes: ], min( size-numBytes, RECV_SIZE ) )
+            if not n:
+                # probably socket has been closed
+                break
+
+            numBytes += n
+
+        return numBytes
+
+    
+    def recvLengthPrefixed(self):
+        """ read message which is prefixed by its length
+
+        the message is read into a preallocated buffer, which is converted to a string at the end.
+        thus, the message is copied once after it has been received.
+
+        raises socket.error if the length exceeds :attr:`maxMessageSize` or if the socket is closed
+        before the message has been received completely. a truncated message is never returned.
+        """
+        header = bytearray( LENGTH_HEADER.size )
+
+        numBytes = self.recvExactly( header )
+        if numBytes==0:
+            # socket has been closed
+            return ""
+        elif numBytes<LENGTH_HEADER.size:
+            raise socket.error( "connection has been closed within header of message" )
+
+        length, = LENGTH_HEADER.unpack( str(header) )
+
+        if length>self.maxMessageSize:
+            raise socket.error( "message of {n} bytes exceeds max message size of {m} bytes".format( n=length, m=self.maxMessageSize ) )
+
+        buf = bytearray( length )
+        numBytes = self.recvExactly( buf )
+
+        if numBytes<length:
+            raise socket.error( "connection has been closed after {n} of {l} bytes of message".format( n=numBytes, l=length ) )
+
+        return str( buf )
+
+    
     def send(self,s):
         try:
             # send string to socket
-            if self.EOCString:
+            if self.framing=='length':
+                ss = LENGTH_HEADER.pack( len(s) ) + s
+            elif self.EOCString:
                 ss = s + self.EOCString
             else:
                 ss = s
 
-            self.socket.send(ss)
+            self.socket.sendall(ss)
                 
             if self.logFileOut:
                 if s:
@@ -245,6 +409,69 @@ class hQSocket( object ):
             else:
                 raise
 
+    def sendLines(self, lines):
+        """ send lines as a single message in which the lines are separated by newlines
+
+        with EOC framing the lines are written to the socket in chunks while they are produced, so
+        the message is never held in memory as a whole. length-prefixed messages have to know
+        their length in advance and are sent with :meth:`send`.
+
+        **Args**
+          | lines (iterable): strings without newline
+        """
+        if self.framing=='length' or not self.EOCString:
+            self.send( "\n".join( lines ) )
+            return
+
+        try:
+            firstLine = None
+            numBytes = 0
+            chunk = []
+            chunkSize = 0
+            for line in lines:
+                if firstLine is None:
+                    firstLine = line
+                else:
+                    line = "\n" + line
+
+                chunk.append( line )
+                chunkSize += len( line )
+
+                if chunkSize>=RECV_SIZE:
+                    self.socket.sendall( "".join( chunk ) )
+                    numBytes += chunkSize
+                    chunk = []
+                    chunkSize = 0
+
+            chunk.append( self.EOCString )
+            self.socket.sendall( "".join( chunk ) )
+            numBytes += chunkSize
+
+            if self.logFileOut and numBytes:
+                h,p = self.socket.getpeername()
+                self.logFileOut.write("[%s] [%s:%s] Out: %s[...][%s]\n" % (datetime.now().strftime("%Y.%m.%d %H:%M:%S"),h,p,firstLine[:60],numBytes))
+                self.logFileOut.flush()
+
+            self.sentStr = firstLine or ""
+
+        except:
+            self.connectionError = True
+            if self.catchErrors:
+                # traceback object
+                tb = sys.exc_info()
+
+                h,p = ("?","?")
+                # get peername if possible
+                try:
+                    h,p = self.socket.getpeername()
+                except:
+                    pass
+
+                sys.stderr.write("[%s] hQSocket: Error while sending something from %s:%s\n" % (datetime.now().strftime("%Y.%m.%d %H:%M:%S"),h,p))
+                traceback.print_exception(*tb,file=sys.stderr)
+            else:
+                raise
+
     def close(self):
         # close socket
         h,p = self.socket.getpeername()
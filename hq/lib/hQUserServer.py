@@ -2,7 +2,7 @@
 from datetime import datetime
 from time import sleep
 import threading
-from sqlalchemy import and_, not_, func
+from sqlalchemy import and_, or_, not_, func, select
 from operator import itemgetter, attrgetter
 from sqlalchemy.orm.exc import NoResultFound
 import pwd
@@ -11,6 +11,7 @@ import json
 import sys
 from copy import deepcopy
 from collections import defaultdict
+from itertools import chain
 import traceback
 from pprint import pprint as pp
 
@@ -18,8 +19,10 @@ from pprint import pprint as pp
 from hq.lib.hQBaseServer import hQBaseServer,hQBaseServerHandler,hQBaseRequestProcessor
 from hq.lib.hQServerDetails import hQServerDetails
 from hq.lib.hQDBConnection import hQDBConnection
+from hq.lib.hQJobStatusCounter import get_job_counts
 from hq.lib.hQCommand import hQCommand
 from hq.lib.hQSocket import hQSocket
+from hq.lib.hQConnectionPool import serverConnectionPool
 from hq.lib.hQServerProxy import hQServerProxy
 from hq.lib.daemon import Daemon
 import hq.lib.hQDatabase as db
@@ -108,19 +111,8 @@ class hQUserServer(hQBaseServer, Daemon):
         self.logger.write( "print status: request database about status",
                            logCategory='debug' )
 
-        # get all number of jobs for each status type
-        query = dbconnection.query( db.JobStatus.name,
-                                    func.count('*') )\
-                                    .join( db.JobDetails )\
-                                    .join( db.Job )\
-                                    .filter( db.Job.user_id==self.user_id )\
-                                    .group_by( db.JobStatus.name )
-
-        counts = dict( query.all() )
-
-        if not counts:
-            # no jobs so far in the database
-            counts = {}
+        # get all number of jobs of user for each status type
+        counts = get_job_counts( dbconnection, user_id=self.user_id )
 
         self.logger.write( "print status: get slot info",
                            logCategory='debug' )
@@ -295,6 +287,7 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
         super( hQUserServerRequestProcessor, self ).__init__()
         
         self.commands["LSS"] = hQCommand( name = "lss",
+                                          readonly = True,
                                           regExp = "^lss$",
                                           help = "return list of hq-exec-servers",
                                           fct = self.process_lss )
@@ -316,47 +309,64 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
                                               arguments = ["json_str"],
                                               help = "add multiple jobs at once to hq.",
                                               fct = self.process_addjobs )
+        self.commands["ADDJOBSTREAM"] = hQCommand( name = "addjobstream",
+                                                   regExp = "^addjobstream$",
+                                                   help = "add jobs to hq which are streamed over the same connection as newline-delimited json. an empty message ends the stream.",
+                                                   fct = self.process_addjobstream )
         self.commands["RUN"] = hQCommand( name = "run",
                                           regExp = "^run:(.*)",
                                           arguments = ["json_str"],
                                           help = "message from hq-server to run jobs",
                                           fct = self.process_run )
         self.commands["LSWJOBS"] = hQCommand( name = 'lswjobs',
+                                              readonly = True,
                                               regExp = '^lswjobs:?(.*)',
                                               arguments = ['num'],
                                               help = "return the last num waiting jobs. default: return the last 10. specify 'all' in order to return all waiting jobs",
                                               fct = self.process_lswjobs )
         self.commands["LSPJOBS"] = hQCommand( name = 'lspjobs',
+                                              readonly = True,
                                               regExp = '^lspjobs:?(.*)',
                                               arguments = ['num'],
                                               help = "return the last num pending jobs. default: return the last 10. specify 'all' in order to return all pending jobs",
                                               fct = self.process_lspjobs )
         self.commands["LSRJOBS"] = hQCommand( name = 'lsrjobs',
+                                              readonly = True,
                                               regExp = '^lsrjobs:?(.*)',
                                               arguments = ['num'],
                                               help = "return the last num running jobs. default: return the last 10. specify 'all' in order to return all running jobs",
                                               fct = self.process_lsrjobs )
         self.commands["LSFJOBS"] = hQCommand( name = 'lsfjobs',
+                                              readonly = True,
                                               regExp = '^lsfjobs:?(.*)',
                                               arguments = ['num'],
                                               help = "return the last num finished jobs. default: return the last 10. specify 'all' in order to return all finished jobs",
                                               fct = self.process_lsfjobs )
+        self.commands["LSARRAYS"] = hQCommand( name = 'lsarrays',
+                                               readonly = True,
+                                               regExp = '^lsarrays$',
+                                               help = "return job arrays which are not finished yet together with the number of tasks in each status",
+                                               fct = self.process_lsarrays )
         self.commands["LAJOB"] = hQCommand( name = 'lajob',
-                                            regExp = 'lajob:(.*)',
+                                            readonly = True,
+                                            regExp = '^lajob:(.*)',
                                             arguments = ["job_id"],
                                             help = "return job info about job with given jobID",
                                             fct = self.process_lajob )
         self.commands["LSGROUPS"] = hQCommand( name = 'lsgroups',
-                                            regExp = 'lsgroups',
+                                            readonly = True,
+                                            regExp = '^lsgroups$',
                                             help = "return groups of user",
                                             fct = self.process_lsgroups )
         self.commands["LAGROUP"] = hQCommand( name = 'lagroup',
-                                            regExp = 'lagroup:(.*)',
+                                            readonly = True,
+                                            regExp = '^lagroup:(.*)',
                                             arguments = ["group_name"],
                                             help = "return details about group with given group identifier",
                                             fct = self.process_lagroup )
         self.commands["FINDJOBS"] = hQCommand( name = 'findjobs',
-                                               regExp = 'findjobs:(.*)',
+                                               readonly = True,
+                                               regExp = '^findjobs:(.*)',
                                                arguments = ["match_str"],
                                                help = "return all jobs which match the search string in command, info text or group.",
                                                fct = self.process_findjobs )
@@ -446,6 +456,9 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
              'infoText': <string>,
              'logfile': <string>,
              'priority': <int>,
+             'reservation': <code of reservation>,
+             'dependencies': <comma separated list of TYPE:ID[:ID...]>,
+             'array': <FIRST-LAST>,
              'shell': <bash|csh>,
              'slots': <int>,
              'stderr': <string>,
@@ -453,7 +466,7 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
 
         """
 
-        job = json.loads( json_str )
+        job = request.codec.loads( json_str )
         
         # register job at TaskDispatcher
         jsonOutObj =  { 'user_id': self.server.user_id,
@@ -464,15 +477,9 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
 
         #self.server.logger.info('[%s] ... submit jobs to cluster' % threadName)
 
-        jsonOutObj = json.dumps(jsonOutObj)
-        com = "add:%s" % jsonOutObj
-
         try:
-            # instantiate new socket
-            clientSock = hQSocket( catchErrors = False )
-            clientSock.initSocket( HQ_SERVER_HOST, HQ_SERVER_PORT )
-            clientSock.send( com )
-            jobID = clientSock.recv()
+            # use persistent connection to hq-server
+            jobID = serverConnectionPool.request( HQ_SERVER_HOST, HQ_SERVER_PORT, "add", jsonOutObj )
 
             if jobID=="What do you want?":
                 response = "Could not submit job to hq-server."
@@ -499,6 +506,9 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
              'infoText': <string>,
              'logfile': <string>,
              'priority': <int>,
+             'reservation': <code of reservation>,
+             'dependencies': <comma separated list of TYPE:ID[:ID...]>,
+             'array': <FIRST-LAST>,
              'shell': <bash|csh>,
              'slots': <int>,
              'stderr': <string>,
@@ -507,7 +517,7 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
         
         """
         
-        jobs = json.loads( json_str )
+        jobs = request.codec.loads( json_str )
         
         # register job at TaskDispatcher
         jsonOutObj =  { 'user_id': self.server.user_id,
@@ -518,15 +528,9 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
 
         #self.server.logger.info('[%s] ... submit jobs to cluster' % threadName)
 
-        jsonOutObj = json.dumps(jsonOutObj)
-        com = "add:%s" % jsonOutObj
-
         try:
-            # instantiate new socket
-            clientSock = hQSocket( catchErrors = False )
-            clientSock.initSocket( HQ_SERVER_HOST, HQ_SERVER_PORT )
-            clientSock.send( com )
-            jobID = clientSock.recv()
+            # use persistent connection to hq-server
+            jobID = serverConnectionPool.request( HQ_SERVER_HOST, HQ_SERVER_PORT, "add", jsonOutObj )
 
             if jobID=="What do you want?":
                 response = "Could not submit job to hq-server."
@@ -539,6 +543,57 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
             request.send("Could not connect to hq-server.")
 
 
+    def process_addjobstream( self, request ):
+        """ ! @brief process 'addjobstream' command
+
+        jobs are received in batches over the same connection. each batch contains one job per
+        line given as json representation of a dictinary (see addjobs). each batch is relayed to
+        the hq-server over a single connection and the response of the hq-server, the ids of the
+        added jobs, is sent back. an empty message ends the stream. the stream is acknowledged
+        with 'ready' if the hq-server accepts it.
+        """
+        
+        # register job stream at hq-server
+        jsonOutObj =  { 'user_id': self.server.user_id,
+                        'host': self.server.host,
+                        'port': self.server.port,
+                        'id': self.server.server_id }
+
+        try:
+            # use persistent connection to hq-server
+            clientSock = serverConnectionPool.send_request( HQ_SERVER_HOST, HQ_SERVER_PORT, "addjobstream", jsonOutObj )
+            response = clientSock.recv()
+        except:
+            traceback.print_exc(file=sys.stderr)
+            request.send("Could not connect to hq-server.")
+            return
+
+        # 'ready' or reason why hq-server refused the stream
+        request.send( response )
+
+        if response!="ready":
+            serverConnectionPool.checkin( HQ_SERVER_HOST, HQ_SERVER_PORT, clientSock )
+            return
+
+        # relay batches without keeping them
+        try:
+            while True:
+                batch = request.recv()
+
+                clientSock.send( batch )
+                request.send( clientSock.recv() )
+
+                if not batch:
+                    # end of stream
+                    break
+        except:
+            # connection is in an unknown state
+            serverConnectionPool.discard( clientSock )
+            raise
+
+        serverConnectionPool.checkin( HQ_SERVER_HOST, HQ_SERVER_PORT, clientSock )
+            
+
     def process_run( self, request, json_str ):
         """ ! @brief process 'addjobs' command
 
@@ -550,20 +605,17 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
                          'jobs': [<JOB.id>, ...], ... }
         """
 
-        jobs = json.loads( json_str )
+        jobs = request.codec.loads( json_str )
         failed = self._send_jobs( jobs )
 
         if failed:
             # there are still some jobs which could not be executed.
             # send them back
             failed_jobs = []
-            [ failed_jobs.append( jobs[ h ]['jobs'] ) for h in failed ]
+            [ failed_jobs.extend( jobs[ h ]['jobs'] ) for h in failed ]
 
-            cmd = "failedjobs:{j}".format(j=json.dumps( failed ) )
-
-            clientSock = hQSocket( catchErrors = False )
-            clientSock.initSocket( HQ_SERVER_HOST, HQ_SERVER_PORT )
-            clientSock.send( cmd )
+            # use persistent connection to hq-server. do not wait for response
+            serverConnectionPool.send( HQ_SERVER_HOST, HQ_SERVER_PORT, "failedjobs", failed_jobs )
 
             
     def _send_jobs( self, jobs ):
@@ -602,66 +654,87 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
        
     def _render_job_list( self, num, job_type ):
         """ ! @brief helper function for lswjobs, lspjobs, ...
+
+        generates lines of list. the jobs are read with a single query and the rows are fetched
+        in batches.
         """
 
         if not num:
             # default
             num=10
 
-        # connect to database
-        dbconnection = hQDBConnection()
-
-        query = dbconnection.query( db.Job )\
-                .join( db.JobDetails )\
-                .join( db.JobHistory )\
-                .filter( db.JobDetails.job_status_id==self.server.database_ids[job_type] )\
-                .filter( db.JobHistory.job_status_id==self.server.database_ids[job_type] )\
-                .filter( db.Job.user_id==self.server.user_id )\
-                .order_by( db.JobHistory.datetime.desc() )
-        
-        if num!='all':
-            query = query.limit( int(num) )
-
-        jobs = query.all()
-
-        header = []
-        response = []
+        jobStatusID = self.server.database_ids[job_type]
 
         if job_type=="waiting":
-            header.append( "Waiting jobs" )
-            header.append( "------------" )
+            header = [ "Waiting jobs",
+                       "------------" ]
             
             jobString = "{i:3d} - [jobid:{id}] [user:{user}] [status:waiting since {t}] [group:{group}] [info:{info}] [command:{command}{dots}]"
 
         elif job_type=="pending":
-            header.append( "Pending jobs" )
-            header.append( "------------" )
+            header = [ "Pending jobs",
+                       "------------" ]
             
-            jobString = "{i:3d} - [jobid:{id}] [user:{user}] [status:pending on {host} since {t}] [group:{group}] [info:{info}] [command:{command}{dots}]\n"
+            jobString = "{i:3d} - [jobid:{id}] [user:{user}] [status:pending on {host} since {t}] [group:{group}] [info:{info}] [command:{command}{dots}]"
 
         elif job_type=="running":
-            header.append( "Running jobs" )
-            header.append( "------------" )
+            header = [ "Running jobs",
+                       "------------" ]
             
             jobString = "{i:3d} - [jobid:{id}] [user:{user}] [status:running on {host} since {t}] [group:{group}] [info:{info}] [command:{command}{dots}]"
 
         elif job_type=="finished":
-            header.append( "Finished jobs" )
-            header.append( "------------" )
+            header = [ "Finished jobs",
+                       "------------" ]
             
             jobString = "{i:3d} - [jobid:{id}] [user:{user}] [status:finished since {t}] [group:{group}] [info:{info}] [command:{command}{dots}]"
+
+        # connect to database
+        dbconnection = hQDBConnection()
+
+        # time at which job entered its current status
+        since = select( [ func.max( db.JobHistory.datetime ) ] )\
+                .where( and_( db.JobHistory.job_id==db.Job.id,
+                              db.JobHistory.job_status_id==jobStatusID ) )\
+                .correlate( db.Job.__table__ )\
+                .as_scalar()\
+                .label( 'since' )
+
+        query = dbconnection.query( db.Job.id,
+                                    db.User.name,
+                                    db.Host.full_name,
+                                    since,
+                                    db.Job.group,
+                                    db.Job.info_text,
+                                    db.Job.command )\
+                .join( db.User, db.User.id==db.Job.user_id )\
+                .join( db.JobDetails, db.JobDetails.job_id==db.Job.id )\
+                .outerjoin( db.Host, db.Host.id==db.JobDetails.host_id )\
+                .filter( db.JobDetails.job_status_id==jobStatusID )\
+                .filter( db.Job.user_id==self.server.user_id )\
+                .order_by( since.desc() )
         
-        
-        for idx,job in enumerate(jobs):
-            response.append( jobString.format( i=idx,
-                                               id=job.id,
-                                               user=job.user.name,
-                                               t=str(job.job_history[-1].datetime),
-                                               group=job.group,
-                                               info=job.info_text,
-                                               command=job.command[:30],
-                                               dots="..." if len(job.command)>30 else "" ) )
-        return "\n".join( header + response )
+        if num!='all':
+            query = query.limit( int(num) )
+
+        try:
+            for idx,(jobID,userName,hostName,t,group,infoText,command) in enumerate( query.yield_per( 1000 ) ):
+                if idx==0:
+                    for line in header:
+                        yield line
+
+                yield jobString.format( i=idx,
+                                        id=jobID,
+                                        user=userName,
+                                        host=hostName,
+                                        t=str(t),
+                                        group=group,
+                                        info=infoText,
+                                        command=command[:30],
+                                        dots="..." if len(command)>30 else "" )
+        finally:
+            # rows are streamed from the connection until all lines have been sent
+            dbconnection.remove()
                 
 
     def process_lswjobs( self, request, num ):
@@ -670,9 +743,10 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
         
         rendered_response = self._render_job_list( num=num,
                                                    job_type='waiting' )
+        firstLine = next( rendered_response, None )
                              
-        if rendered_response:
-            request.send( rendered_response )
+        if firstLine is not None:
+            request.sendLines( chain( [ firstLine ], rendered_response ) )
         else:
             request.send("no waiting jobs")
 
@@ -683,9 +757,10 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
         
         rendered_response = self._render_job_list( num=num,
                                                    job_type='pending' )
+        firstLine = next( rendered_response, None )
                              
-        if rendered_response:
-            request.send( rendered_response )
+        if firstLine is not None:
+            request.sendLines( chain( [ firstLine ], rendered_response ) )
         else:
             request.send("no pending jobs")
 
@@ -696,9 +771,10 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
         
         rendered_response = self._render_job_list( num=num,
                                                    job_type='running' )
+        firstLine = next( rendered_response, None )
                              
-        if rendered_response:
-            request.send( rendered_response )
+        if firstLine is not None:
+            request.sendLines( chain( [ firstLine ], rendered_response ) )
         else:
             request.send("no running jobs")
 
@@ -709,13 +785,90 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
 
         rendered_response = self._render_job_list( num=num,
                                                    job_type='finished' )
+        firstLine = next( rendered_response, None )
                              
-        if rendered_response:
-            request.send( rendered_response )
+        if firstLine is not None:
+            request.sendLines( chain( [ firstLine ], rendered_response ) )
         else:
             request.send("no finished jobs")
 
                 
+    def _render_job_arrays( self ):
+        """ ! @brief helper function for lsarrays
+        """
+
+        # connect to database
+        dbconnection = hQDBConnection()
+
+        # job arrays with tasks which are not created yet or which are not finished yet
+        unfinishedArrayIDs = dbconnection.query( db.Job.array_id )\
+                             .join( db.JobDetails )\
+                             .filter( and_( db.Job.array_id!=None,
+                                            db.JobDetails.job_status_id.in_( [ self.server.database_ids[ s ] for s in ('waiting','pending','running') ] ) ) )\
+                             .distinct()\
+                             .subquery()
+        
+        query = dbconnection.query( db.JobArray )\
+                .filter( or_( db.JobArray.next_idx<=db.JobArray.last_idx,
+                              db.JobArray.id.in_( unfinishedArrayIDs ) ) )\
+                .filter( db.JobArray.user_id==self.server.user_id )\
+                .order_by( db.JobArray.id )
+
+        jobArrays = query.all()
+
+        if not jobArrays:
+            return ""
+        
+        # number of tasks in each status {<JobArray.id>: {<JobStatus.name>: <number of tasks>, ...}, ...}
+        counts = defaultdict( dict )
+        for arrayID,status,num in dbconnection.query( db.Job.array_id,
+                                                      db.JobStatus.name,
+                                                      func.count('*') )\
+                                   .join( db.JobDetails, db.JobDetails.job_id==db.Job.id )\
+                                   .join( db.JobStatus, db.JobStatus.id==db.JobDetails.job_status_id )\
+                                   .filter( db.Job.array_id.in_( [ a.id for a in jobArrays ] ) )\
+                                   .group_by( db.Job.array_id, db.JobStatus.name )\
+                                   .all():
+            counts[ arrayID ][ status ] = num
+
+        header = [ "Job arrays",
+                   "----------" ]
+        response = []
+
+        arrayString = "{i:3d} - [arrayid:{id}] [user:{user}] [tasks:{first}-{last}] [not created:{n}] [waiting:{w}] [pending:{p}] [running:{r}] [finished:{f}] [cancelled:{c}] [info:{info}] [command:{command}{dots}]"
+        
+        for idx,jobArray in enumerate(jobArrays):
+            c = counts[ jobArray.id ]
+            
+            response.append( arrayString.format( i=idx,
+                                                 id=jobArray.id,
+                                                 user=jobArray.user.name,
+                                                 first=jobArray.first_idx,
+                                                 last=jobArray.last_idx,
+                                                 n=jobArray.last_idx - jobArray.next_idx + 1,
+                                                 w=c.get( 'waiting', 0 ),
+                                                 p=c.get( 'pending', 0 ),
+                                                 r=c.get( 'running', 0 ),
+                                                 f=c.get( 'finished', 0 ),
+                                                 c=c.get( 'cancelled', 0 ),
+                                                 info=jobArray.info_text,
+                                                 command=jobArray.command[:30],
+                                                 dots="..." if len(jobArray.command)>30 else "" ) )
+        return "\n".join( header + response )
+                
+
+    def process_lsarrays( self, request ):
+        """ ! @brief process 'lsarrays' command
+        """
+        
+        rendered_response = self._render_job_arrays()
+                             
+        if rendered_response:
+            request.send( rendered_response )
+        else:
+            request.send("no job arrays")
+
+
     def process_lajob( self, request, job_id ):
         """ ! @brief process 'lajob' command
         """
@@ -725,6 +878,10 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
             
         job = dbconnection.query( db.Job ).get( int(job_id) )
 
+        if not job:
+            # job might have been archived
+            job = dbconnection.query( db.ArchivedJob ).get( int(job_id) )
+
         if job:
             response = ""
             response += "{s:>20} : {value}\n".format(s="job id", value=job.id )
@@ -849,9 +1006,12 @@ class hQUserServerRequestProcessor( hQBaseRequestProcessor ):
         # connect to database
         dbconnection = hQDBConnection()
 
-        jobs = dbconnection.query( db.Job ).filter( or_( db.Job.command.ilike( '%{s}%'.format(s=match_str) ),
-                                                         db.Job.info_text.ilike( '%{s}%'.format(s=match_str) ),
-                                                         db.Job.group.ilike( '%{s}%'.format(s=match_str) ) ) ).all()
+        # jobs which have been finished long ago are found in the archive
+        jobs = []
+        for model in (db.Job, db.ArchivedJob):
+            jobs += dbconnection.query( model ).filter( or_( model.command.ilike( '%{s}%'.format(s=match_str) ),
+                                                             model.info_text.ilike( '%{s}%'.format(s=match_str) ),
+                                                             model.group.ilike( '%{s}%'.format(s=match_str) ) ) ).all()
 
         response = []
         response.append( "Matching jobs" )
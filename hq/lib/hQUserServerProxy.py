@@ -6,6 +6,10 @@ from pprint import pprint as pp
 
 # import hq libraries
 from hq.lib.hQServerProxy import hQServerProxy
+from hq.lib.hQUtils import iter_ndjson_batches
+
+# number of jobs which are sent in a single message of a job stream
+STREAM_BATCH_SIZE = 1000
 
     
 class hQUserServerProxy( hQServerProxy ):
@@ -27,7 +31,10 @@ class hQUserServerProxy( hQServerProxy ):
     def add_jobs( self, job_list ):
         """! @brief add job to server
 
-        @param job_list (list) list of jobs represented as dictinary
+        jobs are streamed to the server in batches of STREAM_BATCH_SIZE jobs over a single
+        connection. job_list is consumed lazily.
+
+        @param job_list (iterable) list of jobs represented as dictinary
 
         """
 
@@ -39,36 +46,24 @@ class hQUserServerProxy( hQServerProxy ):
                              "stderr": "",
                              "shell": os.environ['SHELL'].split('/')[-1],
                              "priority": 0,
-                             "estimatedTime": 1,
+                             "estimatedTime": 0,
                              "estimatedMemory": 10,
-                             "excludedHosts": "" }
+                             "excludedHosts": "",
+                             "reservation": "",
+                             "dependencies": "",
+                             "array": "" }
 
-        jobs = []
-        # iterate over all jobs in job_list
         # update default dict by values given job
-        for idx,job in enumerate(job_list):
-            job_dict = copy( default_job_dict )
-            job_dict.update( job )
-
-            if job_dict['command']:
-                jobs.append( job_dict )
-            
-            # add maximal 100 jobs in a single request
-            if idx>0 and idx % 99 == 0:
-                # add jobs
-                jsonObj = json.dumps( jobs )
-
-                response = self.sendAndRecv( 'addjobs:%s' % jsonObj )
-
-                if self.verboseMode:
-                    print response
-                    
-                jobs = []
+        def iter_jobs():
+            for job in job_list:
+                job_dict = copy( default_job_dict )
+                job_dict.update( job )
 
-        if jobs:
-            jsonObj = json.dumps( jobs )
-            
-            response = self.sendAndRecv( 'addjobs:%s' % jsonObj )
+                if job_dict['command']:
+                    yield job_dict
 
+        # stream jobs in batches over a single connection
+        for response in self.sendStream( 'addjobstream',
+                                         iter_ndjson_batches( iter_jobs(), STREAM_BATCH_SIZE ) ):
             if self.verboseMode:
                 print response
@@ -10,6 +10,7 @@ import tempfile
 import subprocess
 import argparse
 import textwrap
+import json
 import sqlalchemy
 import sqlalchemy.orm
 from sqlalchemy.dialects import mysql
@@ -286,8 +287,88 @@ def getDefaultPort( user, bias=0, add=0 ):
 
     return defaultPort+add
     
+
+def read_cluster_table( fileName ):
+    """! @brief read hosts from a tab delimited cluster table such as etc/cluster.tab
+
+    The first line is a header and is skipped. Columns are: short_name, full_name,
+    total_number_slots, max_number_occupied_slots, additional_info, allow_info_server,
+    info_server_port, active[, total_memory]. Rows with a different number of columns are
+    skipped.
+
+    @param fileName (string) path to cluster table
+
+    @return (list) list of tuples (<host settings>,<host status>). host settings are the columns of
+            db.Host, host status is a dict {'active': bool}
+    """
+    defaultSettings = { 'full_name': '',
+                        'short_name': '',
+                        'total_number_slots': 0,
+                        'max_number_occupied_slots': 0,
+                        'additional_info': '',
+                        'allow_info_server': False,
+                        'info_server_port': 0,
+                        'total_memory': 0 }
+    defaultStatus = { 'active': False }
+
+    hosts = []
+    with open( fileName ) as f:
+        # skip first line
+        f.readline()
+
+        # iterate over all lines
+        for line in f:
+            line = line.strip("\n")
+            lineSplitted = line.split("\t")
+
+            # last column total_memory is optional
+            if len(line)>0 and len(lineSplitted) in (8,9):
+                settings = dict( filter( lambda s: s[1]!="", zip( ["short_name",
+                                                                   "full_name",
+                                                                   "total_number_slots",
+                                                                   "max_number_occupied_slots",
+                                                                   "additional_info",
+                                                                   "allow_info_server",
+                                                                   "info_server_port",
+                                                                   "active",
+                                                                   "total_memory"], lineSplitted ) ) )
+
+                # get host setting using dict comprehension, prefer settings from settings file
+                # automatically cast value to type of value given in defaultSettings
+                hostSettings = { key: type(defaultValue)(settings.get(key, defaultValue)) for key,defaultValue in defaultSettings.iteritems() }
+                hostStatus = { key: type(defaultValue)(settings.get(key, defaultValue)) for key,defaultValue in defaultStatus.iteritems() }
+
+                # memory in MB. no limit if not given
+                hostSettings['total_memory'] = hostSettings['total_memory'] or None
+
+                hosts.append( (hostSettings, hostStatus) )
+
+    return hosts
+
+
+def iter_ndjson_batches( items, batchSize ):
+    """! @brief split items into batches given as newline-delimited json
+
+    items are consumed lazily, i.e., at most batchSize items are kept in memory.
+
+    @param items (iterable) json serializable items, e.g., jobs given as dict
+    @param batchSize (int) max number of items in a batch
+
+    @return (generator) strings with one json encoded item in each line
+    """
+    batch = []
+    for item in items:
+        batch.append( json.dumps( item ) )
+
+        if len(batch)>=batchSize:
+            yield '\n'.join( batch )
+            batch = []
+
+    if batch:
+        yield '\n'.join( batch )
     
 
+
 class KillJobs(Thread):
     """kill jobs (in thread) with jobIDs by sending request to TMMS and wait"""
     def __init__(self,jobIDs,tmmsHost,tmmsPort,TMS):
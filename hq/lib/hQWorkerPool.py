@@ -0,0 +1,130 @@
+import sys
+import threading
+import traceback
+import Queue
+import time
+from datetime import datetime
+from collections import deque
+
+# number of recently executed tasks which are taken into account for the wait time statistics
+WAIT_TIME_WINDOW = 100
+
+
+class hQWorkerPool( object ):
+    """fixed number of worker threads which execute tasks from a bounded queue
+
+    In contrast to one thread per request, the number of threads and the number of waiting tasks
+    are limited, so that memory usage is predictable under load.
+
+    **Args**
+      | numWorkers (int): number of worker threads
+      | queueSize (int): max number of waiting tasks
+      | name (string): name of worker threads
+    """
+    def __init__( self, numWorkers, queueSize, name='worker' ):
+        self.numWorkers = numWorkers
+        self.name = name
+
+        self.tasks = Queue.Queue( maxsize=queueSize )
+        self.workers = []
+
+        # number of workers which are executing a task
+        self.numBusy = 0
+        self.lock = threading.Lock()
+
+        # number of tasks which have not been added because the queue was full
+        self.numRejected = 0
+
+        # time in seconds the recently executed tasks have waited in the queue
+        self.waitTimes = deque( maxlen=WAIT_TIME_WINDOW )
+
+
+    def start( self ):
+        """start worker threads"""
+        for idx in xrange( self.numWorkers ):
+            worker = threading.Thread( target=self.work )
+            worker.setDaemon( True )
+            worker.setName( "({name}) {i}".format( name=self.name, i=idx ) )
+            worker.started = datetime.now()
+            worker.start()
+
+            self.workers.append( worker )
+
+        return self
+
+
+    def submit( self, fct, *args ):
+        """add task to queue without blocking
+
+        **Args**
+          | fct (function): function which is executed by a worker
+          | args: arguments of function
+
+        **Returns**
+          bool: ``False`` if queue is full and task has not been added
+        """
+        try:
+            self.tasks.put_nowait( (fct,args,time.time()) )
+        except Queue.Full:
+            with self.lock:
+                self.numRejected += 1
+            return False
+
+        return True
+
+
+    def work( self ):
+        """execute tasks from queue. a task ``None`` stops the worker"""
+        while True:
+            task = self.tasks.get()
+
+            if task is None:
+                break
+
+            fct,args,submitted = task
+
+            with self.lock:
+                self.numBusy += 1
+                self.waitTimes.append( time.time()-submitted )
+
+            try:
+                fct( *args )
+            except:
+                traceback.print_exc( file=sys.stderr )
+            finally:
+                with self.lock:
+                    self.numBusy -= 1
+
+
+    def stop( self ):
+        """stop all workers after waiting tasks have been executed"""
+        for worker in self.workers:
+            self.tasks.put( None )
+
+
+    def qsize( self ):
+        """return number of waiting tasks"""
+        return self.tasks.qsize()
+
+
+    def get_stats( self ):
+        """get load of the pool
+
+        **Returns**
+          dict: number of workers (``workers``), busy workers (``busy``), waiting tasks
+          (``waiting``), max number of waiting tasks (``queueSize``), rejected tasks
+          (``rejected``) and mean and max wait time in seconds of the recently executed tasks
+          (``meanWait``, ``maxWait``)
+        """
+        with self.lock:
+            waitTimes = list( self.waitTimes )
+            busy = self.numBusy
+            rejected = self.numRejected
+
+        return { 'workers': self.numWorkers,
+                 'busy': busy,
+                 'waiting': self.qsize(),
+                 'queueSize': self.tasks.maxsize,
+                 'rejected': rejected,
+                 'meanWait': sum( waitTimes )/len( waitTimes ) if waitTimes else 0.,
+                 'maxWait': max( waitTimes ) if waitTimes else 0. }
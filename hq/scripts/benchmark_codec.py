@@ -0,0 +1,63 @@
+"""microbenchmark of the codecs for payloads of messages between the servers
+
+a batch of jobs as sent by hq-user-server with 'add' and a map of dispatched jobs as sent by
+hq-server with 'run' are encoded and decoded with each available codec.
+
+usage: python benchmark_codec.py [number of jobs]
+"""
+
+import sys
+import timeit
+
+from hq.lib.hQCodec import CODECS
+
+
+def job_batch( numJobs ):
+    """payload of 'add'"""
+    jobs = [ { 'command': 'sleep {i}; echo "job {i} done"'.format( i=idx ),
+               'slots': 1,
+               'group': 'benchmark',
+               'infoText': 'job {i} of benchmark'.format( i=idx ),
+               'estimatedTime': 10.,
+               'estimatedMemory': 100.,
+               'priority': 0,
+               'shell': 'bash',
+               'stdout': '/tmp/job.{i}.out'.format( i=idx ),
+               'stderr': '/tmp/job.{i}.err'.format( i=idx ) } for idx in xrange( numJobs ) ]
+
+    return { 'user_id': 1,
+             'host': 'localhost',
+             'port': 1234,
+             'id': '1234567890.12',
+             'jobs': jobs }
+
+
+def dispatch_map( numJobs, numHosts=100 ):
+    """payload of 'run'"""
+    return dict( ( hostID, { 'host_id': hostID,
+                             'host_full_name': 'host{i}.cluster.local'.format( i=hostID ),
+                             'jobs': range( hostID, numJobs, numHosts ) } ) for hostID in xrange( numHosts ) )
+
+
+if __name__ == '__main__':
+    numJobs = int( sys.argv[1] ) if len( sys.argv )>1 else 10000
+    rounds = 10
+
+    for name,payload in [ ('add', job_batch( numJobs )),
+                          ('run', dispatch_map( numJobs )) ]:
+        print "payload of '{p}' with {n} jobs".format( p=name, n=numJobs )
+
+        for codecName,codec in sorted( CODECS.items() ):
+            data = codec.dumps( payload )
+
+            tEncode = timeit.timeit( lambda: codec.dumps( payload ), number=rounds )/rounds
+            tDecode = timeit.timeit( lambda: codec.loads( data ), number=rounds )/rounds
+
+            print "{c:>20} : {s:8.1f} kB, encode {e:7.2f} ms, decode {d:7.2f} ms".format( c=codecName,
+                                                                                           s=len( data )/1024.,
+                                                                                           e=1000*tEncode,
+                                                                                           d=1000*tDecode )
+        print
+
+    if len( CODECS )==1:
+        print "only json is available. install the python package msgpack for a binary codec."
@@ -0,0 +1,68 @@
+"""microbenchmark of the command dispatch of the request processors
+
+each command of hq-server and hq-user-server is looked up with the dispatch table of
+hQBaseRequestProcessor.match_command and, for comparison, with a linear scan over all commands
+which matches each regular expression and matches the found command once more for the arguments.
+
+usage: python benchmark_dispatch.py [number of rounds]
+"""
+
+import sys
+import timeit
+
+from hq.lib.hQServer import hQRequestProcessor
+from hq.lib.hQUserServer import hQUserServerRequestProcessor
+
+
+def linear_scan( processor, requestStr ):
+    """find command as done before the dispatch table"""
+    try:
+        cmd = next( cmd for cmd_str,cmd in processor.commands.iteritems() if cmd.match( requestStr ) )
+    except StopIteration:
+        return None,None
+
+    return cmd,cmd.groups( requestStr )
+
+
+def requests_of( processor ):
+    """construct a request for each command of processor"""
+    requests = []
+    for cmd in processor.commands.itervalues():
+        requestStr = cmd.name
+        for idx,argument in enumerate( cmd.arguments ):
+            requestStr += ":{a}".format( a=idx+1 )
+        requests.append( requestStr )
+
+    # unknown command
+    requests.append( "unknowncommand:1" )
+
+    return sorted( requests )
+
+
+if __name__ == '__main__':
+    rounds = int( sys.argv[1] ) if len( sys.argv )>1 else 1000
+
+    for name,processor in [ ('hq-server', hQRequestProcessor()),
+                            ('hq-user-server', hQUserServerRequestProcessor()) ]:
+        requests = requests_of( processor )
+
+        # both lookups have to find the same commands
+        for requestStr in requests:
+            cmd,groups = linear_scan( processor, requestStr )
+            matchedCmd,match = processor.match_command( requestStr )
+
+            if cmd is not matchedCmd:
+                print "{s}: '{r}' is dispatched to '{c1}' instead of '{c2}'".format( s=name,
+                                                                                    r=requestStr,
+                                                                                    c1=matchedCmd.name if matchedCmd else None,
+                                                                                    c2=cmd.name if cmd else None )
+
+        tScan = timeit.timeit( lambda: [ linear_scan( processor, r ) for r in requests ], number=rounds )
+        tTable = timeit.timeit( lambda: [ processor.match_command( r ) for r in requests ], number=rounds )
+
+        numLookups = rounds*len( requests )
+
+        print "{s} ({n} commands)".format( s=name, n=len( processor.commands ) )
+        print "{t:>20} : {v:.2f} us per request".format( t='linear scan', v=1e6*tScan/numLookups )
+        print "{t:>20} : {v:.2f} us per request".format( t='dispatch table', v=1e6*tTable/numLookups )
+        print
@@ -0,0 +1,217 @@
+"""benchmark of the hot queries of the servers with and without the indexes of hQDatabase
+
+a SQLite database with a generated cluster and job history is created. the queries for
+  - the number of jobs per status (get_status)
+  - the waiting jobs of highest priority (scheduler)
+  - the jobs with the latest status changes (_render_job_list)
+  - the time of a status change of a job (scheduler)
+  - the latest load of each host (hQHostCapacityIndex)
+  - the groups of a user and their number of jobs per status (lsgroups)
+  - a host by its full name
+are run without any indexes besides primary keys and with the indexes defined in the models. the
+query plan of SQLite and the time per query are printed.
+
+usage: python benchmark_indexes.py [number of jobs]
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+import sqlalchemy
+import sqlalchemy.orm
+from sqlalchemy import func
+
+import hq.lib.hQDatabase as db
+
+
+STATUS = [ 'waiting', 'pending', 'running', 'finished', 'blocked', 'cancelled' ]
+NUM_USERS = 50
+NUM_HOSTS = 200
+NUM_LOADS = 100		# number of load entries per host
+NUM_GROUPS = 20		# number of groups per user
+
+
+def populate( engine, numJobs ):
+    """fill database with users, hosts, their load and jobs with their history"""
+    random.seed( 1 )
+    start = datetime( 2020, 1, 1 )
+
+    con = engine.connect()
+
+    def insert( table, rows ):
+        for idx in xrange( 0, len( rows ), 10000 ):
+            con.execute( table.insert(), rows[ idx:idx+10000 ] )
+
+    insert( db.JobStatus.__table__, [ { 'id': idx+1, 'name': name } for idx,name in enumerate( STATUS ) ] )
+    insert( db.Priority.__table__, [ { 'id': 1, 'value': 0 } ] )
+    insert( db.User.__table__, [ { 'id': idx+1, 'name': 'user{i}'.format( i=idx ), 'enabled': True } for idx in xrange( NUM_USERS ) ] )
+    insert( db.Host.__table__, [ { 'id': idx+1,
+                                   'full_name': 'host{i}.cluster.local'.format( i=idx ),
+                                   'short_name': 'host{i}'.format( i=idx ),
+                                   'total_number_slots': 16,
+                                   'max_number_occupied_slots': 16 } for idx in xrange( NUM_HOSTS ) ] )
+    insert( db.HostSummary.__table__, [ { 'host_id': idx+1,
+                                          'available': True,
+                                          'reachable': True,
+                                          'active': True } for idx in xrange( NUM_HOSTS ) ] )
+    insert( db.HostLoad.__table__, [ { 'host_id': hostID+1,
+                                       'datetime': start+timedelta( minutes=idx ),
+                                       'loadavg_1min': random.random() } for idx in xrange( NUM_LOADS ) for hostID in xrange( NUM_HOSTS ) ] )
+
+    jobs = []
+    details = []
+    history = []
+    waiting = []
+    for jobID in xrange( 1, numJobs+1 ):
+        userID = random.randint( 1, NUM_USERS )
+
+        # most of the jobs have been finished
+        statusID = 4 if random.random()<0.9 else random.randint( 1, 3 )
+        submitted = start+timedelta( seconds=jobID )
+
+        jobs.append( { 'id': jobID,
+                       'user_id': userID,
+                       'command': 'sleep 1',
+                       'group': 'group{i}'.format( i=random.randint( 1, NUM_GROUPS ) ),
+                       'priority_id': 1 } )
+        details.append( { 'job_id': jobID,
+                          'job_status_id': statusID,
+                          'host_id': random.randint( 1, NUM_HOSTS ) if statusID>1 else None } )
+
+        # waiting -> pending -> running -> finished
+        for s in xrange( 1, statusID+1 ):
+            history.append( { 'job_id': jobID,
+                              'job_status_id': s,
+                              'datetime': submitted+timedelta( seconds=s ) } )
+
+        if statusID==1:
+            waiting.append( { 'job_id': jobID,
+                              'user_id': userID,
+                              'priorityValue': random.random() } )
+
+    insert( db.Job.__table__, jobs )
+    insert( db.JobDetails.__table__, details )
+    insert( db.JobHistory.__table__, history )
+    insert( db.WaitingJob.__table__, waiting )
+
+    con.close()
+
+    return len( history )
+
+
+def hot_queries( session, numJobs ):
+    """hot queries of the servers as (name, query)"""
+    jobID = numJobs/2
+
+    # time of latest load of each host
+    latestLoad = session.query( db.HostLoad.host_id,
+                                func.max( db.HostLoad.datetime ).label( 'datetime' ) )\
+                 .group_by( db.HostLoad.host_id )\
+                 .subquery()
+
+    # time at which finished jobs have been finished (_render_job_list)
+    since = sqlalchemy.select( [ func.max( db.JobHistory.datetime ) ] )\
+            .where( sqlalchemy.and_( db.JobHistory.job_id==db.Job.id,
+                                     db.JobHistory.job_status_id==4 ) )\
+            .correlate( db.Job.__table__ )\
+            .as_scalar()\
+            .label( 'since' )
+
+    return [ ('get_status', session.query( db.JobStatus.name, func.count('*') )\
+                            .join( db.JobDetails )\
+                            .group_by( db.JobStatus.name )),
+             ('get_status of user', session.query( db.JobStatus.name, func.count('*') )\
+                                    .join( db.JobDetails )\
+                                    .join( db.Job )\
+                                    .filter( db.Job.user_id==1 )\
+                                    .group_by( db.JobStatus.name )),
+             ('waiting jobs', session.query( db.WaitingJob )\
+                              .join( db.User )\
+                              .filter( db.User.enabled==True )\
+                              .order_by( db.WaitingJob.priorityValue.desc() )\
+                              .limit( 100 )),
+             ('lsfjobs', session.query( db.Job.id, db.User.name, db.Host.full_name, since, db.Job.command )\
+                         .join( db.User, db.User.id==db.Job.user_id )\
+                         .join( db.JobDetails, db.JobDetails.job_id==db.Job.id )\
+                         .outerjoin( db.Host, db.Host.id==db.JobDetails.host_id )\
+                         .filter( db.JobDetails.job_status_id==4 )\
+                         .order_by( since.desc() )\
+                         .limit( 10 )),
+             ('status change of job', session.query( func.max( db.JobHistory.datetime ) )\
+                                      .filter( db.JobHistory.job_id==jobID )\
+                                      .filter( db.JobHistory.job_status_id==3 )),
+             ('latest host load', session.query( db.HostLoad.host_id, db.HostLoad.loadavg_1min )\
+                                  .join( latestLoad, sqlalchemy.and_( db.HostLoad.host_id==latestLoad.c.host_id,
+                                                                      db.HostLoad.datetime==latestLoad.c.datetime ) )),
+             ('lsgroups', session.query( db.Job.group )\
+                          .filter( db.Job.user_id==1 )\
+                          .distinct()),
+             ('lagroup', session.query( db.JobStatus.name, func.count('*') )\
+                         .join( db.JobDetails, db.JobDetails.job_status_id==db.JobStatus.id )\
+                         .join( db.Job, db.Job.id==db.JobDetails.job_id )\
+                         .filter( sqlalchemy.and_( db.Job.user_id==1, db.Job.group=='group1' ) )\
+                         .group_by( db.JobStatus.name )),
+             ('host by name', session.query( db.Host )\
+                              .filter( db.Host.full_name=='host{i}.cluster.local'.format( i=NUM_HOSTS/2 ) )) ]
+
+
+def query_plan( engine, query ):
+    """query plan of SQLite as list of strings"""
+    sql = str( query.statement.compile( dialect=engine.dialect, compile_kwargs={ 'literal_binds': True } ) )
+
+    return [ row[-1] for row in engine.execute( "EXPLAIN QUERY PLAN " + sql ) ]
+
+
+def run( engine, session, numJobs, rounds ):
+    """print plan and time of each hot query"""
+    for name,query in hot_queries( session, numJobs ):
+        t = timeit.timeit( lambda: query.all(), number=rounds )/rounds
+
+        print "{t:>25} : {v:9.3f} ms per query".format( t=name, v=1000*t )
+        for step in query_plan( engine, query ):
+            print "{t:>25}   {s}".format( t='', s=step )
+
+
+if __name__ == '__main__':
+    numJobs = int( sys.argv[1] ) if len( sys.argv )>1 else 200000
+    rounds = 5
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        engine = sqlalchemy.create_engine( "sqlite:///{d}/hq.db".format( d=tmpDir ) )
+        session = sqlalchemy.orm.sessionmaker( bind=engine )()
+
+        db.Base.metadata.create_all( bind=engine )
+
+        indexes = [ index for table in db.Base.metadata.sorted_tables for index in table.indexes ]
+
+        # fill tables without indexes
+        for index in indexes:
+            index.drop( bind=engine )
+
+        numHistory = populate( engine, numJobs )
+
+        print "{n} jobs, {h} job history entries, {l} host load entries".format( n=numJobs,
+                                                                                   h=numHistory,
+                                                                                   l=NUM_HOSTS*NUM_LOADS )
+        print
+
+        print "without indexes"
+        engine.execute( "ANALYZE" )
+        run( engine, session, numJobs, rounds )
+        print
+
+        for index in indexes:
+            index.create( bind=engine )
+
+        print "with indexes"
+        engine.execute( "ANALYZE" )
+        run( engine, session, numJobs, rounds )
+    finally:
+        session.close()
+        shutil.rmtree( tmpDir )
@@ -0,0 +1,93 @@
+"""benchmark of concurrent transactions on the local SQLite database
+
+a SQLite database with the tables of hq is created in a temporary directory. several processes
+add jobs, each in its own transaction which reads the user and the priority before writing the
+job, its details and its history, as hq-server does. the number of transactions per second and
+the number of failed transactions are printed.
+
+usage: python benchmark_sqlite.py [number of processes] [number of transactions per process]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import multiprocessing
+import time
+
+
+def add_jobs( numTransactions ):
+    """add jobs in separate transactions and return number of failed transactions"""
+    # the engine is created in each process
+    import hq.lib.hQDatabase as db
+    from hq.lib.hQDBConnection import hQDBConnection
+
+    errors = 0
+    for idx in xrange( numTransactions ):
+        # transactions read before they write and take the write lock right away
+        dbconnection = hQDBConnection( writer=True )
+        try:
+            user = dbconnection.query( db.User ).first()
+            priority = dbconnection.query( db.Priority ).first()
+
+            job = db.Job( user_id=user.id,
+                          command='sleep 1',
+                          slots=1,
+                          priority_id=priority.id,
+                          shell='bash' )
+            dbconnection.introduce( job,
+                                    db.JobDetails( job=job, job_status_id=1 ),
+                                    db.JobHistory( job=job, job_status_id=1 ) )
+            dbconnection.commit()
+        except Exception:
+            errors += 1
+            dbconnection.session.rollback()
+        finally:
+            dbconnection.remove()
+
+    return errors
+
+
+if __name__ == '__main__':
+    numProcesses = int( sys.argv[1] ) if len( sys.argv )>1 else 8
+    numTransactions = int( sys.argv[2] ) if len( sys.argv )>2 else 200
+
+    tmpDir = tempfile.mkdtemp()
+    try:
+        os.makedirs( os.path.join( tmpDir, 'etc' ) )
+        os.makedirs( os.path.join( tmpDir, 'var' ) )
+        with open( os.path.join( tmpDir, 'etc', 'hq-db.cfg' ), 'w' ) as f:
+            f.write( "[DATABASE]\ndatabase_dialect: sqlite\ndatabase_name: hq.db\n" )
+
+        os.environ['HQPATH'] = tmpDir
+
+        import hq.lib.hQDatabase as db
+        from hq.lib.hQDBConnection import hQDBConnection
+
+        dbconnection = hQDBConnection()
+        dbconnection.create_all_tables()
+        dbconnection.introduce( db.JobStatus( id=1, name='waiting' ),
+                                db.User( name='benchmark', enabled=True ),
+                                db.Priority( value=0 ) )
+        dbconnection.commit()
+        dbconnection.remove()
+
+        t = time.time()
+        pool = multiprocessing.Pool( numProcesses )
+        errors = sum( pool.map( add_jobs, [ numTransactions ]*numProcesses ) )
+        pool.close()
+        dt = time.time()-t
+
+        dbconnection = hQDBConnection()
+        journalMode = dbconnection.session.execute( "PRAGMA journal_mode" ).scalar()
+        numJobs = dbconnection.query( db.Job ).count()
+        dbconnection.remove()
+
+        print "{p} processes with {n} transactions each (journal mode {j})".format( p=numProcesses,
+                                                                                    n=numTransactions,
+                                                                                    j=journalMode )
+        print "{t:>20} : {v}".format( t='added jobs', v=numJobs )
+        print "{t:>20} : {v}".format( t='failed transactions', v=errors )
+        print "{t:>20} : {v:.1f}".format( t='transactions per s', v=numProcesses*numTransactions/dt )
+    finally:
+        shutil.rmtree( tmpDir )
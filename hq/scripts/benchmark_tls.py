@@ -0,0 +1,134 @@
+"""microbenchmark of the cost of TLS handshakes per request
+
+a local server answers each request on a TLS connection. requests are sent
+  - over a new connection with a new ssl context per connection (certificates are loaded for
+    each connection)
+  - over a new connection with the ssl context which is shared by the process
+  - over a single persistent connection
+
+a self-signed certificate is created with openssl if no certificate is given.
+
+usage: python benchmark_tls.py [number of requests] [certfile keyfile]
+"""
+
+import os
+import sys
+import socket
+import ssl
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from hq.lib.hQSocket import get_ssl_context
+
+
+def create_certificate( directory ):
+    """create self-signed certificate and key"""
+    certfile = os.path.join( directory, 'cert.pem' )
+    keyfile = os.path.join( directory, 'key.pem' )
+
+    with open( os.devnull, 'w' ) as devnull:
+        subprocess.check_call( [ 'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                                 '-subj', '/CN=localhost', '-days', '1',
+                                 '-keyout', keyfile, '-out', certfile ],
+                               stdout=devnull, stderr=devnull )
+
+    return certfile,keyfile
+
+
+def serve( listenSocket, context ):
+    """answer each request until client closes connection"""
+    while True:
+        try:
+            sock,address = listenSocket.accept()
+        except socket.error:
+            break
+
+        sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+        thread = threading.Thread( target=answer, args=(context.wrap_socket( sock, server_side=True ),) )
+        thread.setDaemon( True )
+        thread.start()
+
+
+def answer( sock ):
+    try:
+        while sock.recv( 1024 ):
+            sock.sendall( 'pong' )
+    except socket.error:
+        pass
+    finally:
+        sock.close()
+
+
+def request( sock ):
+    sock.sendall( 'ping' )
+    sock.recv( 1024 )
+
+
+def connect( address, context ):
+    sock = socket.create_connection( address )
+    sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+    return context.wrap_socket( sock )
+
+
+def new_context( certfile ):
+    """client context as created before the shared contexts"""
+    context = ssl.SSLContext( ssl.PROTOCOL_SSLv23 )
+    context.load_verify_locations( certfile )
+    context.verify_mode = ssl.CERT_REQUIRED
+    return context
+
+
+if __name__ == '__main__':
+    numRequests = int( sys.argv[1] ) if len( sys.argv )>1 else 200
+
+    tmpDir = None
+    if len( sys.argv )>3:
+        certfile,keyfile = sys.argv[2:4]
+    else:
+        tmpDir = tempfile.mkdtemp()
+        certfile,keyfile = create_certificate( tmpDir )
+
+    try:
+        listenSocket = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        listenSocket.bind( ('127.0.0.1', 0) )
+        listenSocket.listen( 128 )
+        address = listenSocket.getsockname()
+
+        serverThread = threading.Thread( target=serve, args=(listenSocket, get_ssl_context( True, certfile, keyfile )) )
+        serverThread.setDaemon( True )
+        serverThread.start()
+
+        def _new_context():
+            for idx in xrange( numRequests ):
+                sock = connect( address, new_context( certfile ) )
+                request( sock )
+                sock.close()
+
+        def _shared_context():
+            for idx in xrange( numRequests ):
+                sock = connect( address, get_ssl_context( False, ca_certs=certfile ) )
+                request( sock )
+                sock.close()
+
+        def _persistent():
+            sock = connect( address, get_ssl_context( False, ca_certs=certfile ) )
+            for idx in xrange( numRequests ):
+                request( sock )
+            sock.close()
+
+        print "{n} requests with TLS ({v})".format( n=numRequests, v=ssl.OPENSSL_VERSION )
+        for name,fct in [ ('new context', _new_context),
+                          ('shared context', _shared_context),
+                          ('persistent', _persistent) ]:
+            t = time.time()
+            fct()
+            dt = time.time()-t
+
+            print "{t:>20} : {v:.3f} ms per request".format( t=name, v=1000*dt/numRequests )
+    finally:
+        if tmpDir:
+            shutil.rmtree( tmpDir )